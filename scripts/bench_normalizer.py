@@ -0,0 +1,81 @@
+"""
+Microbenchmark for text normalization.
+
+Compares the normalizer in src/normalizer.py with the expression it
+replaced, ' '.join(text.split()).lower(), on the text of the given PDFs
+(or on generated text when none are given). Each text is a fresh string
+per run, so the normalizer's one-entry cache never hits.
+
+Usage:
+    python scripts/bench_normalizer.py [file.pdf ...] [--repeat 20]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.normalizer import normalize_text
+
+
+def legacy_normalize_text(text):
+    """The normalization used before src/normalizer.py."""
+    return ' '.join(text.split()).lower()
+
+
+def sample_texts():
+    """
+    Generated page texts: plain ASCII, the same with ligatures, soft hyphens
+    and hyphenated line breaks, and Cyrillic and Greek text, where almost
+    every character is non-ASCII.
+    """
+    line = "Terms and Conditions of Employment for the financial year, clause {}\n"
+    plain = "".join(line.format(i) for i in range(2000))
+    messy = plain.replace("fi", "ﬁ").replace("Employment", "Employ-\nment").replace("year", "ye\u00adar")
+    cyrillic = "".join("Условия трудового договора на финансовый год, пункт {}\n".format(i) for i in range(2000))
+    greek = "".join("Όροι και Προϋποθέσεις Απασχόλησης για το οικονομικό έτος, άρθρο {}\n".format(i) for i in range(2000))
+    return {"ascii": plain, "ligatures/hyphens": messy, "cyrillic": cyrillic, "greek": greek}
+
+
+def pdf_texts(paths):
+    """The full text layer of each PDF, by file name."""
+    import fitz
+    texts = {}
+    for path in paths:
+        with fitz.open(path) as doc:
+            texts[os.path.basename(path)] = "".join(page.get_text() for page in doc)
+    return texts
+
+
+def time_per_call(function, text, repeat):
+    """Returns the best seconds per call over repeat calls, each on a fresh copy of the text."""
+    # Slicing off a prefix makes a new string object with the same text.
+    copies = [(" " + text)[1:] for _ in range(repeat)]
+    function("warm up é")  # E.g. builds the normalizer's table.
+    best = float("inf")
+    for copy in copies:
+        start = time.perf_counter()
+        function(copy)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the text normalizer with the old whitespace/lowercase fold")
+    parser.add_argument("pdfs", nargs="*", help="PDFs whose text to normalize (default: generated text)")
+    parser.add_argument("--repeat", type=int, default=20, help="Calls per text (default 20)")
+    args = parser.parse_args()
+
+    texts = pdf_texts(args.pdfs) if args.pdfs else sample_texts()
+    print(f"{'text':<24} {'chars':>9} {'old ms':>8} {'new ms':>8} {'ratio':>6}")
+    for name, text in texts.items():
+        old = time_per_call(legacy_normalize_text, text, args.repeat)
+        new = time_per_call(normalize_text, text, args.repeat)
+        print(f"{name[:24]:<24} {len(text):>9} {old * 1000:>8.2f} {new * 1000:>8.2f} {new / old if old else 0:>6.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
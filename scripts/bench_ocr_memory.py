@@ -0,0 +1,157 @@
+"""
+Memory benchmark for handing rendered pages to Tesseract.
+
+Compares the PIL hand-off (Image.frombytes, then pytesseract writing a
+temporary image file) with the zero-copy hand-off (the pixmap's sample
+buffer piped to Tesseract as PNM). Each mode runs in its own process so its
+peak resident set size is measured in isolation; the figure reported is the
+peak above the baseline taken after opening the PDF, i.e. the memory one
+page in flight costs.
+
+Usage:
+    python scripts/bench_ocr_memory.py scan.pdf [--pages 5] [--dpi 300] [--gray]
+    python scripts/bench_ocr_memory.py scan.pdf --handoff-only
+
+--handoff-only skips Tesseract and only performs each mode's copies and
+encoding, for machines without Tesseract installed.
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODES = ("pil", "zero-copy")
+
+
+def peak_rss_bytes():
+    """Returns the peak resident set size of this process in bytes."""
+    try:
+        import resource
+    except ImportError:
+        return _windows_peak_working_set()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _windows_peak_working_set():
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    handle = ctypes.windll.kernel32.GetCurrentProcess()
+    ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb)
+    return counters.PeakWorkingSetSize
+
+
+def _handoff_pil(pix):
+    """The copies the PIL path makes, without running Tesseract."""
+    from PIL import Image
+    mode = "L" if pix.n == 1 else "RGB"
+    img = Image.frombytes(mode, [pix.width, pix.height], pix.samples)
+    with tempfile.TemporaryFile() as f:
+        img.save(f, format="PNG")
+
+
+def _handoff_zero_copy(pix):
+    """The writes the zero-copy path makes, without running Tesseract."""
+    from src import ocr
+    with open(os.devnull, "wb") as sink:
+        sink.write(ocr.pnm_header(pix))
+        sink.write(pix.samples_mv)
+
+
+def run_mode(pdf_path, mode, pages, dpi, gray, handoff_only):
+    """Runs one mode in this process and returns its measurements."""
+    import fitz
+    from src import ocr
+
+    engine = ocr.OcrEngine(zero_copy=mode == "zero-copy")
+    colorspace = fitz.csGRAY if gray else fitz.csRGB
+    with fitz.open(pdf_path) as doc:
+        count = min(pages, doc.page_count)
+        baseline = peak_rss_bytes()
+        start = time.perf_counter()
+        for index in range(count):
+            page = doc[index]
+            if handoff_only:
+                pix = page.get_pixmap(dpi=dpi, colorspace=colorspace)
+                if mode == "zero-copy":
+                    _handoff_zero_copy(pix)
+                else:
+                    _handoff_pil(pix)
+                del pix
+            elif gray:
+                engine._read_gray(page, dpi)
+            else:
+                engine._read_rgb(page, dpi)
+        elapsed = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "pages": count,
+        "baseline_mb": baseline / 2**20,
+        "peak_mb": peak_rss_bytes() / 2**20,
+        "per_page_peak_mb": (peak_rss_bytes() - baseline) / 2**20,
+        "seconds_per_page": elapsed / max(1, count),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure peak RSS per page for the OCR hand-off modes")
+    parser.add_argument("pdf", help="PDF to render (scanned pages show the difference best)")
+    parser.add_argument("--pages", type=int, default=5, help="Number of pages to read (default 5)")
+    parser.add_argument("--dpi", type=int, default=300, help="Render resolution (default 300)")
+    parser.add_argument("--gray", action="store_true", help="Render in grayscale, as adaptive OCR does")
+    parser.add_argument("--handoff-only", action="store_true", help="Skip Tesseract; measure only the hand-off")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        result = run_mode(args.pdf, args.mode, args.pages, args.dpi, args.gray, args.handoff_only)
+        print(json.dumps(result))
+        return
+
+    results = []
+    for mode in MODES:
+        cmd = [sys.executable, os.path.abspath(__file__), args.pdf, "--mode", mode,
+               "--pages", str(args.pages), "--dpi", str(args.dpi)]
+        if args.gray:
+            cmd.append("--gray")
+        if args.handoff_only:
+            cmd.append("--handoff-only")
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"{mode} failed:\n{proc.stderr}")
+            return 1
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    print(f"{'mode':<10} {'pages':>5} {'baseline MB':>12} {'peak MB':>9} {'per-page MB':>12} {'s/page':>8}")
+    for r in results:
+        print(f"{r['mode']:<10} {r['pages']:>5} {r['baseline_mb']:>12.1f} {r['peak_mb']:>9.1f} "
+              f"{r['per_page_peak_mb']:>12.1f} {r['seconds_per_page']:>8.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
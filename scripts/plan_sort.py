@@ -0,0 +1,60 @@
+"""
+Plan a sort, review it, then apply it.
+
+    python scripts/plan_sort.py plan mapping.json plan.jsonl folder [folder ...]
+    python scripts/plan_sort.py apply plan.jsonl [--workers 8] [--no-verify]
+
+"plan" classifies every PDF in the folders and writes one JSON line per
+document (source, dest, rule, hash) without moving anything; "apply" moves
+the files as planned and can be re-run safely. See src/planner.py.
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import ocr, planner, sorter, text_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan a sort without moving files, then apply the plan")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    plan = commands.add_parser("plan", help="Classify the PDFs in the folders and write a plan")
+    plan.add_argument("mapping", help="Mapping JSON file")
+    plan.add_argument("plan", help="Plan file to write")
+    plan.add_argument("folders", nargs="+", help="Folders whose PDFs to plan")
+    plan.add_argument("--first-page-only", action="store_true", help="Only read the first page of each PDF")
+    plan.add_argument("--workers", type=int, default=None, help="OCR worker processes (default: one per CPU)")
+    plan.add_argument("--no-cache", action="store_true", help="Do not use the text cache")
+
+    apply = commands.add_parser("apply", help="Move files as a plan says")
+    apply.add_argument("plan", help="Plan file written by 'plan'")
+    apply.add_argument("--workers", type=int, default=planner.DEFAULT_APPLY_WORKERS, help="Parallel renames")
+    apply.add_argument("--no-verify", action="store_true", help="Do not check each file's hash before moving it")
+    args = parser.parse_args()
+
+    cache = None if getattr(args, "no_cache", False) else text_cache.TextCache()
+    try:
+        if args.command == "plan":
+            sorter_obj = sorter.Sorter(args.mapping, status_callback=print, text_cache=cache,
+                                       ocr_engine=ocr.OcrEngine(adaptive=True, workers=args.workers, batch_size=8))
+            try:
+                planner.write_plan(sorter_obj, args.folders, args.plan, first_page_only=args.first_page_only)
+            finally:
+                sorter_obj.close()
+        else:
+            counts = planner.apply_plan(args.plan, workers=args.workers, verify=not args.no_verify,
+                                        cache=cache, status_callback=print)
+            if counts[planner.OUTCOME_FAILED] or counts[planner.OUTCOME_CHANGED] or counts[planner.OUTCOME_CONFLICT]:
+                return 1
+    finally:
+        if cache is not None:
+            cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""
+Sort PDFs as they arrive in hot folders, without the GUI.
+
+    python scripts/watch_folders.py mapping.json folder [folder ...] [--settle 2] [--first-page-only]
+
+Runs until interrupted (Ctrl+C). See src/watcher.py.
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import ocr, preprocess, sorter, template_index, text_cache, watcher
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch folders and sort new PDFs as they arrive")
+    parser.add_argument("mapping", help="Mapping JSON file")
+    parser.add_argument("folders", nargs="+", help="Folders to watch")
+    parser.add_argument("--settle", type=float, default=watcher.DEFAULT_SETTLE_SECONDS,
+                        help="Seconds a file must stop changing before it is sorted")
+    parser.add_argument("--poll", type=float, default=watcher.DEFAULT_POLL_INTERVAL,
+                        help="Seconds between folder scans when polling")
+    parser.add_argument("--no-inotify", action="store_true", help="Always poll, e.g. for network shares")
+    parser.add_argument("--first-page-only", action="store_true", help="Only read the first page of each PDF")
+    parser.add_argument("--workers", type=int, default=None, help="OCR worker processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    cache = text_cache.TextCache()
+    sorter_obj = sorter.Sorter(args.mapping, status_callback=print, text_cache=cache, incremental=True,
+                               ocr_engine=ocr.OcrEngine(adaptive=True, workers=args.workers, batch_size=8,
+                                                        blank_detector=preprocess.BlankPageDetector()))
+    index = template_index.TemplateIndex(sorter_obj.template_dir)
+    sorter_obj.template_index = index
+    folder_watcher = watcher.FolderWatcher(sorter_obj, args.folders, settle_seconds=args.settle, poll_interval=args.poll,
+                                           use_inotify=not args.no_inotify, first_page_only=args.first_page_only)
+    try:
+        folder_watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sorter_obj.close()
+        index.close()
+        cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
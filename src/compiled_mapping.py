@@ -0,0 +1,367 @@
+"""
+Compiled mapping files.
+
+Parsing a mapping, migrating the old format and building the phrase matcher
+is repeated by every Sorter. The compiled result is therefore pickled into
+the per-user cache directory (see text_cache.user_cache_dir) and keyed by a
+hash of the JSON content, so later runs and worker processes can load it
+directly. Editing the JSON changes the hash, which makes the next load
+rebuild the artifact. Artifacts are never kept next to the mapping: mappings
+may live on a shared folder, and unpickling a file planted there would run
+its code.
+
+Filename and metadata rules are kept apart, so they can be checked before
+any page is read. Rules limited to a page region (see
+MappingUtils.get_rule_scope) are grouped by region, each group with its own
+matcher, so the Sorter can read just those regions. The remaining rules are
+matched against the whole text: phrases through one matcher, expression
+rules through their compiled plans (see src/rules.py). Phrases of rules
+with a "max_distance" also get an approximate matcher, used when the Sorter
+runs in approximate mode.
+"""
+
+import os
+import re
+import json
+import pickle
+import bisect
+import hashlib
+
+from src import utils
+from src import matcher
+from src import text_cache
+from src import rules as rule_expressions
+
+# Bump whenever the compiled layout or the phrase normalization changes so
+# artifacts written by older code are ignored.
+COMPILED_FORMAT_VERSION = 7
+CACHE_DIR_NAME = "compiled"
+CACHE_EXTENSION = ".pickle"
+
+
+class CompiledMapping:
+    """
+    The ready-to-match form of a mapping: the rules in order, their
+    normalized phrases and destinations, and the phrase matcher.
+    """
+
+    def __init__(self, rules, digest=None):
+        self.rules = rules
+        self.digest = digest
+        self.version = COMPILED_FORMAT_VERSION
+        self.keys = list(rules)
+        self.dests = [utils.MappingUtils.get_rule_dest(rule) for rule in rules.values()]
+        self.matcher = matcher.PhraseMatcher.from_mapping(rules)
+
+        phrases = self.matcher.phrases
+        scoped = {}
+        # Indices of the rules matched against the whole text, in rule order,
+        # and of those among them that are plain phrases.
+        self.document_indices = []
+        phrase_indices = []
+        # (index, plan) of the expression rules, in rule order, and of those among them using NOT.
+        self.expression_rules = []
+        self.negated_rules = []
+        # (index, compiled pattern) and (index, field or None, phrase), in rule order.
+        self.filename_rules = []
+        self.metadata_rules = []
+        for index, (key, rule) in enumerate(rules.items()):
+            rule_type = utils.MappingUtils.get_rule_type(rule)
+            if rule_type == utils.RULE_TYPE_FILENAME:
+                try:
+                    self.filename_rules.append((index, re.compile(key, re.IGNORECASE)))
+                except re.error:
+                    # A broken pattern matches nothing rather than failing the whole mapping.
+                    pass
+                continue
+            if rule_type == utils.RULE_TYPE_METADATA:
+                field = str(rule.get("field") or "").lower() or None
+                self.metadata_rules.append((index, field, phrases[index]))
+                continue
+            if rule_type == utils.RULE_TYPE_EXPRESSION:
+                try:
+                    plan = rule_expressions.compile_expression(key)
+                    self.expression_rules.append((index, plan))
+                    if plan.has_not:
+                        self.negated_rules.append((index, plan))
+                    self.document_indices.append(index)
+                except rule_expressions.RuleSyntaxError:
+                    # Like a broken filename pattern, an unparsable expression matches nothing.
+                    pass
+                continue
+            scope = utils.MappingUtils.get_rule_scope(rule)
+            if scope is None:
+                self.document_indices.append(index)
+                phrase_indices.append(index)
+            else:
+                scoped.setdefault(scope, []).append(index)
+        # Region groups, cheapest (smallest area) first.
+        self.scopes = sorted(
+            (RuleScope(page, region, indices, [phrases[i] for i in indices])
+             for (page, region), indices in scoped.items()),
+            key=lambda scope: (scope.area, scope.indices[0]),
+        )
+        self.phrase_indices = phrase_indices
+        # Whole-text phrase rules that tolerate edits, for approximate mode.
+        self.approximate_indices = [
+            i for i in phrase_indices if utils.MappingUtils.get_rule_max_distance(rules[self.keys[i]]) > 0
+        ]
+        self.approximate_matcher = matcher.ApproximateMatcher(
+            [phrases[i] for i in self.approximate_indices],
+            [utils.MappingUtils.get_rule_max_distance(rules[self.keys[i]]) for i in self.approximate_indices],
+        )
+        if len(phrase_indices) < len(phrases):
+            self.document_matcher = matcher.PhraseMatcher(phrases[i] for i in phrase_indices)
+        else:
+            self.document_matcher = self.matcher
+
+    @property
+    def phrases(self):
+        """The normalized phrases, in rule order."""
+        return self.matcher.phrases
+
+    @property
+    def has_pretext_rules(self):
+        """True if some rules are decided without reading the whole document text."""
+        return bool(self.filename_rules or self.metadata_rules or self.scopes)
+
+    def match_filename(self, filename):
+        """Returns the index of the first filename rule whose pattern occurs in the file name, or None."""
+        for index, pattern in self.filename_rules:
+            if pattern.search(filename):
+                return index
+        return None
+
+    def match_metadata(self, metadata, below=None):
+        """
+        Returns the index of the first metadata rule whose phrase occurs in
+        its field of a PDF metadata dict (any field if the rule names none),
+        or None. Rules at or after index below are not checked.
+        """
+        values = {field: matcher.normalize_text(metadata.get(field) or "") for field in utils.METADATA_FIELDS}
+        for index, field, phrase in self.metadata_rules:
+            if below is not None and index >= below:
+                break
+            fields = (field,) if field else utils.METADATA_FIELDS
+            if any(phrase in values.get(name, "") for name in fields):
+                return index
+        return None
+
+    def find_document_rule(self, normalized_text, expression_text=None, approximate=False, negations=True):
+        """
+        Finds the first text rule, among those not limited to a region, whose
+        phrase occurs in (or, for an expression rule, whose expression holds
+        for) the normalized text. With approximate, a phrase may also occur
+        with up to its rule's max_distance edits. Expression rules are only
+        evaluated if they come before the first matching phrase, against
+        expression_text if given. With negations=False, expression rules
+        using NOT are skipped: on part of a document they may hold only until
+        a later page disproves them (see find_negated_rule). Returns (rule
+        index, offset, distance) or None; distance is the number of edits, 0
+        for an exact match.
+        """
+        hit = self.document_matcher.find_first(normalized_text)
+        if hit is not None:
+            hit = self.phrase_indices[hit[0]], hit[1], 0
+        if approximate and self.approximate_indices:
+            # Only rules before the exact hit can change the result.
+            below = len(self.approximate_indices) if hit is None else bisect.bisect_left(self.approximate_indices, hit[0])
+            near = self.approximate_matcher.find_first(normalized_text, below=below)
+            if near is not None:
+                hit = self.approximate_indices[near[0]], near[1], near[2]
+        if self.expression_rules:
+            terms = rule_expressions.TextTerms(normalized_text if expression_text is None else expression_text)
+            for index, plan in self.expression_rules:
+                if hit is not None and index >= hit[0]:
+                    break
+                if not negations and plan.has_not:
+                    continue
+                offset = plan.evaluate(terms)
+                if offset is not None:
+                    return index, offset, 0
+        return hit
+
+    def find_negated_rule(self, normalized_text, below=None):
+        """
+        Returns (rule index, offset) of the first expression rule using NOT
+        that holds for the normalized text, or None. Rules at or after index
+        below are not checked.
+        """
+        if not self.negated_rules:
+            return None
+        terms = rule_expressions.TextTerms(normalized_text)
+        for index, plan in self.negated_rules:
+            if below is not None and index >= below:
+                break
+            offset = plan.evaluate(terms)
+            if offset is not None:
+                return index, offset
+        return None
+
+
+class DocumentRuleCheck:
+    """
+    A picklable check of whether a text matches one of a compiled mapping's
+    whole-text rules (phrases, approximately in approximate mode, and
+    expressions), as find_document_rule decides it. Adaptive OCR uses it to
+    reject a low-DPI read that matches no rule, also in worker processes.
+    """
+
+    def __init__(self, compiled, approximate=False):
+        self.compiled = compiled
+        self.approximate = approximate
+
+    def __call__(self, text):
+        return self.compiled.find_document_rule(matcher.normalize_text(text), approximate=self.approximate) is not None
+
+
+class RuleScope:
+    """
+    The rules limited to one region of one page: page is a 0-based index,
+    region is (x0, y0, x1, y1) as fractions of the page or None for the
+    whole page, and indices are the rules' positions in mapping order.
+    """
+
+    def __init__(self, page, region, indices, phrases):
+        self.page = page
+        self.region = region
+        self.indices = indices
+        self.matcher = matcher.PhraseMatcher(phrases)
+
+    @property
+    def area(self):
+        """The share of the page this scope reads."""
+        if self.region is None:
+            return 1.0
+        x0, y0, x1, y1 = self.region
+        return (x1 - x0) * (y1 - y0)
+
+    def find_first(self, normalized_text):
+        """Returns (rule index, offset) of the first of these rules occurring in the text, or None."""
+        hit = self.matcher.find_first(normalized_text)
+        if hit is None:
+            return None
+        return self.indices[hit[0]], hit[1]
+
+
+def mapping_digest(raw):
+    """Returns the cache key for the raw bytes of a mapping file."""
+    hasher = hashlib.sha256(raw)
+    hasher.update(f"compiled-v{COMPILED_FORMAT_VERSION}".encode("ascii"))
+    return hasher.hexdigest()
+
+
+def mapping_version(rules, approximate=False):
+    """Identifies a mapping's rules, in order, together with the matching mode and the normalization."""
+    hasher = hashlib.sha256(f"compiled-v{COMPILED_FORMAT_VERSION} approximate={bool(approximate)}".encode("ascii"))
+    hasher.update(json.dumps(list(rules.items()), sort_keys=True).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def could_change_outcome(old_rules, new_rules, decided_by):
+    """
+    True if a document that old_rules sent to the rule with key decided_by
+    (None: no rule matched it) might be decided differently by new_rules,
+    its text being the same. First match wins, so for an unmatched document
+    only new or edited rules matter. For a matched one, its rule must be
+    unchanged, and every rule now before it must have been checked (and
+    failed) before: an unchanged rule that was already before it.
+    """
+    if decided_by is None:
+        return any(key not in old_rules or old_rules[key] != rule for key, rule in new_rules.items())
+    if decided_by not in new_rules or old_rules.get(decided_by) != new_rules[decided_by]:
+        return True
+    checked_before = set()
+    for key in old_rules:
+        if key == decided_by:
+            break
+        checked_before.add(key)
+    for key, rule in new_rules.items():
+        if key == decided_by:
+            return False
+        if key not in checked_before or old_rules[key] != rule:
+            return True
+    return False
+
+
+def get_cache_dir():
+    """Returns the per-user directory that holds compiled artifacts."""
+    return os.path.join(text_cache.user_cache_dir(), CACHE_DIR_NAME)
+
+
+def get_compiled_path(mapping_path, digest):
+    """Returns the artifact path for a mapping file with the given content digest."""
+    stem = os.path.splitext(os.path.basename(mapping_path))[0]
+    # Same-named mappings in different folders keep separate artifacts.
+    location = hashlib.sha256(os.path.abspath(mapping_path).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(get_cache_dir(), f"{stem}.{location}.{digest}{CACHE_EXTENSION}")
+
+
+def load_compiled_mapping(mapping_path):
+    """
+    Returns the CompiledMapping for a mapping file, loading the cached artifact
+    when its content hash matches and (re)building and saving it otherwise.
+    """
+    try:
+        with open(mapping_path, "rb") as f:
+            raw = f.read()
+    except OSError:
+        # No readable file: compile whatever the regular loader yields.
+        return CompiledMapping(utils.MappingUtils.load_mapping(mapping_path))
+
+    digest = mapping_digest(raw)
+    compiled_path = get_compiled_path(mapping_path, digest)
+    compiled = _read_artifact(compiled_path, digest)
+    if compiled is not None:
+        return compiled
+
+    try:
+        data = json.loads(raw.decode("utf-8"))
+        rules = utils.MappingUtils.migrate_mapping(data)
+    except (json.JSONDecodeError, UnicodeDecodeError, StopIteration):
+        rules = {}
+
+    compiled = CompiledMapping(rules, digest)
+    _write_artifact(compiled_path, compiled)
+    return compiled
+
+
+def _read_artifact(compiled_path, digest):
+    try:
+        with open(compiled_path, "rb") as f:
+            compiled = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+    if not isinstance(compiled, CompiledMapping) or compiled.digest != digest \
+            or getattr(compiled, "version", None) != COMPILED_FORMAT_VERSION:
+        return None
+    return compiled
+
+
+def _write_artifact(compiled_path, compiled):
+    """Saves an artifact atomically and removes stale ones for the same mapping."""
+    cache_dir = os.path.dirname(compiled_path)
+    tmp_path = f"{compiled_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, compiled_path)
+    except OSError:
+        # A read-only install location just means we compile in memory.
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return
+
+    current = os.path.basename(compiled_path)
+    stem = current.rsplit(".", 2)[0]
+    for name in os.listdir(cache_dir):
+        if name == current or not name.endswith(CACHE_EXTENSION):
+            continue
+        if name.rsplit(".", 2)[0] == stem:
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                pass
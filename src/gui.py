@@ -5,7 +5,7 @@ from tkinter import filedialog, messagebox, ttk
 from tkinterdnd2 import DND_FILES, TkinterDnD
 import threading
 
-from src import sorter, utils
+from src import sorter, utils, ocr, text_cache, preprocess, template_index, watcher
 from src.mapping_editor.editor_gui import MappingEditor
 from src.utils import (
     load_settings, save_settings,
@@ -22,6 +22,10 @@ class FileSorterGUI:
         self.settings = load_settings()
         self.deep_audit = tk.BooleanVar()
         self.first_page_only = tk.BooleanVar(value=True) # Default to True for speed
+        self.stop_at_match = tk.BooleanVar(value=False)
+        self.approximate = tk.BooleanVar(value=False)
+        self.incremental = tk.BooleanVar(value=True)
+        self.folder_watcher = None
         self.root.minsize(300, 220)
 
         self._build_widgets()
@@ -35,9 +39,19 @@ class FileSorterGUI:
             "- Add one or more folders containing PDF files to be sorted.\n"
             "- You can drag and drop folders from Explorer into the list below to add them quickly.\n\n"
             "Deep Audit:\n"
-            "When enabled, the tool will recursively scan all subdirectories for PDF files to sort.\n\n"
+            "When enabled, the tool will recursively scan all subdirectories for PDF files to sort (except the mapping's template folder). "
+            "Afterwards, files already in the template folder are checked against the current rules and misplaced ones are moved; "
+            "only files that changed, or whose rules changed, since the last audit are read again.\n\n"
             "First Page Only:\n"
             "When enabled, only scans the first page of each PDF for faster processing.\n\n"
+            "Stop at First Match:\n"
+            "When scanning all pages, reads each PDF page by page and stops as soon as a rule matches.\n\n"
+            "Tolerate OCR Misreads:\n"
+            "Rules with a max_distance also match phrases with that many wrong, missing or extra characters.\n\n"
+            "Watch Folders:\n"
+            "Keeps running and sorts each PDF dropped into the folders once it has finished being written. Click again to stop.\n\n"
+            "Skip Unchanged:\n"
+            "PDFs that no rule matched in an earlier sort are not read again until a rule is added or edited in a way that might match them.\n\n"
             "Use the Mapping Editor to create or modify sorting rules based on PDF content.\n"
         )
         messagebox.showinfo("Help - OCR File Sorter", message)
@@ -101,7 +115,7 @@ class FileSorterGUI:
             options_frame, text="Deep Audit", variable=self.deep_audit
         )
         deep_audit_check.pack(side="left", padx=5)
-        utils.ToolTip(deep_audit_check, "If checked, recursively move misplaced files to their correct folders after sorting.")
+        utils.ToolTip(deep_audit_check, "If checked, also sort PDFs in all subfolders, then move misplaced files within the template folder.")
 
         first_page_check = ttk.Checkbutton(
             options_frame, text="Scan first page only (faster)", variable=self.first_page_only
@@ -109,6 +123,24 @@ class FileSorterGUI:
         first_page_check.pack(side="left", padx=5)
         utils.ToolTip(first_page_check, "Speeds up sorting by only reading the first page of each PDF.")
 
+        stop_at_match_check = ttk.Checkbutton(
+            options_frame, text="Stop at first match", variable=self.stop_at_match
+        )
+        stop_at_match_check.pack(side="left", padx=5)
+        utils.ToolTip(stop_at_match_check, "When scanning all pages, stop reading a PDF at the first page that matches a rule.")
+
+        approximate_check = ttk.Checkbutton(
+            options_frame, text="Tolerate OCR misreads", variable=self.approximate
+        )
+        approximate_check.pack(side="left", padx=5)
+        utils.ToolTip(approximate_check, "Let rules with a max_distance match phrases with a few misread characters.")
+
+        incremental_check = ttk.Checkbutton(
+            options_frame, text="Skip unchanged", variable=self.incremental
+        )
+        incremental_check.pack(side="left", padx=5)
+        utils.ToolTip(incremental_check, "Do not re-read PDFs left unmatched by an earlier sort unless the mapping changed in a way that could match them.")
+
         # --- Bottom Buttons ---
         button_row = ttk.Frame(self.root)
         button_row.pack(fill="x", padx=10, pady=5)
@@ -117,6 +149,10 @@ class FileSorterGUI:
         self.sort_btn.pack(side="left")
         utils.ToolTip(self.sort_btn, "Start sorting PDF files according to the selected options.")
 
+        self.watch_btn = ttk.Button(button_row, text="Watch Folders", command=self._toggle_watch)
+        self.watch_btn.pack(side="left", padx=5)
+        utils.ToolTip(self.watch_btn, "Keep running and sort new PDFs as they arrive in the folders.")
+
         help_btn = ttk.Button(button_row, text="Help", command=self._show_help)
         help_btn.pack(side="right")
         utils.ToolTip(help_btn, "Show help and usage instructions.")
@@ -191,49 +227,123 @@ class FileSorterGUI:
         self.root.after(0, lambda: self.status_label.config(text=message))
 
     def _start_sort_thread(self):
+        inputs = self._check_inputs()
+        if inputs is None:
+            return
         self.sort_btn.config(state="disabled")
+        self.watch_btn.config(state="disabled")
         self.status_label.config(text="Starting sort...")
         self.progress_bar['value'] = 0
-        thread = threading.Thread(target=self._sort_files, daemon=True)
+        thread = threading.Thread(target=self._sort_files, args=inputs, daemon=True)
         thread.start()
 
-    def _sort_files(self):
+    def _check_inputs(self):
+        """Reports a missing mapping or folder list; returns the mapping path and folders, or None."""
         mapping_path = self.mapping_path
         folders = self.folder_listbox.get(0, tk.END)
         if not mapping_path or not os.path.isfile(mapping_path):
-            self.root.after(0, lambda: utils.show_error("Please select a valid mapping file."))
-            self.root.after(0, lambda: self.sort_btn.config(state="normal"))
-            return
+            messagebox.showerror("Error", "Please select a valid mapping file.")
+            return None
         if not folders:
-            self.root.after(0, lambda: utils.show_error("Please add at least one folder to sort."))
-            self.root.after(0, lambda: self.sort_btn.config(state="normal"))
-            return
-
+            messagebox.showerror("Error", "Please add at least one folder to sort.")
+            return None
+        return mapping_path, folders
+
+    def _create_sorter(self, mapping_path):
+        """Returns a Sorter set up from the options, with its text cache and template index (to close after use)."""
+        cache = text_cache.TextCache()
+        sorter_obj = sorter.Sorter(
+            mapping_path,
+            status_callback=self.update_status,
+            ocr_engine=ocr.OcrEngine(adaptive=True, workers=None, batch_size=8, zero_copy=True,
+                                     blank_detector=preprocess.BlankPageDetector()),
+            text_cache=cache,
+            approximate=self.approximate.get(),
+            incremental=self.incremental.get()
+        )
+        index = template_index.TemplateIndex(sorter_obj.template_dir)
+        sorter_obj.template_index = index
+        return sorter_obj, cache, index
+
+    @staticmethod
+    def _close_sorter(sorter_obj, cache, index):
+        if sorter_obj is not None:
+            sorter_obj.close()
+        if index is not None:
+            index.close()
+        if cache is not None:
+            cache.close()
+
+    def _sort_files(self, mapping_path, folders):
+        sorter_obj = None
+        cache = None
+        index = None
         try:
-            sorter_obj = sorter.Sorter(
-                mapping_path,
-                status_callback=self.update_status
-            )
+            sorter_obj, cache, index = self._create_sorter(mapping_path)
             deep_audit = self.deep_audit.get()
             first_page_only = self.first_page_only.get()
+            stop_at_match = self.stop_at_match.get()
             
             self.root.after(0, lambda: self.progress_bar.config(maximum=len(folders)))
             for i, folder in enumerate(folders):
                 if os.path.isdir(folder):
                     self.root.after(0, lambda f=folder: self.status_label.config(text=f"Sorting {os.path.basename(f)}..."))
-                    sorter_obj.sort_files([folder], deep_audit=deep_audit, first_page_only=first_page_only)
+                    sorter_obj.sort_files([folder], deep_audit=deep_audit, first_page_only=first_page_only, stream_pages=stop_at_match)
                 self.root.after(0, lambda v=i+1: self.progress_bar.config(value=v))
+            if deep_audit:
+                self.root.after(0, lambda: self.status_label.config(text="Auditing sorted files..."))
+                template_index.audit_template_dir(sorter_obj, index)
 
             self.root.after(0, lambda: messagebox.showinfo("Success", "Files sorted successfully!"))
         except Exception as e:
-            self.root.after(0, lambda: utils.show_error(f"An error occurred during sorting:\n{e}"))
+            self.root.after(0, lambda message=f"An error occurred during sorting:\n{e}": messagebox.showerror("Error", message))
         finally:
+            self._close_sorter(sorter_obj, cache, index)
             def final_update():
                 self.sort_btn.config(state="normal")
+                self.watch_btn.config(state="normal")
                 self.status_label.config(text="Ready")
                 self.progress_bar['value'] = 0
             self.root.after(0, final_update)
 
+    def _toggle_watch(self):
+        if self.folder_watcher is not None:
+            self.watch_btn.config(state="disabled")
+            self.status_label.config(text="Stopping watch...")
+            self.folder_watcher.stop()
+            return
+        inputs = self._check_inputs()
+        if inputs is None:
+            return
+        mapping_path, folders = inputs
+        try:
+            sorter_obj, cache, index = self._create_sorter(mapping_path)
+        except Exception as e:
+            messagebox.showerror("Error", f"An error occurred during sorting:\n{e}")
+            return
+        self.folder_watcher = watcher.FolderWatcher(
+            sorter_obj, [folder for folder in folders if os.path.isdir(folder)],
+            first_page_only=self.first_page_only.get(), stream_pages=self.stop_at_match.get()
+        )
+        self.sort_btn.config(state="disabled")
+        self.watch_btn.config(text="Stop Watching")
+        thread = threading.Thread(target=self._watch_folders, args=(sorter_obj, cache, index), daemon=True)
+        thread.start()
+
+    def _watch_folders(self, sorter_obj, cache, index):
+        try:
+            self.folder_watcher.run()
+        except Exception as e:
+            self.root.after(0, lambda message=f"An error occurred while watching:\n{e}": messagebox.showerror("Error", message))
+        finally:
+            self._close_sorter(sorter_obj, cache, index)
+            def final_update():
+                self.folder_watcher = None
+                self.sort_btn.config(state="normal")
+                self.watch_btn.config(text="Watch Folders", state="normal")
+                self.status_label.config(text="Ready")
+            self.root.after(0, final_update)
+
 def main():
     root = TkinterDnD.Tk()
     app = FileSorterGUI(root)
@@ -1,6 +1,10 @@
 # Entry point for the File Sorter application.
+import multiprocessing
+
 from src import gui
 
 if __name__ == "__main__":
+    # Required for the OCR worker pool in frozen (PyInstaller) builds.
+    multiprocessing.freeze_support()
     # Launch the GUI
     gui.main()
\ No newline at end of file
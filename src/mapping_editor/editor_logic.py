@@ -51,9 +51,13 @@ class EditorLogic:
         if new_phrase != old_phrase and new_phrase in self.mappings:
             return False, "This phrase or keyword already exists."
         # Remove old one if phrase changed
+        old_rule = self.mappings.get(old_phrase)
         if old_phrase in self.mappings and new_phrase != old_phrase:
             del self.mappings[old_phrase]
-        self.mappings[new_phrase] = {"name": new_name, "dest": new_dest}
+        # Keep settings the editor does not show, such as a rule's page region.
+        rule = dict(old_rule) if isinstance(old_rule, dict) else {}
+        rule.update({"name": new_name, "dest": new_dest})
+        self.mappings[new_phrase] = rule
         self.is_dirty = True
         return True, None
 
@@ -0,0 +1,273 @@
+"""
+Phrase matching for the Sorter.
+
+Mapping phrases are compiled once into an Aho-Corasick automaton, so a
+document is scanned a single time no matter how many rules the mapping has.
+"""
+
+# Applied identically to phrases and PDF text; re-exported for the modules
+# that match through this one.
+from src.normalizer import normalize_text
+from src import utils
+
+
+class MatchResult:
+    """
+    A rule that matched a document, and where. index is the rule's position
+    in mapping order and key its phrase (or pattern/expression) as written
+    in the mapping. kind says what matched: "text" (a phrase in the document
+    text), "expression", "filename", "metadata" or "region". offset is the
+    start of the match in the normalized text it was found in, page the
+    1-based page it is on, and distance the number of character edits of an
+    approximate match; each is None when it does not apply or is unknown.
+    """
+
+    def __init__(self, index, key, rule, kind, offset=None, page=None, distance=0):
+        self.index = index
+        self.key = key
+        self.rule = rule
+        self.kind = kind
+        self.offset = offset
+        self.page = page
+        self.distance = distance
+
+    @property
+    def name(self):
+        """The rule's display name (None for an old-format rule)."""
+        return self.rule.get("name") if isinstance(self.rule, dict) else None
+
+    @property
+    def dest(self):
+        """The rule's destination folder."""
+        return utils.MappingUtils.get_rule_dest(self.rule)
+
+    def describe(self):
+        """A one-line description for status messages and logs."""
+        what = {
+            "filename": "filename pattern",
+            "metadata": "metadata",
+            "region": "keyword in a page region",
+            "expression": "expression",
+        }.get(self.kind, "keyword")
+        text = f"'{self.name or self.dest}' ({what} '{self.key}'"
+        if self.page is not None:
+            text += f" on page {self.page}"
+        if self.distance:
+            text += f", {self.distance} edit{'s' if self.distance != 1 else ''} away"
+        return text + ")"
+
+    def to_dict(self):
+        """The result as a JSON-serializable dict."""
+        return {
+            "index": self.index, "key": self.key, "name": self.name, "dest": self.dest,
+            "kind": self.kind, "offset": self.offset, "page": self.page, "distance": self.distance,
+        }
+
+    def __repr__(self):
+        return f"MatchResult({self.to_dict()!r})"
+
+
+class PhraseMatcher:
+    """
+    An Aho-Corasick automaton over an ordered list of normalized phrases.
+
+    A phrase is identified by its position in the list, which is the rule
+    order of the mapping. When several phrases occur in a text, the one with
+    the lowest position wins, exactly like checking the rules one by one.
+    """
+
+    def __init__(self, phrases):
+        self.phrases = list(phrases)
+        self.max_length = max((len(p) for p in self.phrases), default=0)
+        # Per node: outgoing transitions, failure link, and the lowest-index
+        # phrase ending here (directly or through the failure chain) as
+        # (index, length), or None.
+        self._goto = [{}]
+        self._fail = [0]
+        self._best = [None]
+        # An empty phrase occurs in every text, just like '' in text.
+        self._always = None
+        self._build()
+
+    @classmethod
+    def from_mapping(cls, mapping_data):
+        """Builds a matcher over the phrases (keys) of a mapping, in rule order."""
+        return cls(normalize_text(phrase) for phrase in mapping_data)
+
+    def _build(self):
+        goto, best = self._goto, self._best
+        for index, phrase in enumerate(self.phrases):
+            if not phrase:
+                if self._always is None:
+                    self._always = index
+                continue
+            node = 0
+            for ch in phrase:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    self._fail.append(0)
+                    best.append(None)
+                node = nxt
+            if best[node] is None:
+                best[node] = (index, len(phrase))
+
+        # Breadth-first pass to set failure links and fold each node's best
+        # phrase together with the best phrase of its longest proper suffix.
+        queue = list(goto[0].values())
+        for node in queue:
+            for ch, child in goto[node].items():
+                queue.append(child)
+                state = self._fail[node]
+                while state and ch not in goto[state]:
+                    state = self._fail[state]
+                fail = goto[state].get(ch, 0)
+                self._fail[child] = fail
+                inherited = best[fail]
+                if inherited is not None and (best[child] is None or inherited[0] < best[child][0]):
+                    best[child] = inherited
+
+    def find_first(self, text):
+        """
+        Finds the lowest-index phrase that occurs in the normalized text.
+
+        Returns (index, offset) where offset is the start of the phrase's
+        first occurrence, or None if no phrase occurs.
+        """
+        goto, fail, best = self._goto, self._fail, self._best
+        found = None if self._always is None else (self._always, 0)
+        if found is not None and found[0] == 0:
+            return found
+
+        node = 0
+        for pos, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            hit = best[node]
+            if hit is not None and (found is None or hit[0] < found[0]):
+                found = (hit[0], pos - hit[1] + 1)
+                if found[0] == 0:
+                    # Nothing can beat the first rule.
+                    break
+        return found
+
+
+class ApproximateMatcher:
+    """
+    Finds phrases that occur with up to a per-phrase number of edits
+    (substituted, inserted or deleted characters), so OCR misreads such as
+    "lnvoice" still match "invoice".
+
+    Uses the bit-parallel Wu-Manber extension of shift-and: the states of
+    all phrases are packed side by side into one integer per allowed error
+    count, so each text character costs a handful of integer operations
+    whatever the number of phrases. Like PhraseMatcher, the lowest index wins.
+    """
+
+    def __init__(self, phrases, max_distances):
+        self.phrases = list(phrases)
+        # A phrase can't be allowed as many edits as it has characters, or it would match anywhere.
+        self.max_distances = [max(0, min(k, len(p) - 1)) for p, k in zip(self.phrases, max_distances)]
+        self.max_distance = max(self.max_distances, default=0)
+        self.max_length = max((len(p) for p in self.phrases), default=0)
+        self._starts = 0
+        self._full = 0
+        # Character -> bits of the phrase positions holding it.
+        self._masks = {}
+        # Per error count: the end bits of the phrases allowed that many edits.
+        self._accept = [0] * (self.max_distance + 1)
+        # End bit position -> (phrase index, phrase length).
+        self._ends = {}
+        # Per error count: the state before any text is read.
+        self._initial = [0] * (self.max_distance + 1)
+        self._build()
+
+    def _build(self):
+        offset = 0
+        for index, (phrase, k) in enumerate(zip(self.phrases, self.max_distances)):
+            if not phrase:
+                continue
+            self._starts |= 1 << offset
+            for j, ch in enumerate(phrase):
+                self._masks[ch] = self._masks.get(ch, 0) | (1 << (offset + j))
+            end = offset + len(phrase) - 1
+            self._accept[k] |= 1 << end
+            self._ends[end] = (index, len(phrase))
+            # Before reading, a prefix of up to d characters matches with d deletions.
+            for d in range(1, self.max_distance + 1):
+                self._initial[d] |= ((1 << min(d, len(phrase))) - 1) << offset
+            offset += len(phrase)
+        self._full = (1 << offset) - 1
+
+    def find_first(self, text, below=None):
+        """
+        Finds the lowest-index phrase that occurs in the normalized text
+        within its maximum distance. Only phrases before index below are
+        considered, if given. Returns (index, offset, distance), where offset
+        is the start of the first occurrence and distance its number of
+        edits, or None.
+        """
+        limit = len(self.phrases) if below is None else min(below, len(self.phrases))
+        if not self._full or limit <= 0:
+            return None
+        masks, starts, full = self._masks, self._starts, self._full
+        accept = self._accept
+        states = list(self._initial)
+        levels = range(1, len(states))
+        found = None
+
+        for pos, ch in enumerate(text):
+            mask = masks.get(ch, 0)
+            previous_old = states[0]
+            states[0] = ((previous_old << 1) | starts) & mask
+            hits = states[0] & accept[0]
+            for d in levels:
+                old = states[d]
+                # Match, insertion, substitution and deletion, in that order.
+                states[d] = ((((old << 1) | starts) & mask) | previous_old
+                             | ((previous_old | states[d - 1]) << 1) | starts) & full
+                previous_old = old
+                hits |= states[d] & accept[d]
+            if not hits:
+                continue
+            while hits:
+                bit = hits & -hits
+                hits ^= bit
+                index, length = self._ends[bit.bit_length() - 1]
+                if index < limit and (found is None or index < found[0]):
+                    found = (index, pos)
+            if found is not None and found[0] == 0:
+                # Nothing can beat the first phrase.
+                break
+        if found is None:
+            return None
+        index, end = found
+        return (index,) + _align(self.phrases[index], text, end, self.max_distances[index])
+
+
+def _align(phrase, text, end, max_distance):
+    """
+    Locates the occurrence of a phrase first detected, within max_distance
+    edits, ending at position end of the text. The occurrence may still
+    improve over the next few characters (e.g. a prefix detected before the
+    whole phrase has been read), so the window around it is aligned with a
+    small dynamic programme. Returns (offset, distance).
+    """
+    start = max(0, end - len(phrase) - max_distance + 1)
+    window = text[start:end + len(phrase) + max_distance]
+    # Per phrase prefix: (edits, start in window) of the best alignment ending here.
+    row = [(j, 0) for j in range(len(phrase) + 1)]
+    best = None
+    for i, ch in enumerate(window):
+        previous, row[0] = row[0], (0, i + 1)
+        for j, pch in enumerate(phrase, 1):
+            diagonal = (previous[0] + (pch != ch), previous[1])
+            previous, row[j] = row[j], min((row[j][0] + 1, row[j][1]), (row[j - 1][0] + 1, row[j - 1][1]), diagonal)
+        if start + i >= end and (best is None or row[-1][0] < best[0]):
+            best = row[-1]
+        if best is not None and (best[0] == 0 or start + i - end >= max_distance + len(phrase)):
+            break
+    return start + best[1], best[0]
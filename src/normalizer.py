@@ -0,0 +1,110 @@
+"""
+Text normalization for matching.
+
+PDF text differs from the phrases typed into a mapping in ways that have
+nothing to do with its content: ligatures (ﬁ, ﬂ), soft hyphens, words
+hyphenated across a line break, full-width and other compatibility forms,
+and assorted Unicode spaces. normalize_text folds all of these away, along
+with case and whitespace runs, and is applied identically to phrases and
+to document text.
+
+Every per-character fold of a non-ASCII character (NFKC compatibility
+form, lowercase, dropped characters, space and line break variants) is
+precomputed into one translation table, indexed by code point. A text is
+lowercased and, if it holds a character the table changes, translated
+through it in one pass; then hyphenated line breaks are joined and
+whitespace collapsed. Lowercased Cyrillic, Greek and most other non-Latin
+text is already in NFKC form, which a quick check tells without
+translating. Each of these steps is a single pass in C, so PDF text costs
+little more than the plain lowercase-and-split it replaces (see
+scripts/bench_normalizer.py).
+"""
+
+import re
+import threading
+import unicodedata
+
+# Removed wherever they occur: soft hyphen, zero-width spaces and joiners,
+# word joiner and byte order mark.
+DROPPED_CHARACTERS = "\u00ad\u200b\u200c\u200d\u2060\ufeff"
+# Non-ASCII line breaks, turned into "\n" so a hyphen before them joins the word
+# (a "\r" on its own is treated as a space, and a hyphen before it is kept).
+LINE_BREAKS = "\x85\u2028\u2029"
+# Turned into "-": the Unicode hyphen and non-breaking hyphen.
+HYPHENS = "\u2010\u2011"
+# Code points whose compatibility and case folds go into the table, beyond
+# which characters are left as they are. The second range holds the
+# mathematical alphanumerics some PDF generators use for bold/italic text.
+TABLE_RANGES = ((0x80, 0x10000), (0x1D400, 0x1D800))
+
+# The characters the table changes in text that is lowercase and in NFKC form.
+_SPECIAL_CHARACTERS = DROPPED_CHARACTERS + LINE_BREAKS + HYPHENS
+# A hyphen ending a line, with the line break and any indentation after it.
+_HYPHEN_BREAK_RE = re.compile(r"-\r?\n\s*")
+
+_table = None
+_table_lock = threading.Lock()
+# The last (text, normalized) pair, since callers often normalize the same
+# text twice (e.g. to match it and then to report a miss).
+_last = (None, None)
+
+
+def _build_table():
+    """
+    Returns a str.translate table: a list holding, for each code point up to
+    the end of TABLE_RANGES, its fold, or the code point itself where
+    folding leaves the character alone. Unlike a dict of just the folded
+    characters, looking up a character that stays costs no KeyError.
+    """
+    table = list(range(TABLE_RANGES[-1][1]))
+    for first, stop in TABLE_RANGES:
+        for code in range(first, stop):
+            if 0xD800 <= code < 0xE000:
+                continue
+            ch = chr(code)
+            folded = unicodedata.normalize("NFKC", ch).lower()
+            if folded != ch:
+                table[code] = folded
+    for ch in DROPPED_CHARACTERS:
+        table[ord(ch)] = ""
+    for ch in LINE_BREAKS:
+        table[ord(ch)] = "\n"
+    for ch in HYPHENS:
+        table[ord(ch)] = "-"
+    return table
+
+
+def _get_table():
+    """Returns the fold table, built on first use."""
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                _table = _build_table()
+    return _table
+
+
+def normalize_text(text):
+    """
+    Normalizes text for matching: applies NFKC compatibility forms (which
+    splits ligatures), lowercases, removes soft hyphens and zero-width
+    characters, joins words hyphenated across a line break, and collapses
+    all whitespace runs to a single space.
+    """
+    global _last
+    last = _last
+    if last[0] is text:
+        return last[1]
+    normalized = text.lower()
+    if not normalized.isascii():
+        if not unicodedata.is_normalized("NFC", normalized):
+            # Compose accents typed as separate combining marks, so the table sees whole characters.
+            normalized = unicodedata.normalize("NFC", normalized)
+        if not unicodedata.is_normalized("NFKC", normalized) or any(ch in normalized for ch in _SPECIAL_CHARACTERS):
+            normalized = normalized.translate(_get_table())
+    if "-\n" in normalized or "-\r\n" in normalized:
+        normalized = _HYPHEN_BREAK_RE.sub("", normalized)
+    normalized = " ".join(normalized.split())
+    _last = (text, normalized)
+    return normalized
+
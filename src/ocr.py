@@ -0,0 +1,645 @@
+"""
+OCR for pages that have no usable text layer.
+
+The OcrEngine renders a page and runs Tesseract on it. In adaptive mode it
+starts with a cheap grayscale render at a low DPI and only re-renders at a
+higher DPI when Tesseract's word confidences are low or the text matches no
+rule. The DPI each page needed is recorded so the thresholds can be tuned.
+
+With workers > 0, pages are rendered and read in a process pool instead of
+the calling process. Each worker runs Tesseract with OMP_THREAD_LIMIT set to
+threads_per_worker, so workers x threads stays within the machine's cores.
+
+With batch_size > 1, submitted pages are collected and read by a single
+Tesseract invocation per batch (and per DPI tier), so process start-up and
+language-data loading are paid once per batch instead of once per page.
+
+With zero_copy=True, a rendered page is piped to Tesseract as a PNM image
+straight from the pixmap's sample buffer, instead of being copied into a PIL
+image that pytesseract then encodes into a temporary file. Batches are
+always written to disk from the pixmap directly.
+
+Pages that are a single full-page scan image are not rendered at all: the
+image is decoded from the PDF, turned upright and scaled down to the
+requested DPI. Any other page is rendered with get_pixmap.
+
+An optional Preprocessor (see preprocess.py) crops, binarizes and deskews
+each page image before it reaches Tesseract, and records the time taken.
+An optional BlankPageDetector screens pages on a cheap low-resolution
+render first; blank and separator pages are not OCRed at all.
+"""
+
+import os
+import csv
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+
+# Attempt to import OCR libraries. If they fail, OCR will be disabled.
+try:
+    from PIL import Image
+    import pytesseract
+    OCR_AVAILABLE = True
+except ImportError:
+    OCR_AVAILABLE = False
+
+# Resolution used when adaptive OCR is off.
+DEFAULT_DPI = 300
+# Resolutions tried in order by adaptive OCR; the last one is always accepted.
+ADAPTIVE_DPI_TIERS = (150, 300)
+# Mean word confidence (0-100) below which a tier's result is rejected.
+MIN_WORD_CONFIDENCE = 70
+# Share of the page an embedded image must cover to be read in place of the page.
+FULL_PAGE_COVERAGE = 0.95
+
+
+def default_worker_count(threads_per_worker=1):
+    """Returns how many OCR workers fit on this machine with the given Tesseract threads each."""
+    return max(1, (os.cpu_count() or 1) // max(1, threads_per_worker))
+
+
+def configure_tesseract_threads(threads):
+    """
+    Limits the OpenMP threads of Tesseract processes started from here on.
+    Tesseract reads OMP_THREAD_LIMIT from the environment it inherits.
+    """
+    os.environ["OMP_THREAD_LIMIT"] = str(max(1, threads))
+
+
+class OcrResult:
+    """
+    The text read from one page, with the DPI it was read at, its mean word
+    confidence and the seconds spent in each preprocessing step. skipped
+    names the kind of page ("blank" or "separator") if it was not OCRed.
+    """
+
+    def __init__(self, text, dpi, confidence=None, preprocess_times=None, skipped=None):
+        self.text = text
+        self.dpi = dpi
+        self.confidence = confidence
+        self.preprocess_times = preprocess_times or {}
+        self.skipped = skipped
+
+
+class OcrEngine:
+    """
+    Renders pages and reads them with Tesseract.
+
+    With adaptive=False every page is rendered in RGB at DEFAULT_DPI, as
+    before. With adaptive=True pages are rendered in grayscale at each DPI in
+    tiers until a result is confident enough and, if an accept callback is
+    given, accepted by it.
+
+    workers=0 reads pages in the calling process; workers > 0 enables
+    submit_page, which reads pages in a process pool (None picks a worker
+    count from the CPU count and threads_per_worker). batch_size > 1 makes
+    submit_page queue pages and read them batch_size at a time with one
+    Tesseract process, in the pool if there is one. zero_copy=True hands
+    pages read one at a time to Tesseract without intermediate copies.
+    embedded_images=True reads full-page scans from their embedded image.
+    A preprocessor, if given, processes every page image before OCR. A
+    blank_detector, if given, skips pages it classifies as blank or separator.
+    """
+
+    def __init__(self, adaptive=False, tiers=ADAPTIVE_DPI_TIERS, min_confidence=MIN_WORD_CONFIDENCE,
+                 workers=0, threads_per_worker=1, batch_size=1, zero_copy=False, embedded_images=True,
+                 preprocessor=None, blank_detector=None):
+        self.adaptive = adaptive
+        self.zero_copy = zero_copy
+        self.embedded_images = embedded_images
+        self.preprocessor = preprocessor
+        self.blank_detector = blank_detector
+        # How many pages were skipped, by kind.
+        self.skipped_counts = Counter()
+        # Preprocessing times of the page being read.
+        self._page_times = Counter()
+        self.tiers = tuple(tiers)
+        self.min_confidence = min_confidence
+        self.threads_per_worker = max(1, threads_per_worker)
+        self.workers = default_worker_count(self.threads_per_worker) if workers is None else workers
+        # How many pages were finally read at each DPI, and a per-page log of
+        # (label, page_number, dpi, confidence) for tuning the tiers.
+        self.tier_counts = Counter()
+        self.page_log = []
+        self.batch_size = max(1, batch_size)
+        self._batch = []
+        self._batch_accept = None
+        self._pool = None
+        self._pool_accept = None
+
+    @property
+    def parallel(self):
+        """True if pages are read in worker processes."""
+        return OCR_AVAILABLE and self.workers > 0
+
+    @property
+    def batched(self):
+        """True if submitted pages are read in batches by one Tesseract process."""
+        return OCR_AVAILABLE and self.batch_size > 1
+
+    @property
+    def deferred(self):
+        """True if pages should be submitted with submit_page rather than read inline."""
+        return self.parallel or self.batched
+
+    @property
+    def cache_key(self):
+        """
+        Names the settings that decide what OCR reads from a page: the DPI
+        tiers, the preprocessing steps and blank-page screening. Cached OCR
+        text read under other settings is not reused.
+        """
+        tiers = self.tiers if self.adaptive else (DEFAULT_DPI,)
+        parts = [f"dpi={','.join(str(dpi) for dpi in tiers)}"]
+        if self.adaptive:
+            parts.append(f"gray min_confidence={self.min_confidence}")
+        parts.append(f"embedded_images={self.embedded_images}")
+        if self.preprocessor is not None and self.preprocessor.enabled:
+            steps = [step for step in ("crop", "binarize", "deskew") if getattr(self.preprocessor, step)]
+            parts.append(f"preprocess={','.join(steps)}")
+        if self.blank_detector is not None:
+            detector = self.blank_detector
+            parts.append(f"screen={detector.dpi},{detector.ink_fraction},{detector.detect_separators}")
+        return " ".join(parts)
+
+    def is_provisional(self, result, accept):
+        """
+        True if adaptive OCR kept a result below the last DPI tier because
+        accept approved it. Such a result only holds for that check (that is,
+        for the mapping it came from).
+        """
+        return accept is not None and self.adaptive and result.dpi is not None and result.dpi != self.tiers[-1]
+
+    def ocr_page(self, page, accept=None, label=None, page_number=None, clip=None):
+        """
+        Reads the text of a page in this process and records its DPI tier.
+        accept(text) may reject an otherwise confident low-DPI result, e.g.
+        because it matches no rule. clip, a rectangle in the page's displayed
+        coordinates, limits OCR to that part of the page. Returns an OcrResult.
+        """
+        result = self.read_page(page, accept, clip)
+        self.record(result, label, page_number)
+        return result
+
+    def read_page(self, page, accept=None, clip=None):
+        """
+        Reads the text of a page, or of the clip rectangle, without recording
+        it. A clip is not screened for blankness, which would render the
+        whole page. Returns an OcrResult.
+        """
+        self._page_times = Counter()
+        skipped = None if clip is not None else self._screen(page)
+        if skipped:
+            return OcrResult("", None, skipped=skipped)
+        if not self.adaptive:
+            result = OcrResult(self._read_rgb(page, DEFAULT_DPI, clip), DEFAULT_DPI)
+        else:
+            result = None
+            for tier, dpi in enumerate(self.tiers):
+                text, confidence = self._read_gray(page, dpi, clip)
+                result = OcrResult(text, dpi, confidence)
+                if tier == len(self.tiers) - 1:
+                    break
+                if confidence >= self.min_confidence and (accept is None or accept(text)):
+                    break
+        result.preprocess_times = dict(self._page_times)
+        return result
+
+    def read_batch(self, page_refs, accept=None):
+        """
+        Reads several pages, given as (file_path, page_index), with one
+        Tesseract invocation per DPI tier. Only pages rejected at one tier are
+        rendered again at the next. Returns an OcrResult per page, in order.
+        """
+        tiers = self.tiers if self.adaptive else (DEFAULT_DPI,)
+        results = [None] * len(page_refs)
+        page_times = [Counter() for _ in page_refs]
+        docs = {}
+        try:
+            for i, (file_path, page_index) in enumerate(page_refs):
+                if file_path not in docs:
+                    docs[file_path] = fitz.open(file_path)
+                skipped = self._screen(docs[file_path][page_index])
+                if skipped:
+                    results[i] = OcrResult("", None, skipped=skipped)
+            pending = [i for i, result in enumerate(results) if result is None]
+
+            for tier, dpi in enumerate(tiers):
+                if not pending:
+                    break
+                last_tier = tier == len(tiers) - 1
+                with tempfile.TemporaryDirectory(prefix="ocr_batch_") as tmp_dir:
+                    image_paths = []
+                    for i in pending:
+                        file_path, page_index = page_refs[i]
+                        image_path = os.path.join(tmp_dir, f"page{len(image_paths):05d}.pnm")
+                        self._page_times = page_times[i]
+                        self._render(docs[file_path][page_index], dpi).save(image_path, output="pnm")
+                        image_paths.append(image_path)
+                    pages_data = run_tesseract_batch(image_paths)
+
+                rejected = []
+                for i, data in zip(pending, pages_data):
+                    text = words_to_text(data)
+                    confidence = mean_word_confidence(data) if self.adaptive else None
+                    results[i] = OcrResult(text, dpi, confidence, dict(page_times[i]))
+                    if not last_tier and (confidence < self.min_confidence or (accept is not None and not accept(text))):
+                        rejected.append(i)
+                pending = rejected
+        finally:
+            for doc in docs.values():
+                doc.close()
+        return results
+
+    def record(self, result, label=None, page_number=None):
+        """Records the DPI tier a page was read at and its preprocessing times, or why it was skipped."""
+        if result.skipped:
+            self.skipped_counts[result.skipped] += 1
+            self.page_log.append((label, page_number, None, None))
+            return
+        self.tier_counts[result.dpi] += 1
+        self.page_log.append((label, page_number, result.dpi, result.confidence))
+        if self.preprocessor is not None:
+            self.preprocessor.add_timings(result.preprocess_times)
+
+    def submit_page(self, file_path, page_index, accept=None):
+        """
+        Queues OCR of one page (0-based index) in the worker pool, or in the
+        current batch when batching. accept(text), if given, is used by
+        adaptive OCR to reject results that match no rule; it must be
+        picklable to reach worker processes. Returns a Future of
+        (status, payload): ("ok", OcrResult), ("missing", None) if Tesseract
+        is not installed, or ("error", message).
+        """
+        if not self.batched:
+            return self._get_pool(accept).submit(_ocr_page_job, file_path, page_index)
+
+        future = Future()
+        self._batch.append((file_path, page_index, future))
+        self._batch_accept = accept
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+        return future
+
+    def ensure_dispatched(self, future):
+        """Flushes the current batch if the given page future is still waiting in it."""
+        if any(queued is future for _, _, queued in self._batch):
+            self.flush()
+
+    def flush(self):
+        """Dispatches the pages queued for the current batch, even if it is not full."""
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        page_refs = [(file_path, page_index) for file_path, page_index, _ in batch]
+        page_futures = [future for _, _, future in batch]
+
+        if self.parallel:
+            job = self._get_pool(self._batch_accept).submit(_ocr_batch_job, page_refs)
+            job.add_done_callback(lambda done: _resolve_batch_job(page_futures, done))
+        else:
+            _resolve_batch(page_futures, _read_batch_statuses(self, page_refs, self._batch_accept))
+
+    def close(self):
+        """Dispatches any queued pages and shuts down the worker pool, if one was started."""
+        self.flush()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+            self._pool_accept = None
+
+    def _get_pool(self, accept):
+        if self._pool is not None and self._pool_accept is not accept:
+            self.close()
+        if self._pool is None:
+            configure_tesseract_threads(self.threads_per_worker)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.adaptive, self.tiers, self.min_confidence, self.threads_per_worker,
+                          self.zero_copy, self.embedded_images, self.preprocessor, self.blank_detector, accept),
+            )
+            self._pool_accept = accept
+        return self._pool
+
+    def tier_summary(self):
+        """Returns a short description of how many pages each DPI tier read."""
+        return ", ".join(f"{dpi} dpi: {count}" for dpi, count in sorted(self.tier_counts.items()))
+
+    def skipped_summary(self):
+        """Returns a short description of how many pages were skipped, by kind."""
+        return ", ".join(f"{kind}: {count}" for kind, count in sorted(self.skipped_counts.items()))
+
+    def _screen(self, page):
+        """Returns "blank" or "separator" if the blank detector says to skip the page, else None."""
+        if self.blank_detector is None:
+            return None
+        return self.blank_detector.classify(page)
+
+    def _read_rgb(self, page, dpi, clip=None):
+        # Render page to an image (pixmap) at high DPI for better accuracy
+        pix = self._pixmap(page, dpi, clip=clip)
+        if self.zero_copy:
+            return run_tesseract_pixmap(pix)
+        # Convert pixmap to a PIL Image (grayscale once preprocessed)
+        img = Image.frombytes("L" if pix.n == 1 else "RGB", [pix.width, pix.height], pix.samples)
+        # Use Tesseract to do OCR on the image.
+        # NOTE: This requires Tesseract-OCR to be installed on your system.
+        return pytesseract.image_to_string(img)
+
+    def _read_gray(self, page, dpi, clip=None):
+        pix = self._pixmap(page, dpi, gray=True, clip=clip)
+        if self.zero_copy:
+            data = parse_tesseract_tsv(run_tesseract_pixmap(pix, "tsv"), 1)[0]
+        else:
+            img = Image.frombytes("L", [pix.width, pix.height], pix.samples)
+            data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
+        return words_to_text(data), mean_word_confidence(data)
+
+    def _render(self, page, dpi):
+        """Renders a page the way read_page would at this DPI, as a pixmap."""
+        return self._pixmap(page, dpi, gray=self.adaptive)
+
+    def _pixmap(self, page, dpi, gray=False, clip=None):
+        """
+        Returns the page image to OCR: its embedded scan if it is one, else a
+        rendering, preprocessed if there is a preprocessor. A clip is always
+        rendered, and only that part of the page is.
+        """
+        pix = embedded_scan_pixmap(page, dpi, gray) if self.embedded_images and clip is None else None
+        if pix is None:
+            colorspace = fitz.csGRAY if gray else fitz.csRGB
+            if clip is not None:
+                pix = page.get_pixmap(dpi=dpi, colorspace=colorspace, clip=clip)
+            elif gray:
+                pix = page.get_pixmap(dpi=dpi, colorspace=colorspace)
+            else:
+                pix = page.get_pixmap(dpi=dpi)
+        if self.preprocessor is not None:
+            pix, times = self.preprocessor.process(pix)
+            self._page_times.update(times)
+        return pix
+
+
+def embedded_scan_pixmap(page, dpi, gray=False):
+    """
+    Returns the scan image of a page as a pixmap for OCR at about dpi, or None
+    if the page is not a single image covering the page. The image is decoded
+    from the PDF instead of rendering the page, scaled down if it is finer
+    than dpi, and turned to the page's display orientation.
+    """
+    try:
+        images = page.get_images(full=True)
+        # Exactly one image, without a soft mask, placed once.
+        if len(images) != 1 or images[0][1]:
+            return None
+        xref = images[0][0]
+        placements = page.get_image_rects(xref, transform=True)
+        if len(placements) != 1:
+            return None
+        bbox, transform = placements[0]
+        turn = _quarter_turn(transform * page.rotation_matrix)
+        shown = fitz.Rect(bbox * page.rotation_matrix) & page.rect
+        if turn is None or shown.is_empty or shown.get_area() < FULL_PAGE_COVERAGE * page.rect.get_area():
+            return None
+
+        # The decoded pixmap may be MuPDF's cached copy of the image, so it
+        # is only ever replaced, never modified in place.
+        pix = fitz.Pixmap(page.parent, xref)
+        if pix.colorspace is None:
+            return None
+        if pix.alpha:
+            pix = fitz.Pixmap(pix, 0)
+        shown_width = pix.height if turn in (90, 270) else pix.width
+        scale = dpi * shown.width / 72 / shown_width
+        if scale < 1:
+            pix = fitz.Pixmap(pix, max(1, round(pix.width * scale)), max(1, round(pix.height * scale)), None)
+        colorspace = fitz.csGRAY if gray else fitz.csRGB
+        if pix.colorspace.n != colorspace.n:
+            pix = fitz.Pixmap(colorspace, pix)
+        return _turn_pixmap(pix, turn) if turn else pix
+    except (RuntimeError, ValueError):
+        # Undecodable or unusual images are simply rendered.
+        return None
+
+
+def _quarter_turn(matrix):
+    """
+    Returns the counter-clockwise turn (0, 90, 180 or 270) that shows an
+    image placed with matrix upright, or None if it is skewed or mirrored.
+    """
+    eps = 1e-6 * max(abs(matrix.a), abs(matrix.b), abs(matrix.c), abs(matrix.d))
+    if abs(matrix.b) <= eps and abs(matrix.c) <= eps:
+        if matrix.a > 0 and matrix.d > 0:
+            return 0
+        if matrix.a < 0 and matrix.d < 0:
+            return 180
+    elif abs(matrix.a) <= eps and abs(matrix.d) <= eps:
+        if matrix.b < 0 and matrix.c > 0:
+            return 90
+        if matrix.b > 0 and matrix.c < 0:
+            return 270
+    return None
+
+
+def _turn_pixmap(pix, turn):
+    """Returns a gray or RGB pixmap turned counter-clockwise by 90, 180 or 270 degrees."""
+    transpose = {90: Image.Transpose.ROTATE_90, 180: Image.Transpose.ROTATE_180, 270: Image.Transpose.ROTATE_270}
+    img = Image.frombuffer("L" if pix.n == 1 else "RGB", (pix.width, pix.height), pix.samples_mv, "raw")
+    img = img.transpose(transpose[turn])
+    return fitz.Pixmap(pix.colorspace, img.width, img.height, img.tobytes(), False)
+
+
+def pnm_header(pix):
+    """Returns the binary PNM header for a grayscale or RGB pixmap without alpha."""
+    if pix.alpha or pix.n not in (1, 3):
+        raise ValueError(f"Cannot encode a pixmap with {pix.n} channels (alpha={pix.alpha}) as PNM")
+    magic = "P5" if pix.n == 1 else "P6"
+    return f"{magic}\n{pix.width} {pix.height}\n255\n".encode("ascii")
+
+
+def run_tesseract_pixmap(pix, output="txt"):
+    """
+    Runs Tesseract on a pixmap and returns its stdout as text. The image is
+    sent through stdin as a PNM header followed by the pixmap's own sample
+    buffer (a memoryview), so the page is never copied in this process.
+    output is the Tesseract config to use: "txt" for plain text, "tsv" for word data.
+    """
+    header = pnm_header(pix)
+    cmd = [pytesseract.pytesseract.tesseract_cmd, "stdin", "stdout"]
+    if output != "txt":
+        cmd.append(output)
+
+    # stderr goes to a file so a chatty Tesseract cannot fill a pipe while
+    # the image is still being written.
+    with tempfile.TemporaryFile() as stderr:
+        try:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr)
+        except FileNotFoundError:
+            raise pytesseract.TesseractNotFoundError()
+        feeder = threading.Thread(target=_feed_pnm, args=(proc.stdin, header, pix.samples_mv), daemon=True)
+        feeder.start()
+        stdout = proc.stdout.read()
+        proc.stdout.close()
+        returncode = proc.wait()
+        feeder.join()
+        if returncode != 0:
+            stderr.seek(0)
+            raise pytesseract.TesseractError(returncode, stderr.read().decode("utf-8", "replace"))
+    return stdout.decode("utf-8", "replace")
+
+
+def _feed_pnm(stream, header, samples):
+    try:
+        stream.write(header)
+        stream.write(samples)
+    except (BrokenPipeError, OSError):
+        # Tesseract exited early; its return code reports why.
+        pass
+    finally:
+        try:
+            stream.close()
+        except OSError:
+            pass
+
+
+def run_tesseract_batch(image_paths):
+    """
+    Runs one Tesseract process over several image files and returns, per
+    image, a word data dict in the format of pytesseract.image_to_data.
+    """
+    if not image_paths:
+        return []
+
+    list_path = os.path.join(os.path.dirname(image_paths[0]), "pages.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(image_paths) + "\n")
+
+    try:
+        proc = subprocess.run(
+            [pytesseract.pytesseract.tesseract_cmd, list_path, "stdout", "tsv"],
+            capture_output=True,
+        )
+    except FileNotFoundError:
+        raise pytesseract.TesseractNotFoundError()
+    if proc.returncode != 0:
+        raise pytesseract.TesseractError(proc.returncode, proc.stderr.decode("utf-8", "replace"))
+
+    # Tesseract numbers the pages of a list file from 1 in list order.
+    return parse_tesseract_tsv(proc.stdout.decode("utf-8", "replace"), len(image_paths))
+
+
+def parse_tesseract_tsv(tsv, page_count):
+    """
+    Splits Tesseract's TSV output into a word data dict per page, in the
+    format of pytesseract.image_to_data.
+    """
+    empty = lambda: {key: [] for key in ("text", "conf", "block_num", "par_num", "line_num")}
+    pages = [empty() for _ in range(page_count)]
+    rows = csv.DictReader(tsv.splitlines(), delimiter="\t", quoting=csv.QUOTE_NONE)
+    for row in rows:
+        try:
+            page = pages[int(row["page_num"]) - 1]
+        except (KeyError, TypeError, ValueError, IndexError):
+            continue
+        if row.get("level") != "5":
+            continue
+        page["text"].append(row.get("text") or "")
+        page["conf"].append(row.get("conf") or "-1")
+        page["block_num"].append(row.get("block_num"))
+        page["par_num"].append(row.get("par_num"))
+        page["line_num"].append(row.get("line_num"))
+    return pages
+
+
+def _read_batch_statuses(engine, page_refs, accept):
+    """Runs OcrEngine.read_batch and returns a (status, payload) per page, as submit_page describes."""
+    try:
+        results = engine.read_batch(page_refs, accept)
+    except pytesseract.TesseractNotFoundError:
+        return [("missing", None)] * len(page_refs)
+    except Exception as e:
+        return [("error", str(e))] * len(page_refs)
+    return [("ok", result) for result in results]
+
+
+def _resolve_batch(page_futures, statuses):
+    for future, status in zip(page_futures, statuses):
+        future.set_result(status)
+
+
+def _resolve_batch_job(page_futures, job):
+    """Resolves the page futures of a batch from its pool job, including a failed job."""
+    try:
+        statuses = job.result()
+    except Exception as e:
+        statuses = [("error", str(e))] * len(page_futures)
+    _resolve_batch(page_futures, statuses)
+
+
+def words_to_text(data):
+    """Rebuilds page text from Tesseract's word data, one output line per detected line."""
+    lines = []
+    current_line = None
+    words = []
+    for i, word in enumerate(data["text"]):
+        word = word.strip()
+        if not word:
+            continue
+        line_id = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        if line_id != current_line and words:
+            lines.append(" ".join(words))
+            words = []
+        current_line = line_id
+        words.append(word)
+    if words:
+        lines.append(" ".join(words))
+    return "\n".join(lines)
+
+
+def mean_word_confidence(data):
+    """Returns the mean confidence (0-100) of the recognized words, or 0 if there are none."""
+    confidences = [float(conf) for word, conf in zip(data["text"], data["conf"])
+                   if word.strip() and float(conf) >= 0]
+    if not confidences:
+        return 0.0
+    return sum(confidences) / len(confidences)
+
+
+# --- Worker process side ---
+_worker_engine = None
+_worker_accept = None
+
+
+def _init_worker(adaptive, tiers, min_confidence, threads_per_worker, zero_copy, embedded_images,
+                 preprocessor, blank_detector, accept):
+    """Sets up a pool worker once, so jobs only carry a file path and page index."""
+    global _worker_engine, _worker_accept
+    configure_tesseract_threads(threads_per_worker)
+    _worker_engine = OcrEngine(adaptive=adaptive, tiers=tiers, min_confidence=min_confidence,
+                               zero_copy=zero_copy, embedded_images=embedded_images, preprocessor=preprocessor,
+                               blank_detector=blank_detector)
+    _worker_accept = accept
+
+
+def _ocr_page_job(file_path, page_index):
+    """Reads one page in a worker process. See OcrEngine.submit_page for the result."""
+    try:
+        with fitz.open(file_path) as doc:
+            result = _worker_engine.read_page(doc[page_index], _worker_accept)
+    except pytesseract.TesseractNotFoundError:
+        # Returned rather than raised: this exception cannot be unpickled.
+        return "missing", None
+    except Exception as e:
+        return "error", str(e)
+    return "ok", result
+
+
+def _ocr_batch_job(page_refs):
+    """Reads a batch of pages in a worker process. Returns a (status, payload) per page."""
+    return _read_batch_statuses(_worker_engine, page_refs, _worker_accept)
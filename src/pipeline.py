@@ -0,0 +1,255 @@
+"""
+Staged pipeline behind Sorter.sort_files and Sorter.classify_many.
+
+Each document goes through four stages. Each stage runs on its own thread
+(or threads), and bounded queues connect them:
+
+    scanner -> extraction -> matching -> results (the mover, in sort_files)
+
+- The scanner walks folders lazily (see src/walker.py).
+- Extraction evaluates the filename, metadata and region rules. For
+  documents those rules do not settle, it reads the text through
+  Sorter.extract_many, whose OCR engine runs image-only pages on its own
+  worker pool. Documents settled early skip matching and go straight to
+  the results.
+- match_workers threads match the text against the mapping.
+- The caller consumes the results. sort_files moves each file from its
+  own thread, so there is a single mover.
+
+Disk reads, text extraction, OCR, matching and moves of different documents
+therefore overlap. A full queue blocks the stage feeding it, so however
+large the backlog, at most queue_size documents (plus the OCR engine's
+lookahead) wait between any two stages. PyMuPDF must not be used from
+several threads at once, so every document is opened on the extraction
+thread; extraction concurrency is the OCR engine's worker count.
+"""
+
+import os
+import queue
+import threading
+
+from src import text_cache
+from src import walker
+
+DEFAULT_QUEUE_SIZE = 32
+DEFAULT_MATCH_WORKERS = 1
+
+# Ends a queue: put by a stage once for each consumer of its output.
+_DONE = object()
+# The text of a result for a document skipped by an incremental sort.
+UNCHANGED = object()
+# How often a blocked stage checks whether the pipeline was stopped.
+_POLL_SECONDS = 0.1
+
+
+class _Stopped(Exception):
+    """Raised inside a stage when the pipeline is stopped early."""
+
+
+class SortPipeline:
+    """
+    Classifies the PDFs under a set of paths on a scanner, an extraction
+    stage and match_workers matching threads. run() yields the results to
+    the calling thread. scanned is the number of PDFs found so far.
+    Folders are walked with walker.walk_files: recursively if recursive,
+    keeping files matching the include and exclude globs, and never
+    entering the sorter's template folder.
+    """
+
+    def __init__(self, sorter, first_page_only=False, stream_pages=False, max_pages=None,
+                 queue_size=DEFAULT_QUEUE_SIZE, match_workers=DEFAULT_MATCH_WORKERS, recursive=False,
+                 include=walker.DEFAULT_INCLUDE, exclude=()):
+        self.sorter = sorter
+        self.first_page_only = first_page_only
+        self.stream_pages = stream_pages and not first_page_only
+        self.max_pages = max_pages
+        self.queue_size = max(1, queue_size)
+        self.match_workers = max(1, match_workers)
+        self.recursive = recursive
+        self.include = include
+        self.exclude = exclude
+        self.scanned = 0
+        self.unchanged = 0
+        # Pages read per document, as the template index records it (0: all).
+        self.pages_read = 1 if first_page_only else (max_pages or 0)
+        self.incremental = sorter.incremental and sorter.template_index is not None
+        self._stop = threading.Event()
+        self._error = None
+
+    def run(self, paths):
+        """
+        Yields (file_path, match, text, complete) for each PDF in paths,
+        which are files or folders (walked as set up in the constructor).
+        match is a MatchResult or None. text is the text that was read, None
+        if it was not read or was streamed, or UNCHANGED for a document an
+        incremental sort skipped (see _unchanged). complete is False if the
+        document, or a page or region of it that was needed, could not be
+        read or OCRed, so finding no match is not a final outcome. Documents
+        come out roughly in scan order. If the caller stops early, the stages
+        are stopped too.
+        """
+        # Compile the mapping once, before the stages share it.
+        self.sorter.compiled
+        file_paths = queue.Queue(self.queue_size)
+        texts = queue.Queue(self.queue_size)
+        results = queue.Queue(self.queue_size)
+        stages = [(self._scan, (paths, file_paths)), (self._extract, (file_paths, texts, results))]
+        stages += [(self._match, (texts, results))] * self.match_workers
+        threads = [threading.Thread(target=self._run_stage, args=stage, daemon=True) for stage in stages]
+        for thread in threads:
+            thread.start()
+        try:
+            finished = 0
+            while finished < self.match_workers:
+                item = self._get(results)
+                if item is _DONE:
+                    finished += 1
+                else:
+                    yield item
+        except _Stopped:
+            pass
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _run_stage(self, stage, args):
+        """Runs a stage; an unexpected error stops the whole pipeline and is raised from run()."""
+        try:
+            stage(*args)
+        except _Stopped:
+            pass
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+            self._stop.set()
+
+    def _put(self, q, item):
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                q.put(item, timeout=_POLL_SECONDS)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, q):
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                return q.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                pass
+
+    def _report(self, message):
+        if self.sorter.status_callback:
+            self.sorter.status_callback(message)
+
+    def _scan(self, paths, file_paths):
+        """Scanner stage: puts the PDFs under each path on file_paths, walking folders lazily."""
+        def report_error(error):
+            self._report(f"Error scanning {getattr(error, 'filename', None) or error}: {error}")
+
+        for path in paths:
+            if os.path.isdir(path):
+                self._report(f"Sorting folder: {path}")
+                found = walker.walk_files(path, include=self.include, exclude=self.exclude, recursive=self.recursive,
+                                          skip_dirs=[self.sorter.template_dir], on_error=report_error)
+            elif os.path.isfile(path):
+                found = [path]
+            else:
+                continue
+            for file_path in found:
+                self.scanned += 1
+                self._put(file_paths, file_path)
+        self._put(file_paths, _DONE)
+
+    def _extract(self, file_paths, texts, results):
+        """
+        Extraction stage: settles what it can without reading the text, and
+        reads the rest. Settled documents (and, with stream_pages, all
+        documents) go to results; extracted text goes to texts.
+        """
+        sorter = self.sorter
+        early_hits = {}
+
+        def to_read():
+            while True:
+                file_path = self._get(file_paths)
+                if file_path is _DONE:
+                    return
+                self._report(f"Scanning: {file_path}")
+                if self.incremental and self._unchanged(file_path):
+                    self.unchanged += 1
+                    self._put(results, (file_path, None, UNCHANGED, True))
+                    continue
+                early_match, complete = None, True
+                if sorter.compiled.has_pretext_rules:
+                    early_match, complete = sorter._match_before_text(file_path)
+                if not sorter._needs_document_text(early_match):
+                    self._put(results, (file_path, early_match, None, complete))
+                    continue
+                early_hits[file_path] = early_match, complete
+                yield file_path
+
+        if not sorter.compiled.document_indices:
+            # Every document is settled by the rules checked before reading text.
+            for _ in to_read():
+                pass
+        elif self.stream_pages:
+            for file_path in to_read():
+                early_match, complete = early_hits.pop(file_path)
+                streamed = self._safely(file_path, sorter._match_streaming, file_path, self.max_pages)
+                if streamed is not False:
+                    match, read = streamed
+                    self._put(results, (file_path, sorter._first_match(early_match, match), None, complete and read))
+        else:
+            extracted = sorter.extract_many(to_read(), first_page_only=self.first_page_only, max_pages=self.max_pages)
+            for file_path, text in extracted:
+                early_match, complete = early_hits.pop(file_path, (None, True))
+                self._put(texts, (file_path, early_match, text, complete and getattr(text, "complete", True)))
+        for _ in range(self.match_workers):
+            self._put(texts, _DONE)
+
+    def _unchanged(self, file_path):
+        """
+        True if an earlier sort reading as many pages found no match for
+        this document (by content and name), and no new or edited rule
+        since could match it.
+        """
+        sorter = self.sorter
+        index = sorter.template_index
+        try:
+            digest = text_cache.digest(file_path, sorter.text_cache)
+        except OSError:
+            return False
+        version = index.unmatched_version(digest, os.path.basename(file_path), self.pages_read)
+        return version is not None and index.still_decides(None, version, sorter.mapping_data, sorter.approximate)
+
+    def _match(self, texts, results):
+        """Matching stage: matches extracted text and puts the result on results."""
+        sorter = self.sorter
+        while True:
+            item = self._get(texts)
+            if item is _DONE:
+                break
+            file_path, early_match, text, complete = item
+            match = None
+            if text:
+                match = self._safely(file_path, sorter.match_text, text)
+                if match is False:
+                    continue
+            self._put(results, (file_path, sorter._first_match(early_match, match), text, complete))
+        self._put(results, _DONE)
+
+    def _safely(self, file_path, function, *args, **kwargs):
+        """Calls function, reporting an error for file_path and returning False if it raises."""
+        try:
+            return function(*args, **kwargs)
+        except Exception as e:
+            self._report(f"Error processing {os.path.basename(file_path)}: {e}")
+            return False
@@ -0,0 +1,215 @@
+"""
+Plan-then-apply sorting.
+
+sort_files classifies and moves each document in one go. For a large
+backlog it can be worth computing the whole sort first, reviewing it and
+only then moving anything: write_plan classifies every PDF (through
+Sorter.classify_many, so with the same OCR pool and text cache as a sort)
+and writes one JSON line per document with its source path, destination
+path, matching rule and content hash. apply_plan then performs the moves.
+
+Moves are grouped by destination folder, each folder is created once, and
+the renames run on a thread pool. Applying a plan again is safe: entries
+whose file (with the planned hash) is already at its destination are
+counted as done, and a source whose content no longer matches the planned
+hash is left where it is. Nothing is overwritten: a destination that is
+taken by another file, or by an earlier entry of the same plan (e.g. two
+scan001.pdf from different folders), is a conflict and the source stays.
+write_plan reports such duplicate destinations when planning.
+"""
+
+import os
+import json
+import time
+import shutil
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from src import text_cache
+
+PLAN_FORMAT_VERSION = 1
+DEFAULT_APPLY_WORKERS = 8
+
+# Outcomes of applying one plan entry.
+OUTCOME_MOVED = "moved"
+OUTCOME_DONE = "done"            # Already at its destination from an earlier run.
+OUTCOME_UNMATCHED = "unmatched"  # No rule matched; the file stays.
+OUTCOME_MISSING = "missing"      # Neither at its source nor its destination.
+OUTCOME_CHANGED = "changed"      # The source's content differs from the plan.
+OUTCOME_CONFLICT = "conflict"    # Another file has, or is planned to take, the destination.
+OUTCOME_FAILED = "failed"
+
+
+class PlanEntry:
+    """One document in a plan: where it is, where it goes (None if unmatched), the rule key and its SHA-256."""
+
+    __slots__ = ("source", "dest", "rule", "hash")
+
+    def __init__(self, source, dest, rule, hash):
+        self.source = source
+        self.dest = dest
+        self.rule = rule
+        self.hash = hash
+
+    def to_dict(self):
+        return {"source": self.source, "dest": self.dest, "rule": self.rule, "hash": self.hash}
+
+    def __repr__(self):
+        return f"PlanEntry({self.source!r} -> {self.dest!r}, rule={self.rule!r})"
+
+
+def write_plan(sorter, folders_to_sort, plan_path, first_page_only=False, stream_pages=False, max_pages=None):
+    """
+    Classifies the PDFs in the given folders with the sorter and writes the
+    plan to plan_path without moving anything. The first line of the file
+    is a header; each following line is a PlanEntry as JSON. Returns a
+    Counter with the number of "matched" and "unmatched" documents, and of
+    matched ones whose destination an earlier document already takes
+    ("conflict"; apply_plan leaves them in place).
+    """
+    counts = Counter()
+    # Planned destinations, by normalized path, with the source planned there.
+    planned = {}
+    folders = [folder for folder in folders_to_sort if os.path.isdir(folder)]
+    temp_path = plan_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        header = {
+            "format": PLAN_FORMAT_VERSION,
+            "mapping": os.path.abspath(sorter.mapping_path),
+            "template_dir": os.path.abspath(sorter.template_dir),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        f.write(json.dumps(header) + "\n")
+        for file_path, match in sorter.classify_many(folders, first_page_only=first_page_only,
+                                                     stream_pages=stream_pages, max_pages=max_pages):
+            try:
+                digest = text_cache.digest(file_path, sorter.text_cache)
+            except OSError as e:
+                if sorter.status_callback:
+                    sorter.status_callback(f"Error processing {os.path.basename(file_path)}: {e}")
+                continue
+            source = os.path.abspath(file_path)
+            if match is not None and match.dest:
+                dest = os.path.join(header["template_dir"], match.dest, os.path.basename(file_path))
+                entry = PlanEntry(source, dest, match.key, digest)
+                counts["matched"] += 1
+                first = planned.setdefault(os.path.normcase(dest), source)
+                if first != source:
+                    counts["conflict"] += 1
+                    if sorter.status_callback:
+                        sorter.status_callback(f"Conflict: {source} and {first} are both planned to go to {dest}")
+            else:
+                entry = PlanEntry(source, None, None, digest)
+                counts["unmatched"] += 1
+            f.write(json.dumps(entry.to_dict()) + "\n")
+    # Only a complete plan replaces an earlier one.
+    os.replace(temp_path, plan_path)
+    if sorter.status_callback:
+        sorter.status_callback(f"Plan written to {plan_path}. Matched: {counts['matched']}, Unmatched: {counts['unmatched']}"
+                               + (f", Conflicts: {counts['conflict']}" if counts["conflict"] else ""))
+    return counts
+
+
+def read_plan(plan_path):
+    """Returns (header, entries) from a plan file. Raises ValueError for a file that is not a plan this version reads."""
+    with open(plan_path, "r", encoding="utf-8") as f:
+        try:
+            header = json.loads(f.readline())
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Not a sort plan: {plan_path}") from e
+        if not isinstance(header, dict) or header.get("format") != PLAN_FORMAT_VERSION:
+            raise ValueError(f"Unsupported sort plan format in {plan_path}")
+        entries = []
+        for line in f:
+            if line.strip():
+                data = json.loads(line)
+                entries.append(PlanEntry(data["source"], data.get("dest"), data.get("rule"), data.get("hash")))
+    return header, entries
+
+
+def _move(source, dest):
+    """Renames source to dest, copying across file systems when a rename cannot."""
+    try:
+        os.replace(source, dest)
+    except OSError:
+        if not os.path.exists(source):
+            raise
+        shutil.move(source, dest)
+
+
+def _apply_entry(entry, verify, cache):
+    """Applies one plan entry; returns one of the OUTCOME_* values."""
+    if entry.dest is None:
+        return OUTCOME_UNMATCHED
+    check_hash = verify and entry.hash
+    if not os.path.exists(entry.source):
+        if not os.path.exists(entry.dest):
+            return OUTCOME_MISSING
+        if check_hash and text_cache.digest(entry.dest, cache) != entry.hash:
+            # Some other file has the name; this entry's file went elsewhere.
+            return OUTCOME_MISSING
+        return OUTCOME_DONE
+    if check_hash and text_cache.digest(entry.source, cache) != entry.hash:
+        return OUTCOME_CHANGED
+    if os.path.exists(entry.dest):
+        return OUTCOME_CONFLICT
+    _move(entry.source, entry.dest)
+    return OUTCOME_MOVED
+
+
+def apply_plan(plan_path, workers=DEFAULT_APPLY_WORKERS, verify=True, cache=None, status_callback=None):
+    """
+    Performs the moves of a plan written by write_plan. Destination folders
+    are created once each, then the files are renamed on a pool of workers,
+    one destination folder after another. With verify, a source is only
+    moved if its content still has the planned hash (the text cache, if
+    given, saves re-hashing unchanged files). Only the first entry planned to
+    a destination is applied; later ones are conflicts, so no two workers
+    ever rename onto the same path. Returns a Counter of outcomes.
+    """
+    _, entries = read_plan(plan_path)
+    by_folder = {}
+    duplicates = []
+    planned = set()
+    for entry in entries:
+        if entry.dest is not None:
+            dest = os.path.normcase(entry.dest)
+            if dest in planned:
+                duplicates.append(entry)
+                continue
+            planned.add(dest)
+        by_folder.setdefault(None if entry.dest is None else os.path.dirname(entry.dest), []).append(entry)
+
+    counts = Counter(OUTCOME_UNMATCHED for _ in by_folder.pop(None, ()))
+    for entry in duplicates:
+        counts[OUTCOME_CONFLICT] += 1
+        if status_callback:
+            status_callback(f"Skipped {os.path.basename(entry.source)}: an earlier entry is planned to {entry.dest}")
+    for folder in by_folder:
+        os.makedirs(folder, exist_ok=True)
+
+    def apply(entry):
+        try:
+            return entry, _apply_entry(entry, verify, cache), None
+        except Exception as e:
+            return entry, OUTCOME_FAILED, e
+
+    ordered = [entry for folder_entries in by_folder.values() for entry in folder_entries]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for entry, outcome, error in executor.map(apply, ordered):
+            counts[outcome] += 1
+            if status_callback is None:
+                continue
+            filename = os.path.basename(entry.source)
+            if outcome == OUTCOME_FAILED:
+                status_callback(f"Error processing {filename}: {error}")
+            elif outcome == OUTCOME_CHANGED:
+                status_callback(f"Skipped {filename}: it changed since the plan was made")
+            elif outcome == OUTCOME_MISSING:
+                status_callback(f"Skipped {filename}: not found")
+            elif outcome == OUTCOME_CONFLICT:
+                status_callback(f"Skipped {filename}: another file is already at {entry.dest}")
+
+    if status_callback:
+        status_callback("Plan applied. " + ", ".join(f"{outcome.capitalize()}: {count}" for outcome, count in sorted(counts.items())))
+    return counts
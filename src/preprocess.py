@@ -0,0 +1,271 @@
+"""
+Image preprocessing for OCR.
+
+Tesseract's run time grows with image area and noise. The Preprocessor
+works on the page pixmap as a NumPy array, between rendering and OCR, and
+can crop the page to its content, binarize it against the local background
+and straighten a slight skew. Each step can be turned off and is timed, so
+its effect on OCR latency and match rate can be measured.
+
+The BlankPageDetector looks at a small grayscale render of a page and tells
+blank pages and barcode/patch-code separator sheets apart from pages worth
+sending to OCR.
+"""
+
+import time
+from collections import Counter
+
+import fitz  # PyMuPDF
+
+# NumPy is optional; without it pages go to OCR unprocessed.
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+STEPS = ("crop", "binarize", "deskew")
+
+# Gray level below which a pixel counts as ink when cropping and deskewing.
+INK_THRESHOLD = 160
+# Rows or columns with less ink than this share of the image are treated as noise.
+NOISE_FRACTION = 0.002
+# White border kept around the content after cropping, in pixels.
+CROP_MARGIN = 10
+# A pixel is black if it is this much darker than the mean of its neighbourhood.
+BINARIZE_SENSITIVITY = 0.15
+# Side of the pixel blocks the neighbourhood means are computed over.
+BINARIZE_BLOCK = 4
+# Skew angles tried by deskew, in degrees.
+MAX_SKEW_DEGREES = 5.0
+SKEW_STEP_DEGREES = 0.25
+
+# Resolution of the render used to screen pages for blanks and separators.
+SCREEN_DPI = 50
+# Share of the page width/height along each edge ignored as scanner shadow.
+SCREEN_BORDER = 0.03
+# A page with less ink than this share of its pixels is blank. Kept low, since
+# a page holding a single short word must still be read.
+BLANK_INK_FRACTION = 0.0001
+# A separator's ink is mostly solid vertical bars: columns at least this full
+# within the ink band, making up this share of the inked columns.
+BAR_FILL = 0.7
+BAR_COLUMN_SHARE = 0.6
+MIN_BARS = 3
+# Pages with more ink than this share are never separators.
+MAX_SEPARATOR_INK_FRACTION = 0.25
+
+
+class Preprocessor:
+    """
+    Crops, binarizes and deskews page pixmaps for OCR. Each step is enabled
+    by its keyword argument. process() returns a grayscale pixmap and the
+    seconds spent in each step.
+    """
+
+    def __init__(self, crop=True, binarize=True, deskew=True):
+        self.crop = crop
+        self.binarize = binarize
+        self.deskew = deskew
+        # Totals over the pages recorded with add_timings.
+        self.timings = Counter()
+        self.pages = 0
+
+    @classmethod
+    def from_steps(cls, steps):
+        """Builds a Preprocessor with only the named steps (see STEPS) enabled."""
+        steps = set(steps)
+        unknown = steps.difference(STEPS)
+        if unknown:
+            raise ValueError(f"Unknown preprocessing step(s): {', '.join(sorted(unknown))}")
+        return cls(**{step: step in steps for step in STEPS})
+
+    @property
+    def enabled(self):
+        """True if NumPy is available and at least one step is on."""
+        return NUMPY_AVAILABLE and (self.crop or self.binarize or self.deskew)
+
+    def process(self, pix):
+        """
+        Runs the enabled steps on a gray or RGB pixmap. Returns the processed
+        grayscale pixmap and a dict of seconds per step.
+        """
+        times = {}
+        if not self.enabled:
+            return pix, times
+
+        start = time.perf_counter()
+        gray = _gray_array(pix)
+        times["convert"] = time.perf_counter() - start
+
+        for step, function in (("crop", crop_to_content), ("deskew", deskew), ("binarize", binarize)):
+            if getattr(self, step):
+                start = time.perf_counter()
+                gray = function(gray)
+                times[step] = time.perf_counter() - start
+
+        height, width = gray.shape
+        out = fitz.Pixmap(fitz.csGRAY, width, height, np.ascontiguousarray(gray).tobytes(), False)
+        out.set_dpi(pix.xres, pix.yres)
+        return out, times
+
+    def add_timings(self, times):
+        """Adds the step times of one page to the totals."""
+        if times:
+            self.pages += 1
+            self.timings.update(times)
+
+    def timing_summary(self):
+        """Returns the mean milliseconds per page of each step."""
+        if not self.pages:
+            return "no pages preprocessed"
+        return ", ".join(f"{step}: {self.timings[step] * 1000 / self.pages:.1f} ms"
+                         for step in ("convert",) + STEPS if step in self.timings)
+
+
+def _gray_array(pix):
+    """Returns the pixmap as a 2-D uint8 array, a view of its samples if it is already gray."""
+    samples = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    if pix.n == 1:
+        return samples[:, :, 0]
+    # ITU-R 601 luma, in integers.
+    rgb = samples[:, :, :3].astype(np.uint16)
+    return ((rgb[:, :, 0] * 77 + rgb[:, :, 1] * 150 + rgb[:, :, 2] * 29) >> 8).astype(np.uint8)
+
+
+def crop_to_content(gray):
+    """Crops a gray image to the bounding box of its ink, plus CROP_MARGIN."""
+    ink = gray < INK_THRESHOLD
+    height, width = gray.shape
+    rows = np.flatnonzero(ink.sum(axis=1) > max(1, width * NOISE_FRACTION))
+    cols = np.flatnonzero(ink.sum(axis=0) > max(1, height * NOISE_FRACTION))
+    if rows.size == 0 or cols.size == 0:
+        return gray
+    top = max(0, rows[0] - CROP_MARGIN)
+    bottom = min(height, rows[-1] + CROP_MARGIN + 1)
+    left = max(0, cols[0] - CROP_MARGIN)
+    right = min(width, cols[-1] + CROP_MARGIN + 1)
+    return gray[top:bottom, left:right]
+
+
+def binarize(gray, window=None, sensitivity=BINARIZE_SENSITIVITY):
+    """
+    Adaptive (Bradley) binarization: a pixel becomes black if it is darker
+    than the mean of the window around it by the given fraction. The local
+    means come from an integral image of the page reduced by BINARIZE_BLOCK,
+    since the background varies slowly, so the cost is a few passes over the
+    page whatever the window size.
+    """
+    height, width = gray.shape
+    if window is None:
+        window = max(15, min(height, width) // 40)
+    block = BINARIZE_BLOCK
+    half = max(1, window // (2 * block))
+
+    padded = np.pad(gray, ((0, -height % block), (0, -width % block)), mode="edge")
+    rows, cols = padded.shape[0] // block, padded.shape[1] // block
+    small = padded.reshape(rows, block, cols, block).sum(axis=(1, 3), dtype=np.uint32)
+
+    integral = np.zeros((rows + 1, cols + 1), dtype=np.int64)
+    np.cumsum(np.cumsum(small, axis=0, dtype=np.int64), axis=1, out=integral[1:, 1:])
+    y0 = np.clip(np.arange(rows) - half, 0, rows)
+    y1 = np.clip(np.arange(rows) + half + 1, 0, rows)
+    x0 = np.clip(np.arange(cols) - half, 0, cols)
+    x1 = np.clip(np.arange(cols) + half + 1, 0, cols)
+    sums = integral[y1][:, x1] - integral[y0][:, x1] - integral[y1][:, x0] + integral[y0][:, x0]
+    areas = (y1 - y0)[:, None] * (x1 - x0)[None, :] * block * block
+    thresholds = (sums * (1 - sensitivity) / areas).astype(np.float32)
+
+    thresholds = np.repeat(np.repeat(thresholds, block, axis=0), block, axis=1)[:height, :width]
+    return np.where(gray < thresholds, 0, 255).astype(np.uint8)
+
+
+def estimate_skew(gray, max_degrees=MAX_SKEW_DEGREES, step=SKEW_STEP_DEGREES):
+    """
+    Estimates the skew of text lines in degrees by projection profiles: the
+    angle whose sheared ink rows are the most sharply peaked wins. Works on
+    a subsample of the ink pixels, so it stays cheap on large pages.
+    """
+    ys, xs = np.nonzero(gray[::2, ::2] < INK_THRESHOLD)
+    if ys.size < 100:
+        return 0.0
+    if ys.size > 200000:
+        keep = np.linspace(0, ys.size - 1, 200000).astype(np.intp)
+        ys, xs = ys[keep], xs[keep]
+
+    best_angle, best_score = 0.0, -1
+    for angle in np.arange(-max_degrees, max_degrees + step / 2, step):
+        shifted = np.round(ys - xs * np.tan(np.radians(angle))).astype(np.int64)
+        counts = np.bincount(shifted - shifted.min())
+        score = int(np.dot(counts, counts))
+        if score > best_score or (score == best_score and abs(angle) < abs(best_angle)):
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def deskew(gray, angle=None):
+    """
+    Straightens text lines skewed by a small angle (estimated if not given).
+    Uses a vertical shear, which for a few degrees is indistinguishable from
+    a rotation to Tesseract and needs a single gather over the image.
+    """
+    if angle is None:
+        angle = estimate_skew(gray)
+    if abs(angle) < SKEW_STEP_DEGREES / 2:
+        return gray
+    height, width = gray.shape
+    offsets = np.round(np.arange(width) * np.tan(np.radians(angle))).astype(np.int64)
+    source_rows = np.arange(height)[:, None] + offsets[None, :]
+    inside = (source_rows >= 0) & (source_rows < height)
+    straightened = gray[np.clip(source_rows, 0, height - 1), np.arange(width)[None, :]]
+    return np.where(inside, straightened, 255).astype(np.uint8)
+
+
+class BlankPageDetector:
+    """
+    Classifies pages as "blank", "separator" or None (worth OCRing) from a
+    grayscale render at a low DPI. Without NumPy nothing is classified.
+    """
+
+    def __init__(self, dpi=SCREEN_DPI, ink_fraction=BLANK_INK_FRACTION, detect_separators=True):
+        self.dpi = dpi
+        self.ink_fraction = ink_fraction
+        self.detect_separators = detect_separators
+
+    def classify(self, page):
+        """Returns "blank", "separator" or None for a PyMuPDF page."""
+        if not NUMPY_AVAILABLE:
+            return None
+        pix = page.get_pixmap(dpi=self.dpi, colorspace=fitz.csGRAY)
+        return self.classify_array(_gray_array(pix))
+
+    def classify_array(self, gray):
+        """Returns "blank", "separator" or None for a 2-D uint8 page image."""
+        height, width = gray.shape
+        dy, dx = int(height * SCREEN_BORDER), int(width * SCREEN_BORDER)
+        ink = gray[dy:height - dy, dx:width - dx] < INK_THRESHOLD
+        if ink.size == 0:
+            return "blank"
+        coverage = ink.mean()
+        if coverage < self.ink_fraction:
+            return "blank"
+        if self.detect_separators and coverage < MAX_SEPARATOR_INK_FRACTION and _is_bar_code(ink):
+            return "separator"
+        return None
+
+
+def _is_bar_code(ink):
+    """True if the ink is mostly solid vertical bars in one horizontal band, like a barcode or patch code."""
+    # The band is the run of rows as busy as the busiest one, which leaves
+    # out a caption printed under the code.
+    row_ink = ink.sum(axis=1)
+    rows = np.flatnonzero(row_ink >= row_ink.max() / 2)
+    band = ink[rows[0]:rows[-1] + 1]
+    column_ink = band.sum(axis=0)
+    inked = column_ink > 0
+    solid = column_ink >= BAR_FILL * band.shape[0]
+    if solid.sum() < BAR_COLUMN_SHARE * inked.sum():
+        return False
+    # Count the runs of solid columns.
+    bars = np.count_nonzero(solid[1:] & ~solid[:-1]) + int(solid[0])
+    return bars >= MIN_BARS
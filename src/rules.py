@@ -0,0 +1,284 @@
+"""
+Compound rule expressions.
+
+An expression rule (a rule with "type": "expression") uses its key as a
+small boolean language over phrases instead of a single phrase:
+
+    invoice AND (total OR "amount due") AND NOT "credit note"
+    purchase NEAR/3 order
+
+Adjacent words form one phrase, quotes make that explicit, and the
+operators AND, OR, NOT and NEAR/n (both phrases within n words of each
+other, in either order) are written in capitals. NOT binds tightest, then
+NEAR, AND, and OR; parentheses group.
+
+Each expression is compiled once into a plan: the operands of every AND
+and OR are ordered so the one most likely to decide the result, per unit
+of cost, runs first, and evaluation stops as soon as the result is known.
+Phrase lookups are shared by all rules evaluated against one text.
+
+Without NOT, an expression that holds for part of a document holds for all
+of it. A plan's has_not says it uses NOT, so a caller reading a document
+page by page knows a result may still be overturned by a later page.
+"""
+
+import re
+
+from src.matcher import normalize_text
+
+# Estimated cost of evaluating a node, relative to one substring search.
+TERM_COST = 1.0
+NEAR_COST = 4.0
+
+_TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|(NEAR/(\d+))\b|(AND|OR|NOT)\b|([^\s()"]+))')
+
+
+class RuleSyntaxError(ValueError):
+    """Raised for an expression that cannot be parsed."""
+
+
+def _term_probability(phrase):
+    """A rough chance that a phrase occurs in a document: longer phrases are rarer."""
+    return min(0.9, 2.0 ** (-len(phrase) / 4.0))
+
+
+class TextTerms:
+    """
+    The phrase lookups for one normalized text, computed on first use and
+    shared by every rule evaluated against it.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self._offsets = {}
+        self._positions = {}
+        self._word_starts = None
+
+    def offset(self, phrase):
+        """Returns the offset of the phrase's first occurrence, or -1."""
+        offset = self._offsets.get(phrase)
+        if offset is None:
+            offset = self._offsets[phrase] = self.text.find(phrase)
+        return offset
+
+    def word_positions(self, phrase):
+        """Returns the word numbers at which the phrase occurs, in order."""
+        positions = self._positions.get(phrase)
+        if positions is not None:
+            return positions
+        positions = []
+        start = self.offset(phrase)
+        if start >= 0:
+            if self._word_starts is None:
+                self._word_starts = [0] + [m.end() for m in re.finditer(" ", self.text)]
+            starts = self._word_starts
+            word = 0
+            while start >= 0:
+                while word + 1 < len(starts) and starts[word + 1] <= start:
+                    word += 1
+                positions.append(word)
+                start = self.text.find(phrase, start + 1)
+        self._positions[phrase] = positions
+        return positions
+
+
+class Term:
+    """A phrase that must occur in the text."""
+
+    def __init__(self, phrase):
+        self.phrase = phrase
+        self.probability = _term_probability(phrase)
+        self.cost = TERM_COST
+        self.has_not = False
+
+    def evaluate(self, terms):
+        """Returns the offset of the match, or None."""
+        offset = terms.offset(self.phrase)
+        return offset if offset >= 0 else None
+
+
+class Not:
+    """True when the operand is false."""
+
+    def __init__(self, operand):
+        self.operand = operand
+        self.probability = 1.0 - operand.probability
+        self.cost = operand.cost
+        self.has_not = True
+
+    def evaluate(self, terms):
+        # A negation has no position of its own; 0 only marks it as true.
+        return None if self.operand.evaluate(terms) is not None else 0
+
+
+class Near:
+    """Two phrases within a number of words of each other, in either order."""
+
+    def __init__(self, left, right, distance):
+        if not isinstance(left, Term) or not isinstance(right, Term):
+            raise RuleSyntaxError("NEAR only joins phrases")
+        self.left = left
+        self.right = right
+        self.distance = distance
+        self.probability = left.probability * right.probability
+        self.cost = NEAR_COST
+        self.has_not = False
+        # Both phrases must occur; the rarer is checked first, which settles most texts.
+        self._checks = sorted((left, right), key=lambda term: term.probability)
+
+    def evaluate(self, terms):
+        if any(term.evaluate(terms) is None for term in self._checks):
+            return None
+        right_positions = terms.word_positions(self.right.phrase)
+        left_length = len(self.left.phrase.split())
+        right_length = len(self.right.phrase.split())
+        j = 0
+        for left in terms.word_positions(self.left.phrase):
+            while j < len(right_positions) and right_positions[j] + right_length + self.distance < left:
+                j += 1
+            if j < len(right_positions) and right_positions[j] <= left + left_length + self.distance:
+                return terms.offset(self.left.phrase)
+        return None
+
+
+class And:
+    """True when every operand is; operands run most likely to fail per cost first."""
+
+    def __init__(self, operands):
+        self.operands = sorted(operands, key=lambda node: node.cost / max(1.0 - node.probability, 1e-6))
+        self.probability = 1.0
+        for node in operands:
+            self.probability *= node.probability
+        self.cost = sum(node.cost for node in operands)
+        self.has_not = any(node.has_not for node in operands)
+
+    def evaluate(self, terms):
+        offset = None
+        for node in self.operands:
+            hit = node.evaluate(terms)
+            if hit is None:
+                return None
+            if not isinstance(node, Not):
+                offset = hit if offset is None else min(offset, hit)
+        return 0 if offset is None else offset
+
+
+class Or:
+    """True when any operand is; operands run most likely to succeed per cost first."""
+
+    def __init__(self, operands):
+        self.operands = sorted(operands, key=lambda node: node.cost / max(node.probability, 1e-6))
+        missing = 1.0
+        for node in operands:
+            missing *= 1.0 - node.probability
+        self.probability = 1.0 - missing
+        self.cost = sum(node.cost for node in operands)
+        self.has_not = any(node.has_not for node in operands)
+
+    def evaluate(self, terms):
+        for node in self.operands:
+            hit = node.evaluate(terms)
+            if hit is not None:
+                return hit
+        return None
+
+
+def _tokenize(expression):
+    """Splits an expression into (kind, value) tokens."""
+    tokens = []
+    pos = 0
+    expression = expression.strip()
+    while pos < len(expression):
+        m = _TOKEN_RE.match(expression, pos)
+        if not m or m.end() == pos:
+            raise RuleSyntaxError(f"Cannot parse expression at: {expression[pos:]!r}")
+        pos = m.end()
+        if m.group(1):
+            tokens.append(("(", None))
+        elif m.group(2):
+            tokens.append((")", None))
+        elif m.group(3) is not None:
+            tokens.append(("phrase", m.group(3)))
+        elif m.group(4):
+            tokens.append(("NEAR", int(m.group(5))))
+        elif m.group(6):
+            tokens.append((m.group(6), None))
+        else:
+            tokens.append(("word", m.group(7)))
+    return tokens
+
+
+class _Parser:
+    """Recursive-descent parser: or := and (OR and)*, and := near (AND near)*, near := not (NEAR/n not)*, not := NOT not | atom."""
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+
+    def parse(self):
+        node = self._or()
+        if self.pos != len(self.tokens):
+            raise RuleSyntaxError(f"Unexpected {self.tokens[self.pos][0]!r} in {self.expression!r}")
+        return node
+
+    def _peek(self):
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def _or(self):
+        operands = [self._and()]
+        while self._peek() == "OR":
+            self.pos += 1
+            operands.append(self._and())
+        return operands[0] if len(operands) == 1 else Or(operands)
+
+    def _and(self):
+        operands = [self._near()]
+        while self._peek() == "AND":
+            self.pos += 1
+            operands.append(self._near())
+        return operands[0] if len(operands) == 1 else And(operands)
+
+    def _near(self):
+        node = self._not()
+        while self._peek() == "NEAR":
+            distance = self.tokens[self.pos][1]
+            self.pos += 1
+            node = Near(node, self._not(), distance)
+        return node
+
+    def _not(self):
+        if self._peek() == "NOT":
+            self.pos += 1
+            return Not(self._not())
+        return self._atom()
+
+    def _atom(self):
+        kind = self._peek()
+        if kind == "(":
+            self.pos += 1
+            node = self._or()
+            if self._peek() != ")":
+                raise RuleSyntaxError(f"Missing ')' in {self.expression!r}")
+            self.pos += 1
+            return node
+        if kind == "phrase":
+            phrase = self.tokens[self.pos][1]
+            self.pos += 1
+        elif kind == "word":
+            words = []
+            while self._peek() == "word":
+                words.append(self.tokens[self.pos][1])
+                self.pos += 1
+            phrase = " ".join(words)
+        else:
+            raise RuleSyntaxError(f"Expected a phrase in {self.expression!r}")
+        phrase = normalize_text(phrase)
+        if not phrase:
+            raise RuleSyntaxError(f"Empty phrase in {self.expression!r}")
+        return Term(phrase)
+
+
+def compile_expression(expression):
+    """Parses an expression into its evaluation plan. Raises RuleSyntaxError."""
+    return _Parser(expression).parse()
@@ -1,22 +1,79 @@
 import os
 import shutil
+from collections import deque
 import fitz  # PyMuPDF
 
 from src import utils
+from src import matcher
+from src import compiled_mapping
+from src import ocr
+from src import text_cache
+from src import pipeline
+from src import walker
 
 # Attempt to import OCR libraries. If they fail, OCR will be disabled.
 try:
-    from PIL import Image
     import pytesseract
     OCR_AVAILABLE = True
 except ImportError:
     OCR_AVAILABLE = False
 
+class PdfText(str):
+    """
+    The text of a PDF as read_pdf_text and extract_many return it: the
+    pages' text joined and stripped. It also keeps the pages, as a list of
+    (page_number, text), so the page of a match can be told. complete is
+    False if the document could not be opened or some page to read could
+    not be (e.g. OCR failed), so finding no match in it is not final.
+    """
+
+    def __new__(cls, pages, complete=True):
+        self = super().__new__(cls, "".join(text for _, text in pages).strip())
+        self.pages = pages
+        self.complete = complete
+        return self
+
+    def page_at(self, offset):
+        """Returns the number of the page holding an offset into the normalized text, or None."""
+        position = 0
+        page_number = None
+        for page_number, text in self.pages:
+            length = len(matcher.normalize_text(text))
+            if not length:
+                continue
+            # Normalized pages are joined by a single space.
+            position += length + 1
+            if offset < position:
+                return page_number
+        return page_number
+
 class Sorter:
-    def __init__(self, mapping_path, progress_callback=None, status_callback=None):
+    # Pages whose trimmed text layer is shorter than this (e.g. only a
+    # scanner's page stamp) are treated as image-only and OCRed.
+    MIN_TEXT_LAYER_CHARS = 10
+
+    def __init__(self, mapping_path, progress_callback=None, status_callback=None, ocr_engine=None, text_cache=None,
+                 approximate=False, queue_size=pipeline.DEFAULT_QUEUE_SIZE, match_workers=pipeline.DEFAULT_MATCH_WORKERS,
+                 template_index=None, incremental=False):
         self.mapping_path = mapping_path
         self.progress_callback = progress_callback
         self.status_callback = status_callback
+        self.ocr_engine = ocr_engine if ocr_engine is not None else ocr.OcrEngine()
+        # Optional text_cache.TextCache shared across runs; not owned by the Sorter.
+        self.text_cache = text_cache
+        # Let rules with a max_distance match phrases misread by OCR.
+        self.approximate = approximate
+        # Pipeline settings: documents waiting between stages, and matching threads.
+        self.queue_size = queue_size
+        self.match_workers = match_workers
+        # Optional template_index.TemplateIndex of the template directory,
+        # told about every file moved there; not owned by the Sorter.
+        self.template_index = template_index
+        # With a template_index, skip documents left unmatched by an earlier
+        # sort unless a new or edited rule might match them.
+        self.incremental = incremental
+        self._compiled = None
+        self._ocr_accept = None
         self.mapping_data = self.load_mapping()
         # The template directory is named after the mapping file (without .json) + "_template"
         self.template_dir = os.path.splitext(self.mapping_path)[0] + "_template"
@@ -26,197 +83,687 @@ class Sorter:
     def load_mapping(self):
         """
         Load mapping from the JSON file specified by mapping_path.
+        The compiled form is reused from the mapping cache when the file is unchanged.
         """
         if self.status_callback:
             self.status_callback(f"Loading mapping from {self.mapping_path}")
-        data = utils.MappingUtils.load_mapping(self.mapping_path)
+        self._compiled = compiled_mapping.load_compiled_mapping(self.mapping_path)
         if self.status_callback:
             self.status_callback(f"Mapping loaded from {self.mapping_path}")
-        return data
+        return self._compiled.rules
+
+    def close(self):
+        """Releases resources held between runs, such as the OCR worker pool."""
+        self.ocr_engine.close()
+
+    @property
+    def compiled(self):
+        """
+        The CompiledMapping for the current mapping_data. It comes from the
+        mapping load and is only recompiled if mapping_data is replaced.
+        """
+        if self._compiled is None or self._compiled.rules is not self.mapping_data:
+            self._compiled = compiled_mapping.CompiledMapping(self.mapping_data)
+        return self._compiled
+
+    @property
+    def ocr_accept(self):
+        """
+        The check adaptive OCR uses to reject results that match no whole-text
+        rule (a DocumentRuleCheck), or None if the mapping has no such rules.
+        The same object is returned until the mapping or mode changes, so a
+        worker pool started with it is reused.
+        """
+        compiled = self.compiled
+        check = self._ocr_accept
+        if check is None or check.compiled is not compiled or check.approximate != self.approximate:
+            check = self._ocr_accept = compiled_mapping.DocumentRuleCheck(compiled, self.approximate)
+        return check if compiled.document_indices else None
+
+    def read_pdf_text(self, file_path, first_page_only=False, max_pages=None):
+        """
+        Reads text from a PDF. Can be set to read only the first page, or at
+        most max_pages pages. Pages without a usable text layer (e.g. scanned
+        pages) fall back to OCR.
+        """
+        if first_page_only:
+            max_pages = 1
+        pages = []
+        complete = True
+        for page_number, page_text, source in self._read_pages(file_path, max_pages):
+            complete = complete and source is not None
+            if page_text.strip():
+                pages.append((page_number, page_text))
+        return PdfText(pages, complete)
 
-    def read_pdf_text(self, file_path, first_page_only=False):
+    def iter_pdf_pages(self, file_path, max_pages=None):
         """
-        Reads text from a PDF. Can be set to read only the first page.
-        If that fails (e.g., for a scanned PDF), it falls back to OCR.
+        Yields (page_number, text) for a PDF one page at a time, reading at
+        most max_pages pages from a single open document. Pages with a usable
+        text layer are read directly and only image-only pages are OCRed.
+        Pages already in the text cache are not read again. Nothing more is
+        read once the caller stops iterating.
         """
-        text = ""
+        for page_number, page_text, _ in self._read_pages(file_path, max_pages):
+            if page_text.strip():
+                yield page_number, page_text
+
+    def _read_pages(self, file_path, max_pages):
+        """
+        Yields (page_number, text, source) for every page read, serving them
+        from the text cache when it covers them and storing what was read
+        otherwise. source is text_cache.SOURCE_TEXT, SOURCE_OCR or
+        SOURCE_OCR_PROVISIONAL, or None for a page whose OCR could not run
+        (neither of the last two is ever cached). If
+        the document cannot be read (any further), a last (None, "", None)
+        says so.
+        """
+        if self.text_cache is not None:
+            cached = self.text_cache.get_pages(file_path, max_pages, self.ocr_engine.cache_key)
+            if cached is not None:
+                for page_number, (source, page_text) in enumerate(cached, start=1):
+                    yield page_number, page_text, source
+                return
+
+        pages = []
+        exhausted = False
+        try:
+            for page_number, page_text, source in self._extract_pages(file_path, max_pages):
+                pages.append((source, page_text))
+                yield page_number, page_text, source
+            exhausted = True
+        except Exception as e:
+            if self.status_callback:
+                self.status_callback(f"Error reading {os.path.basename(file_path)}: {e}")
+            yield None, "", None
+            return
+        finally:
+            # Also runs when the caller stops early, caching the pages read so far.
+            if self.text_cache is not None and (pages or exhausted):
+                complete = exhausted and (max_pages is None or len(pages) < max_pages)
+                self._store_pages(file_path, pages, complete, max_pages)
+
+    def _extract_pages(self, file_path, max_pages):
+        """Yields (page_number, text, source) for each page read from the PDF itself. See _read_pages."""
+        filename = os.path.basename(file_path)
+        ocr_enabled = OCR_AVAILABLE
+        pages_without_text = 0
+        with fitz.open(file_path) as doc:
+            if not doc:
+                return
+            pages_to_read = self._pages_to_read(doc, max_pages)
+            for page_number, page in enumerate(pages_to_read, start=1):
+                page_text = page.get_text()
+                if not self._needs_ocr(page, page_text):
+                    yield page_number, page_text, text_cache.SOURCE_TEXT
+                    continue
+
+                pages_without_text += 1
+                if ocr_enabled:
+                    if self.status_callback:
+                        self.status_callback(f"OCR page {page_number}/{len(pages_to_read)} of {filename}...")
+                    try:
+                        result = self._ocr_page(page, filename, page_number)
+                    except pytesseract.TesseractNotFoundError:
+                        if self.status_callback:
+                            self.status_callback("Tesseract not found. OCR unavailable. Please install Tesseract.")
+                        ocr_enabled = False
+                    except Exception as e:
+                        if self.status_callback:
+                            self.status_callback(f"An error occurred during OCR: {e}")
+                    else:
+                        source = self._ocr_source(result)
+                        if result.text.strip():
+                            # Keep OCRed pages from running into the next page's text.
+                            yield page_number, result.text + "\n", source
+                        else:
+                            yield page_number, page_text, source
+                        continue
+                yield page_number, page_text, None
+
+        if pages_without_text and not OCR_AVAILABLE and self.status_callback:
+            self.status_callback(f"No text on {pages_without_text} page(s) of {filename}, and OCR libraries not installed.")
+
+    def _ocr_source(self, result):
+        """The text source of a page read by OCR: provisional if it was kept at a low DPI for matching the mapping."""
+        if self.ocr_engine.is_provisional(result, self.ocr_accept):
+            return text_cache.SOURCE_OCR_PROVISIONAL
+        return text_cache.SOURCE_OCR
+
+    def _store_pages(self, file_path, pages, complete, max_pages):
+        """Saves pages read from a file to the text cache, unless some page's OCR failed or is provisional."""
+        if any(source is None or source == text_cache.SOURCE_OCR_PROVISIONAL for source, _ in pages):
+            return
+        self.text_cache.put_pages(file_path, pages, complete, first_page_only=max_pages == 1,
+                                  ocr_settings=self.ocr_engine.cache_key)
+
+    def extract_many(self, file_paths, first_page_only=False, max_pages=None):
+        """
+        Yields (file_path, text) for each PDF, in the order given. When the
+        OCR engine has worker processes or batches pages, the image-only pages
+        of this and the next few documents are submitted together and OCRed
+        while earlier ones are used.
+        """
+        if first_page_only:
+            max_pages = 1
+        if not self.ocr_engine.deferred:
+            for file_path in file_paths:
+                yield file_path, self.read_pdf_text(file_path, max_pages=max_pages)
+            return
+
+        # Documents whose OCR is in flight; results are taken from the front
+        # so output order never depends on which worker finishes first.
+        lookahead = max(2, self.ocr_engine.workers * 2) * self.ocr_engine.batch_size
+        in_flight = deque()
+        for file_path in file_paths:
+            in_flight.append((file_path, self._start_pdf_text(file_path, max_pages)))
+            if len(in_flight) >= lookahead:
+                done_path, pending = in_flight.popleft()
+                yield done_path, self._finish_pdf_text(done_path, pending, max_pages)
+        while in_flight:
+            done_path, pending = in_flight.popleft()
+            yield done_path, self._finish_pdf_text(done_path, pending, max_pages)
+
+    def _start_pdf_text(self, file_path, max_pages):
+        """
+        Reads the text layer of a PDF and submits its image-only pages to the
+        OCR engine. Returns (parts, store) for _finish_pdf_text: parts holds a
+        (page_number, source, text, OCR future or None) per page, or is None
+        if the document could not be read, and store says whether the result
+        should be written to the text cache.
+        """
+        if self.text_cache is not None:
+            cached = self.text_cache.get_pages(file_path, max_pages, self.ocr_engine.cache_key)
+            if cached is not None:
+                parts = [(page_number, source, page_text, None) for page_number, (source, page_text) in enumerate(cached, start=1)]
+                return parts, False
+
+        parts = []
         try:
-            # 1. First, try direct text extraction
             with fitz.open(file_path) as doc:
                 if not doc:
-                    return ""
-                
-                if first_page_only:
-                    text = doc[0].get_text().strip()
-                else:
-                    text = "".join(page.get_text() for page in doc).strip()
+                    return parts, True
+                for page_index, page in enumerate(self._pages_to_read(doc, max_pages)):
+                    page_text = page.get_text()
+                    if not self._needs_ocr(page, page_text):
+                        parts.append((page_index + 1, text_cache.SOURCE_TEXT, page_text, None))
+                    else:
+                        future = self.ocr_engine.submit_page(file_path, page_index, self.ocr_accept)
+                        parts.append((page_index + 1, text_cache.SOURCE_OCR, page_text, future))
         except Exception as e:
             if self.status_callback:
                 self.status_callback(f"Error reading {os.path.basename(file_path)}: {e}")
-            return ""
+            return None, False
+        return parts, True
 
-        # 2. If no text was found, fall back to OCR if available
-        if not text and OCR_AVAILABLE:
+    def _finish_pdf_text(self, file_path, pending, max_pages):
+        """Waits for a document's OCR pages and returns its text, like read_pdf_text."""
+        parts, store = pending
+        if parts is None:
+            return PdfText([], complete=False)
+        filename = os.path.basename(file_path)
+        pages = []
+        for page_number, source, page_text, future in parts:
+            if future is None:
+                pages.append((source, page_text))
+                continue
+            self.ocr_engine.ensure_dispatched(future)
+            status, payload = future.result()
+            if status == "ok":
+                self.ocr_engine.record(payload, filename, page_number)
+                if payload.text.strip():
+                    # Keep OCRed pages from running into the next page's text.
+                    page_text = payload.text + "\n"
+                pages.append((self._ocr_source(payload), page_text))
+                continue
             if self.status_callback:
-                self.status_callback(f"No text layer in {os.path.basename(file_path)}. Attempting OCR...")
-            try:
-                ocr_texts = []
-                with fitz.open(file_path) as doc:
-                    if not doc:
-                        return ""
-                    
-                    # Determine which pages to scan based on the flag
-                    pages_to_scan = [doc[0]] if first_page_only and len(doc) > 0 else doc
-
-                    for i, page in enumerate(pages_to_scan):
-                        if self.status_callback:
-                            # Adjust status message for single page scan
-                            page_count = len(pages_to_scan)
-                            self.status_callback(f"OCR page {i + 1}/{page_count} of {os.path.basename(file_path)}...")
-                        # Render page to an image (pixmap) at high DPI for better accuracy
-                        pix = page.get_pixmap(dpi=300)
-                        # Convert pixmap to a PIL Image
-                        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                        # Use Tesseract to do OCR on the image.
-                        # NOTE: This requires Tesseract-OCR to be installed on your system.
-                        page_text = pytesseract.image_to_string(img)
-                        ocr_texts.append(page_text)
-                text = "\n".join(ocr_texts)
-            except pytesseract.TesseractNotFoundError:
-                if self.status_callback:
+                if status == "missing":
                     self.status_callback("Tesseract not found. OCR unavailable. Please install Tesseract.")
-                return "" # Return empty string if Tesseract is not found
-            except Exception as e:
-                if self.status_callback:
-                    self.status_callback(f"An error occurred during OCR: {e}")
-                return ""
-        elif not text and not OCR_AVAILABLE:
-             if self.status_callback:
-                self.status_callback(f"No text in {os.path.basename(file_path)}, and OCR libraries not installed.")
+                else:
+                    self.status_callback(f"An error occurred during OCR: {payload}")
+            pages.append((None, page_text))
 
-        return text
+        if self.text_cache is not None and store:
+            complete = max_pages is None or len(pages) < max_pages
+            self._store_pages(file_path, pages, complete, max_pages)
+        return PdfText([(page_number, page_text) for page_number, (_, page_text) in enumerate(pages, start=1)
+                        if page_text.strip()], complete=all(source is not None for source, _ in pages))
 
-    def find_matching_destination(self, text):
+    def _has_text_layer(self, page_text):
+        """Returns True if a page's extracted text is substantial enough to skip OCR."""
+        return len(page_text.strip()) >= self.MIN_TEXT_LAYER_CHARS
+
+    def _needs_ocr(self, page, page_text):
         """
-        Finds the first matching destination folder based on the phrases in the mapping.
+        Returns True if a page has too little text to skip OCR and an image or
+        drawing for OCR to read. A blank page of a born-digital PDF has neither.
         """
-        if not self.mappings or not text:
-            return None
-        
-        text_lower = text.lower()
-        for phrase, rule in self.mappings.items():
-            if phrase.lower() in text_lower:
-                # The rule is a dictionary, get the destination from it
-                return rule.get("dest")
-        return None
+        return not self._has_text_layer(page_text) and bool(page.get_images() or page.get_drawings())
+
+    def _pages_to_read(self, doc, max_pages):
+        """Returns the pages of an open document to read, capped at max_pages."""
+        if max_pages is None or max_pages >= len(doc):
+            return doc
+        return [doc[i] for i in range(max_pages)]
+
+    def _ocr_page(self, page, filename=None, page_number=None):
+        """
+        Returns the OcrResult for a page. With adaptive OCR, a low-DPI result
+        is only kept if it is confident and matches a rule.
+        """
+        result = self.ocr_engine.ocr_page(
+            page, accept=self.ocr_accept, label=filename, page_number=page_number
+        )
+        if result.skipped:
+            if self.ocr_engine.adaptive and self.status_callback:
+                self.status_callback(f"OCR page {page_number} of {filename} skipped ({result.skipped} page)")
+        elif self.ocr_engine.adaptive and self.status_callback:
+            confidence = f"{result.confidence:.0f}" if result.confidence is not None else "n/a"
+            self.status_callback(f"OCR page {page_number} of {filename} read at {result.dpi} dpi (confidence {confidence})")
+        return result
 
     def find_destination(self, text):
         """
         Finds the destination folder by checking for keywords in the text.
         The search is case-insensitive and normalized to handle OCR quirks.
+        All phrases are matched in a single pass; the first rule in mapping
+        order that occurs in the text wins. Filename, metadata and region
+        rules are not matched here; see match_before_text. Returns the rule,
+        or None; match_text returns the full MatchResult.
         """
-        # Normalize the text from the PDF: replace newlines/tabs with spaces,
-        # collapse multiple spaces, and convert to lowercase.
-        normalized_text = ' '.join(text.split()).lower()
+        match = self.match_text(text)
+        return None if match is None else match.rule
 
-        for phrase, destination in self.mapping_data.items():
-            # Normalize the mapping phrase in the same way.
-            normalized_phrase = ' '.join(phrase.split()).lower()
-            
-            if normalized_phrase in normalized_text:
-                if self.status_callback:
-                    # Add a debug message to show exactly what matched.
-                    self.status_callback(f"Found a match for keyword: '{normalized_phrase}'")
-                return destination
+    def match_text(self, text):
+        """
+        Returns the MatchResult of the first text rule (not limited to a
+        region) matching the text, or None. The page is known when the text
+        came from read_pdf_text or extract_many.
+        """
+        # Normalize the text from the PDF: fold ligatures, case and Unicode
+        # forms, rejoin hyphenated line breaks and collapse whitespace.
+        # Phrases were normalized the same way when the matcher was built.
+        normalized_text = matcher.normalize_text(text)
+
+        hit = self.compiled.find_document_rule(normalized_text, approximate=self.approximate)
+        if hit is None:
+            return None
+
+        index, offset, distance = hit
+        page = text.page_at(offset) if isinstance(text, PdfText) else None
+        match = self._match_at(index, self._text_kind(index), offset, page, distance)
+        self._report_match(match)
+        return match
+
+    def find_destination_streaming(self, file_path, max_pages=None):
+        """
+        Finds the destination folder while reading the PDF one page at a time,
+        and stops reading as soon as a rule matches. A window of the previous
+        page's tail is carried over so phrases split across a page break still
+        match. Pages are considered in order, so a rule matching on an earlier
+        page wins over an earlier rule that only appears on a later page.
+        Expression rules are evaluated against all the pages read so far. One
+        using NOT could still be disproved by a later page, so while it holds
+        (and comes before any other match) reading goes on, and it only
+        matches if it still holds once every page has been read.
+        """
+        match = self.match_streaming(file_path, max_pages)
+        return None if match is None else match.rule
+
+    def match_streaming(self, file_path, max_pages=None):
+        """Like find_destination_streaming, but returns the MatchResult or None. offset is within the matching page's window."""
+        return self._match_streaming(file_path, max_pages)[0]
+
+    def _match_streaming(self, file_path, max_pages):
+        """
+        Does the work of match_streaming. Returns (MatchResult or None,
+        complete), where complete is False if some page read could not be,
+        like PdfText.complete.
+        """
+        # Any phrase spanning a page break starts within this many characters
+        # of the end of the previous page.
+        overlap = max(self.compiled.document_matcher.max_length - 1, 0)
+        if self.approximate:
+            # An approximate occurrence can be longer than its phrase by the edits allowed.
+            approximate_matcher = self.compiled.approximate_matcher
+            overlap = max(overlap, approximate_matcher.max_length + approximate_matcher.max_distance - 1)
+        carry = ""
+        # The text read so far, kept only when expression rules need it.
+        seen = [] if self.compiled.expression_rules else None
+        complete = True
+        # A match held back while an earlier expression rule using NOT holds.
+        match = None
+        last_page = None
+        for page_number, page_text, source in self._read_pages(file_path, max_pages):
+            complete = complete and source is not None
+            normalized_page = matcher.normalize_text(page_text)
+            if not normalized_page:
+                continue
+            window = f"{carry} {normalized_page}" if carry else normalized_page
+            expression_text = None
+            if seen is not None:
+                seen.append(normalized_page)
+                expression_text = " ".join(seen)
+                last_page = page_number
+
+            if match is None:
+                hit = self.compiled.find_document_rule(window, expression_text, self.approximate, negations=False)
+                if hit is not None:
+                    index, offset, distance = hit
+                    match = self._match_at(index, self._text_kind(index), offset, page_number, distance)
+            if match is not None and (expression_text is None or
+                                      self.compiled.find_negated_rule(expression_text, below=match.index) is None):
+                self._report_match(match)
+                return match, complete
+
+            carry = window[-overlap:] if overlap else ""
+
+        if seen:
+            # Every page is read, so expression rules using NOT are settled.
+            negated = self.compiled.find_negated_rule(" ".join(seen), below=None if match is None else match.index)
+            if negated is not None:
+                match = self._match_at(negated[0], "expression", negated[1], last_page)
+        if match is not None:
+            self._report_match(match)
+        return match, complete
+
+    def match_before_text(self, file_path):
+        """
+        Evaluates the rules that are cheaper than reading the document, from
+        cheapest to dearest: filename patterns (no I/O), then PDF metadata
+        (one open of the file), then page regions (see match_regions). The
+        document is opened only if a metadata or region rule comes before the
+        best match so far in mapping order. Returns the MatchResult of the
+        first matching rule among them, or None.
+        """
+        return self._match_before_text(file_path)[0]
+
+    def _match_before_text(self, file_path):
+        """
+        Does the work of match_before_text. Returns (MatchResult or None,
+        complete), where complete is False if the document or a region that
+        was needed could not be read.
+        """
+        compiled = self.compiled
+        filename = os.path.basename(file_path)
+        best = None
+        index = compiled.match_filename(filename)
+        if index is not None:
+            best = self._match_at(index, "filename")
+            self._report_match(best)
+
+        first_indices = [scope.indices[0] for scope in compiled.scopes]
+        if compiled.metadata_rules:
+            first_indices.append(compiled.metadata_rules[0][0])
+        if not first_indices or (best is not None and min(first_indices) >= best.index):
+            return best, True
+
+        try:
+            with fitz.open(file_path) as doc:
+                if compiled.metadata_rules:
+                    index = compiled.match_metadata(doc.metadata or {}, below=None if best is None else best.index)
+                    if index is not None:
+                        best = self._match_at(index, "metadata")
+                        self._report_match(best)
+                return self._match_regions_in(doc, best, filename)
+        except Exception as e:
+            if self.status_callback:
+                self.status_callback(f"Error reading {filename}: {e}")
+        return best, False
+
+    def match_regions(self, file_path):
+        """
+        Evaluates the rules limited to page regions, reading only those
+        regions: the text layer inside the region, or OCR of just the region
+        when the page has no text layer. Regions are read smallest first, and
+        one is skipped once a rule earlier in mapping order than all of its
+        rules has matched. Returns the MatchResult of the first matching
+        region rule in mapping order, or None.
+        """
+        if not self.compiled.scopes:
+            return None
+        filename = os.path.basename(file_path)
+        try:
+            with fitz.open(file_path) as doc:
+                return self._match_regions_in(doc, None, filename)[0]
+        except Exception as e:
+            if self.status_callback:
+                self.status_callback(f"Error reading {filename}: {e}")
         return None
 
-    def sort_file(self, file_path):
+    def _match_regions_in(self, doc, best, filename):
+        """
+        Evaluates the region rules of an open document that come before the
+        match best (or all, for None). Returns (MatchResult or None,
+        complete), where complete is False if a region could not be OCRed.
+        """
+        complete = True
+        for scope in self.compiled.scopes:
+            if best is not None and scope.indices[0] >= best.index:
+                continue
+            if not -len(doc) <= scope.page < len(doc):
+                continue
+            text, read = self._read_region(doc, scope, filename)
+            complete = complete and read
+            hit = scope.find_first(matcher.normalize_text(text))
+            if hit is not None and (best is None or hit[0] < best.index):
+                best = self._match_at(hit[0], "region", hit[1], scope.page % len(doc) + 1)
+                self._report_match(best)
+        return best, complete
+
+    def _read_region(self, doc, scope, filename):
+        """
+        Returns (text, read) for a rule scope's page region, from the text
+        layer or by OCRing only that region. read is False if the region
+        needed OCR that could not run.
+        """
+        page = doc[scope.page]
+        page_number = scope.page % len(doc) + 1
+        clip = None
+        if scope.region is not None:
+            # Regions are fractions of the page as displayed; text extraction
+            # works in unrotated page coordinates, rendering in displayed ones.
+            x0, y0, x1, y1 = scope.region
+            shown = page.rect
+            clip = fitz.Rect(shown.x0 + x0 * shown.width, shown.y0 + y0 * shown.height,
+                             shown.x0 + x1 * shown.width, shown.y0 + y1 * shown.height)
+        text = page.get_text(clip=None if clip is None else clip * page.derotation_matrix)
+        if text.strip() and (clip is not None or self._has_text_layer(text)):
+            return text, True
+        if clip is not None and page.get_fonts() and not page.get_images():
+            # The page has text and no scanned image, so the region is just
+            # empty. Checked from the page's resources, without reading the
+            # rest of the page.
+            return text, True
+        if not OCR_AVAILABLE:
+            return text, False
+        try:
+            result = self.ocr_engine.ocr_page(
+                page, accept=lambda ocr_text: scope.find_first(matcher.normalize_text(ocr_text)) is not None,
+                label=filename, page_number=page_number, clip=clip,
+            )
+        except pytesseract.TesseractNotFoundError:
+            if self.status_callback:
+                self.status_callback("Tesseract not found. OCR unavailable. Please install Tesseract.")
+            return text, False
+        except Exception as e:
+            if self.status_callback:
+                self.status_callback(f"An error occurred during OCR: {e}")
+            return text, False
+        return result.text, True
+
+    def _needs_document_text(self, early_match):
+        """True if a rule matched against the whole text could still beat the match of match_before_text (or None)."""
+        document_indices = self.compiled.document_indices
+        return bool(document_indices) and (early_match is None or document_indices[0] < early_match.index)
+
+    def _match_at(self, index, kind, offset=None, page=None, distance=0):
+        """Builds the MatchResult for the rule at a position in mapping order."""
+        key = self.compiled.keys[index]
+        return matcher.MatchResult(index, key, self.mapping_data[key], kind, offset, page, distance)
+
+    def _text_kind(self, index):
+        """The MatchResult kind of a rule matched against the whole text."""
+        rule = self.mapping_data[self.compiled.keys[index]]
+        return "expression" if utils.MappingUtils.get_rule_type(rule) == utils.RULE_TYPE_EXPRESSION else "text"
+
+    def _report_match(self, match):
+        """Reports a match through the status callback."""
+        if self.status_callback:
+            # Add a debug message to show exactly what matched.
+            self.status_callback(f"Found a match: {match.describe()}")
+
+    @staticmethod
+    def _first_match(*matches):
+        """Returns the match earliest in mapping order, ignoring None."""
+        found = [match for match in matches if match is not None]
+        return min(found, key=lambda match: match.index) if found else None
+
+    def sort_file(self, file_path, first_page_only=False, max_pages=None):
         """
         Sorts a single file: reads its text, finds the matching destination,
-        and moves it to the appropriate folder.
+        and moves it to the appropriate folder. Returns True if it was moved.
         """
         if self.status_callback:
             self.status_callback(f"Sorting file: {file_path}")
 
-        text = self.read_pdf_text(file_path)
-        if not text:
-            return
-
+        early_match = self.match_before_text(file_path)
+        text = None
+        if self._needs_document_text(early_match):
+            text = self.read_pdf_text(file_path, first_page_only=first_page_only, max_pages=max_pages)
+            if not text and early_match is None:
+                return False
         try:
-            destination_folder = self.find_matching_destination(text)
-
-            if destination_folder:
-                destination_path = os.path.join(self.template_dir, destination_folder)
-                os.makedirs(destination_path, exist_ok=True)
-                shutil.move(file_path, os.path.join(destination_path, os.path.basename(file_path)))
-                if self.status_callback:
-                    self.status_callback(f"Moved: {os.path.basename(file_path)} -> {destination_folder}")
-            else:
-                if self.status_callback:
-                    self.status_callback(f"No match found for: {os.path.basename(file_path)}")
-                    # Print the NORMALIZED text for easier debugging
-                    debug_text = ' '.join(text.split()).lower()
-                    if len(debug_text) > 1000:
-                        debug_text = debug_text[:1000] + "..."
-                    self.status_callback(f"--- Normalized Text Read from {os.path.basename(file_path)} ---\n{debug_text}\n---------------------------------")
+            match = self._first_match(early_match, self.match_text(text) if text else None)
+            return self._move_to_destination(file_path, match, text)
         except Exception as e:
             if self.status_callback:
                 self.status_callback(f"Error processing {os.path.basename(file_path)}: {e}")
+            return False
 
-    def sort_files(self, folders_to_sort, deep_audit=False, first_page_only=False):
-        total_files_sorted = 0
-        total_files_scanned = 0
+    def _move_to_destination(self, file_path, match, text=None):
+        """
+        Moves a file into the template folder of the matched rule (a
+        MatchResult). If nothing matched, reports it (with the normalized
+        text, when available) and leaves the file in place. A file whose
+        destination already holds a file of the same name (e.g. scan001.pdf
+        from two date folders) is reported and left in place too. Returns
+        True if the file was moved.
+        """
+        filename = os.path.basename(file_path)
+        destination_folder = None if match is None else match.dest
 
-        for folder in folders_to_sort:
-            if not os.path.isdir(folder):
-                continue
-            
-            # In this version, we only scan the top-level of the provided folder
-            root = folder 
+        if destination_folder:
+            destination_path = os.path.join(self.template_dir, destination_folder)
+            os.makedirs(destination_path, exist_ok=True)
+            target_path = os.path.join(destination_path, filename)
+            if os.path.exists(target_path):
+                if self.status_callback:
+                    self.status_callback(f"Not moved: {filename} -> {destination_folder}, a file of that name is already there")
+                return False
+            digest = None
+            if self.template_index is not None and self.text_cache is not None and text is not None:
+                # Already known to the text cache, which just read the file.
+                digest = self.text_cache.digest(file_path)
+            shutil.move(file_path, target_path)
+            if self.template_index is not None:
+                version = self.template_index.version_for(self.mapping_data, self.approximate)
+                self.template_index.record(target_path, match.key, version, digest)
             if self.status_callback:
-                self.status_callback(f"Sorting folder: {root}")
+                self.status_callback(f"Moved: {filename} -> {destination_folder}, matched {match.describe()}")
+            return True
 
-            for filename in os.listdir(root):
-                file_path = os.path.join(root, filename)
-                
-                if os.path.isdir(file_path):
-                    # Skip directories in this version
-                    continue
-                
-                if filename.lower().endswith('.pdf'):
-                    total_files_scanned += 1
-                    if self.status_callback:
-                        self.status_callback(f"Scanning: {file_path}")
+        if self.status_callback:
+            self.status_callback(f"No match found for: {filename}")
+            if text is not None:
+                # Print the NORMALIZED text for easier debugging (normally
+                # the text just matched, which the normalizer remembers).
+                debug_text = matcher.normalize_text(text)
+                if len(debug_text) > 1000:
+                    debug_text = debug_text[:1000] + "..."
+                self.status_callback(f"--- Normalized Text Read from {filename} ---\n{debug_text}\n---------------------------------")
+        return False
 
-                    text = self.read_pdf_text(file_path, first_page_only=first_page_only)
-                    if not text:
-                        continue
+    def classify_many(self, paths, first_page_only=False, stream_pages=False, max_pages=None,
+                      recursive=False, include=walker.DEFAULT_INCLUDE, exclude=()):
+        """
+        Yields (file_path, MatchResult or None) for each PDF in paths (files,
+        or folders whose PDFs are classified; subfolders too with recursive)
+        without moving anything. Documents go through the same pipeline as
+        sort_files: filename, metadata and region rules first, then text
+        from extract_many (or page by page with stream_pages), using the OCR
+        worker pool and the text cache.
+        """
+        for file_path, match, _ in self._classify_many(paths, first_page_only, stream_pages, max_pages,
+                                                       recursive, include, exclude):
+            yield file_path, match
 
-                    try:
-                        destination_folder = self.find_destination(text)
-
-                        if destination_folder:
-                            destination_path = os.path.join(self.template_dir, destination_folder)
-                            os.makedirs(destination_path, exist_ok=True)
-                            shutil.move(file_path, os.path.join(destination_path, filename))
-                            total_files_sorted += 1
-                            if self.status_callback:
-                                self.status_callback(f"Moved: {filename} -> {destination_folder}")
-                        else:
-                            if self.status_callback:
-                                self.status_callback(f"No match found for: {filename}")
-                                # Print the NORMALIZED text for easier debugging
-                                debug_text = ' '.join(text.split()).lower()
-                                if len(debug_text) > 1000:
-                                    debug_text = debug_text[:1000] + "..."
-                                self.status_callback(f"--- Normalized Text Read from {filename} ---\n{debug_text}\n---------------------------------")
-                    except Exception as e:
-                        if self.status_callback:
-                            self.status_callback(f"Error processing {filename}: {e}")
+    def _classify_many(self, paths, first_page_only=False, stream_pages=False, max_pages=None,
+                       recursive=False, include=walker.DEFAULT_INCLUDE, exclude=()):
+        """
+        Does the work of classify_many. Yields (file_path, MatchResult or
+        None, complete), where complete is False if the document could not
+        be read completely, like PdfText.complete.
+        """
+        classify_pipeline = self._pipeline(first_page_only, stream_pages, max_pages, recursive, include, exclude)
+        for file_path, match, _, complete in classify_pipeline.run(paths):
+            yield file_path, match, complete
+
+    def _pipeline(self, first_page_only, stream_pages, max_pages, recursive, include, exclude):
+        """A SortPipeline for this sorter with its queue and matcher settings."""
+        return pipeline.SortPipeline(self, first_page_only=first_page_only, stream_pages=stream_pages, max_pages=max_pages,
+                                     queue_size=self.queue_size, match_workers=self.match_workers,
+                                     recursive=recursive, include=include, exclude=exclude)
+
+    def sort_files(self, folders_to_sort, deep_audit=False, first_page_only=False, stream_pages=False, max_pages=None,
+                   include=walker.DEFAULT_INCLUDE, exclude=()):
+        """
+        Sorts the PDFs in the given folders (or given PDF files, as the
+        folder watcher passes them) into the template directory.
+        With deep_audit, subfolders are scanned too (never the template
+        directory itself); include and exclude are file/folder name globs.
+        With stream_pages, documents are read page by page and reading stops
+        at the first page that matches a rule; max_pages caps how many pages
+        are read per document. Otherwise documents are extracted through
+        extract_many, so OCR can run ahead in the OCR engine's worker pool.
+        Scanning, extraction and matching run as a pipeline (see
+        src/pipeline.py) while this thread moves the files. With a
+        template_index, unmatched documents that were read completely are
+        recorded there, and an incremental sort skips them until a new or
+        edited rule might match.
+        """
+        total_files_sorted = 0
+        paths = [path for path in folders_to_sort if os.path.isdir(path) or os.path.isfile(path)]
+        sort_pipeline = self._pipeline(first_page_only, stream_pages, max_pages, deep_audit, include, exclude)
+
+        for file_path, match, text, complete in sort_pipeline.run(paths):
+            if text is pipeline.UNCHANGED or (match is None and text is not None and not text):
+                continue
+            if match is None and not complete:
+                # Not a "no match": the errors were reported, and a later sort tries again.
+                if self.status_callback:
+                    self.status_callback(f"Not sorted: {os.path.basename(file_path)} could not be read completely")
+                continue
+            try:
+                if self._move_to_destination(file_path, match, text):
+                    total_files_sorted += 1
+                elif match is None and self.template_index is not None:
+                    version = self.template_index.version_for(self.mapping_data, self.approximate)
+                    digest = text_cache.digest(file_path, self.text_cache)
+                    self.template_index.record_unmatched(digest, os.path.basename(file_path),
+                                                         sort_pipeline.pages_read, version)
+            except Exception as e:
+                if self.status_callback:
+                    self.status_callback(f"Error processing {os.path.basename(file_path)}: {e}")
+        total_files_scanned = sort_pipeline.scanned
 
-        if deep_audit:
-            if self.status_callback:
-                self.status_callback("Deep audit not yet implemented.")
-        
         if self.status_callback:
-            self.status_callback(f"Sort complete. Scanned: {total_files_scanned}, Moved: {total_files_sorted}")
\ No newline at end of file
+            self.status_callback(f"Sort complete. Scanned: {total_files_scanned}, Moved: {total_files_sorted}")
+            if sort_pipeline.unchanged:
+                self.status_callback(f"Skipped as unmatched last time, with no relevant rule changes: {sort_pipeline.unchanged}")
+            if self.ocr_engine.adaptive and self.ocr_engine.tier_counts:
+                self.status_callback(f"OCR pages by resolution: {self.ocr_engine.tier_summary()}")
+            if self.ocr_engine.preprocessor is not None and self.ocr_engine.preprocessor.pages:
+                self.status_callback(f"OCR preprocessing per page: {self.ocr_engine.preprocessor.timing_summary()}")
+            if self.ocr_engine.skipped_counts:
+                self.status_callback(f"Pages skipped without OCR: {self.ocr_engine.skipped_summary()}")
\ No newline at end of file
@@ -0,0 +1,292 @@
+"""
+Persistent index of the files sorted into a template folder.
+
+Deep Audit checks that every PDF in <mapping>_template still sits in the
+folder its content maps to, for example after a rule was edited. Reading
+the whole archive on every audit would be far too slow, so the index
+remembers, for each file: its size and mtime, its content hash, the rule
+that placed it, and the version of the mapping that decided it. Every
+mapping version used is kept too, so a later mapping can be diffed against
+it (see compiled_mapping.could_change_outcome). A file is only classified
+again when its content changed or the mapping changed in a way that could
+send it elsewhere, and it is only moved when it is in the wrong folder.
+
+The same goes for documents a sort left in place because nothing matched:
+their outcome is remembered by content hash, so an incremental sort only
+reads them again once a new or edited rule might match them.
+
+The index is a SQLite database inside the template folder, so it travels
+with the archive. The Sorter records files it moves there and documents it
+leaves unmatched; audit_template_dir fills in and corrects the rest.
+"""
+
+import os
+import json
+import shutil
+import sqlite3
+import threading
+from collections import Counter
+
+from src import compiled_mapping
+from src import text_cache
+from src import walker
+
+INDEX_FILENAME = ".template_index.sqlite"
+
+
+class IndexEntry:
+    """What the index knows about one file; rule is None if no rule matched it."""
+
+    __slots__ = ("size", "mtime_ns", "digest", "rule", "version")
+
+    def __init__(self, size, mtime_ns, digest, rule, version):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.digest = digest
+        self.rule = rule
+        self.version = version
+
+
+class TemplateIndex:
+    """
+    A SQLite-backed index of the files under a template folder, keyed by
+    their path relative to it.
+
+    Safe to use from several threads of one process.
+    """
+
+    def __init__(self, template_dir, db_path=None):
+        self.template_dir = os.path.abspath(template_dir)
+        self.db_path = db_path or os.path.join(self.template_dir, INDEX_FILENAME)
+        self._lock = threading.Lock()
+        if self.db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT, rule TEXT, version TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS mappings ("
+                " version TEXT PRIMARY KEY, format INTEGER, approximate INTEGER, rules TEXT)"
+            )
+            # Documents outside the template folder that no rule matched.
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS unmatched (digest TEXT PRIMARY KEY, filename TEXT, pages INTEGER, version TEXT)"
+            )
+        # (rules, version) of the mapping version_for last saw.
+        self._current = (None, None)
+        # Stored mappings loaded so far, by version.
+        self._mappings = {}
+
+    def close(self):
+        """Closes the database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def relative(self, file_path):
+        """The index key of a path: relative to the template folder, with '/' separators."""
+        return os.path.relpath(os.path.abspath(file_path), self.template_dir).replace(os.sep, "/")
+
+    def get(self, file_path):
+        """Returns the IndexEntry of a file, or None if it is not indexed."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, digest, rule, version FROM files WHERE path = ?", (self.relative(file_path),)
+            ).fetchone()
+        return None if row is None else IndexEntry(*row)
+
+    def record(self, file_path, rule, version, digest=None, stat=None):
+        """
+        Stores a file as placed by rule (a key, or None) under the given
+        rules version. Without a digest, the content is trusted to be what
+        was classified until its size or mtime changes.
+        """
+        stat = stat or os.stat(file_path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, digest, rule, version) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.relative(file_path), stat.st_size, stat.st_mtime_ns, digest, rule, version),
+            )
+
+    def forget(self, file_path):
+        """Removes a file from the index."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (self.relative(file_path),))
+
+    def forget_all_but(self, keys):
+        """Removes every file whose key is not in keys (e.g. files deleted since the last audit)."""
+        with self._lock:
+            stored = [row[0] for row in self._conn.execute("SELECT path FROM files")]
+        gone = [(key,) for key in stored if key not in keys]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM files WHERE path = ?", gone)
+        return len(gone)
+
+    def version_for(self, rules, approximate=False):
+        """
+        Returns the version of a mapping (see compiled_mapping.mapping_version),
+        storing the mapping under it the first time, so later mappings can be
+        compared with it.
+        """
+        current_rules, version = self._current
+        if current_rules is rules:
+            return version
+        version = compiled_mapping.mapping_version(rules, approximate)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO mappings (version, format, approximate, rules) VALUES (?, ?, ?, ?)",
+                (version, compiled_mapping.COMPILED_FORMAT_VERSION, int(bool(approximate)), json.dumps(list(rules.items()))),
+            )
+        self._mappings[version] = (compiled_mapping.COMPILED_FORMAT_VERSION, bool(approximate), rules)
+        self._current = (rules, version)
+        return version
+
+    def still_decides(self, rule, version, rules, approximate=False):
+        """
+        True if a document that the mapping stored under version sent to rule
+        (None: unmatched) is certain to be decided the same way by rules.
+        """
+        if version == self.version_for(rules, approximate):
+            return True
+        stored = self._mappings.get(version)
+        if stored is None:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT format, approximate, rules FROM mappings WHERE version = ?", (version,)
+                ).fetchone()
+            if row is None:
+                return False
+            stored = (row[0], bool(row[1]), dict(json.loads(row[2])))
+            self._mappings[version] = stored
+        format_version, old_approximate, old_rules = stored
+        if format_version != compiled_mapping.COMPILED_FORMAT_VERSION or old_approximate != bool(approximate):
+            return False
+        return not compiled_mapping.could_change_outcome(old_rules, rules, rule)
+
+    def record_unmatched(self, digest, filename, pages, version):
+        """
+        Remembers that no rule of the mapping version matched the document
+        with this content and name, reading up to pages pages (0: all).
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO unmatched (digest, filename, pages, version) VALUES (?, ?, ?, ?)",
+                (digest, filename, pages, version),
+            )
+
+    def unmatched_version(self, digest, filename, pages):
+        """The mapping version that last found no match for this content and name, reading as many pages, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT filename, pages, version FROM unmatched WHERE digest = ?", (digest,)
+            ).fetchone()
+        # A renamed copy may match a filename rule, and more or fewer pages
+        # may match a rule (e.g. one with NOT) that the text read did not.
+        return row[2] if row is not None and (row[0], row[1]) == (filename, pages) else None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+
+def _is_within(path, folder):
+    """True if path is inside folder, at any depth."""
+    path, folder = os.path.normcase(os.path.abspath(path)), os.path.normcase(os.path.abspath(folder))
+    return os.path.commonpath([path, folder]) == folder
+
+
+def _needs_classifying(sorter, index, file_path):
+    """
+    True if a file must be classified again: it is not indexed, its content
+    changed, or the mapping changed in a way that could decide it
+    differently. A file whose mtime changed but whose content hash did not,
+    or whose mapping changed harmlessly, is re-stamped instead.
+    """
+    entry = index.get(file_path)
+    if entry is None:
+        return True
+    stat = os.stat(file_path)
+    restamp = False
+    if (entry.size, entry.mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        if entry.digest is None or text_cache.digest(file_path, sorter.text_cache) != entry.digest:
+            return True
+        restamp = True
+    if not index.still_decides(entry.rule, entry.version, sorter.mapping_data, sorter.approximate):
+        return True
+    version = index.version_for(sorter.mapping_data, sorter.approximate)
+    if restamp or entry.version != version:
+        index.record(file_path, entry.rule, version, entry.digest, stat)
+    return False
+
+
+def audit_template_dir(sorter, index, include=walker.DEFAULT_INCLUDE, exclude=()):
+    """
+    Moves the PDFs under the sorter's template folder that are in the wrong
+    folder for the current mapping into the folder their content maps to.
+    Only files that need it (see _needs_classifying) are classified again,
+    through Sorter.classify_many. Files nothing matches, and files whose
+    destination already holds a file of the same name, stay where they are.
+    A file nothing matched that could not be read completely (e.g. OCR did
+    not run) is left unindexed, so the next audit reads it again. Returns a
+    Counter of "unchanged", "correct", "moved", "unmatched", "incomplete"
+    and "conflict" files.
+    """
+    counts = Counter()
+    version = index.version_for(sorter.mapping_data, sorter.approximate)
+
+    def report(message):
+        if sorter.status_callback:
+            sorter.status_callback(message)
+
+    report(f"Auditing {sorter.template_dir}")
+    seen = set()
+    to_classify = []
+    for file_path in walker.walk_files(sorter.template_dir, include=include, exclude=exclude,
+                                       on_error=lambda e: report(f"Error scanning {e.filename}: {e}")):
+        seen.add(index.relative(file_path))
+        try:
+            if _needs_classifying(sorter, index, file_path):
+                to_classify.append(file_path)
+            else:
+                counts["unchanged"] += 1
+        except OSError as e:
+            report(f"Error reading {os.path.basename(file_path)}: {e}")
+    index.forget_all_but(seen)
+
+    for file_path, match, complete in sorter._classify_many(to_classify):
+        filename = os.path.basename(file_path)
+        if match is None and not complete:
+            report(f"Not audited: {filename} could not be read completely")
+            counts["incomplete"] += 1
+            continue
+        try:
+            digest = text_cache.digest(file_path, sorter.text_cache)
+            if match is None or not match.dest:
+                index.record(file_path, None, version, digest)
+                counts["unmatched"] += 1
+                continue
+            dest_dir = os.path.join(sorter.template_dir, match.dest)
+            if _is_within(file_path, dest_dir):
+                index.record(file_path, match.key, version, digest)
+                counts["correct"] += 1
+                continue
+            target = os.path.join(dest_dir, filename)
+            if os.path.exists(target):
+                # Left unindexed, so the next audit tries again.
+                report(f"Not moved: {filename} -> {match.dest}, a file of that name is already there")
+                counts["conflict"] += 1
+                continue
+            os.makedirs(dest_dir, exist_ok=True)
+            shutil.move(file_path, target)
+            index.forget(file_path)
+            index.record(target, match.key, version, digest)
+            counts["moved"] += 1
+            report(f"Moved: {index.relative(file_path)} -> {match.dest}, matched {match.describe()}")
+        except OSError as e:
+            report(f"Error processing {filename}: {e}")
+
+    report("Audit complete. " + ", ".join(f"{name.capitalize()}: {count}" for name, count in sorted(counts.items())))
+    return counts
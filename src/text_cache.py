@@ -0,0 +1,210 @@
+"""
+Persistent cache of text read from PDFs.
+
+Re-running a sort over the same backlog (e.g. after a mapping edit) would
+otherwise re-read and re-OCR every file. Entries are keyed by a SHA-256 of
+the file content, so renamed or moved copies still hit. A path's size and
+mtime are remembered with its hash, so unchanged files are not re-hashed.
+
+Each entry stores the pages that were read, in order, with whether the text
+came from the text layer or OCR, compressed with zlib. An entry with OCR
+pages also records the OCR settings they were read with (see
+OcrEngine.cache_key) and is only served under the same settings. The least
+recently used entries are evicted once the cache exceeds its size limit.
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+
+# Default upper bound for the compressed text stored in the cache.
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+# How many of the least recently used entries _evict looks at per query.
+EVICT_BATCH = 16
+
+# Where a page's text came from.
+SOURCE_TEXT = "text"
+SOURCE_OCR = "ocr"
+# OCR kept at a lower DPI because it matched the mapping of the time. It may
+# be wrong for an edited mapping, so it is never cached.
+SOURCE_OCR_PROVISIONAL = "ocr-provisional"
+
+
+def user_cache_dir():
+    """Returns the per-user directory the application keeps its caches in."""
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "OCR File Sorter")
+
+
+def default_cache_path():
+    """Returns the per-user location of the text cache database."""
+    return os.path.join(user_cache_dir(), "text_cache.sqlite")
+
+
+def file_digest(file_path):
+    """Returns the SHA-256 hex digest of a file's content."""
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def digest(file_path, cache=None):
+    """The content hash of a file, through a TextCache (which skips unchanged files) when one is given."""
+    if cache is not None:
+        return cache.digest(file_path)
+    return file_digest(file_path)
+
+
+class TextCache:
+    """
+    A SQLite-backed cache of per-page PDF text, shared across runs.
+
+    Safe to use from several threads of one process.
+    """
+
+    def __init__(self, db_path=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.db_path = db_path or default_cache_path()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._last_touch = 0.0
+        if self.db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS texts ("
+                " digest TEXT PRIMARY KEY, pages_covered INTEGER, complete INTEGER,"
+                " first_page_only INTEGER, data BLOB, nbytes INTEGER, last_used REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS texts_last_used ON texts (last_used)")
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(texts)")]
+            if "ocr_settings" not in columns:
+                # Entries from before OCR settings were recorded never match any.
+                self._conn.execute("ALTER TABLE texts ADD COLUMN ocr_settings TEXT")
+                self._conn.execute("UPDATE texts SET ocr_settings = ''")
+        # Compressed size of all entries, kept up to date so a put need not sum the table.
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM texts").fetchone()[0]
+
+    def close(self):
+        """Closes the database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def digest(self, file_path):
+        """
+        Returns the content digest of a file, reusing the stored one when the
+        file's size and mtime are unchanged.
+        """
+        stat = os.stat(file_path)
+        path = os.path.abspath(file_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, digest FROM files WHERE path = ?", (path,)
+            ).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        digest = file_digest(file_path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, digest),
+            )
+        return digest
+
+    def get_pages(self, file_path, max_pages=None, ocr_settings=None):
+        """
+        Returns the cached pages of a file as a list of (source, text), up to
+        max_pages, or None if the cache does not cover those pages or has
+        OCR pages read under settings other than ocr_settings.
+        """
+        try:
+            digest = self.digest(file_path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT pages_covered, complete, data, ocr_settings FROM texts WHERE digest = ?", (digest,)
+            ).fetchone()
+            covered = row is not None and (row[1] or (max_pages is not None and row[0] >= max_pages)) \
+                and (row[3] is None or row[3] == ocr_settings)
+            if not covered:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._conn:
+                self._conn.execute("UPDATE texts SET last_used = ? WHERE digest = ?", (self._touch_time(), digest))
+        pages = [tuple(page) for page in json.loads(zlib.decompress(row[2]).decode("utf-8"))]
+        return pages if max_pages is None else pages[:max_pages]
+
+    def put_pages(self, file_path, pages, complete, first_page_only=False, ocr_settings=None):
+        """
+        Stores the pages read from a file as a list of (source, text), in page
+        order from the first page. complete says whether they are all of the
+        document's pages, and ocr_settings names the settings any OCR pages
+        were read with. An entry covering more pages is never replaced by one
+        covering fewer, unless its OCR settings differ.
+        """
+        try:
+            digest = self.digest(file_path)
+        except OSError:
+            return
+        data = zlib.compress(json.dumps(list(pages)).encode("utf-8"))
+        if not any(source == SOURCE_OCR for source, _ in pages):
+            ocr_settings = None
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT pages_covered, complete, nbytes, ocr_settings FROM texts WHERE digest = ?", (digest,)
+            ).fetchone()
+            if row is not None and (row[1] or row[0] >= len(pages)) and not complete \
+                    and (row[3] is None or row[3] == ocr_settings):
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO texts"
+                " (digest, pages_covered, complete, first_page_only, data, nbytes, last_used, ocr_settings)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (digest, len(pages), int(bool(complete)), int(bool(first_page_only)),
+                 data, len(data), self._touch_time(), ocr_settings),
+            )
+            self._total_bytes += len(data) - (row[2] if row is not None else 0)
+            self._evict()
+
+    def total_bytes(self):
+        """Returns the compressed size of all cached text."""
+        with self._lock:
+            return self._total_bytes
+
+    def _touch_time(self):
+        """Returns a strictly increasing use timestamp, so LRU order survives coarse clocks. Caller holds the lock."""
+        self._last_touch = max(time.time(), self._last_touch + 1e-6)
+        return self._last_touch
+
+    def _evict(self):
+        """Drops least recently used entries until the cache fits in max_bytes. Caller holds the lock."""
+        while self._total_bytes > self.max_bytes:
+            # Oldest first, a few at a time: a full cache usually only needs one or two dropped.
+            rows = self._conn.execute(
+                "SELECT digest, nbytes FROM texts ORDER BY last_used LIMIT ?", (EVICT_BATCH,)
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                return
+            for digest, nbytes in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM texts WHERE digest = ?", (digest,))
+                self._total_bytes -= nbytes
@@ -9,6 +9,15 @@ SETTINGS_FILE = "settings.json"
 LAST_MAPPING_KEY = "last_mapping_file"
 MAPPINGS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "mappings"))
 
+# Rule types: a phrase in the document text, a regular expression on the
+# file name, a phrase in a PDF metadata field, or a boolean expression over
+# phrases in the document text (see src/rules.py).
+RULE_TYPE_TEXT = "text"
+RULE_TYPE_FILENAME = "filename"
+RULE_TYPE_METADATA = "metadata"
+RULE_TYPE_EXPRESSION = "expression"
+METADATA_FIELDS = ("title", "subject", "author", "keywords", "creator", "producer")
+
 # --- Settings Functions ---
 def load_settings():
     """Loads the application settings from settings.json."""
@@ -50,22 +59,77 @@ class MappingUtils:
         try:
             with open(file_path, "r", encoding="utf-8") as f:
                 data = json.load(f)
-            
-            # Check for old format and migrate.
-            # The first value in the dict will be a string in the old format,
-            # and a dictionary in the new format.
-            if data and isinstance(next(iter(data.values())), str):
-                migrated_data = {}
-                for phrase, dest in data.items():
-                    # Create a default name from the phrase for backward compatibility
-                    default_name = phrase.replace("_", " ").replace("-", " ").title()
-                    migrated_data[phrase] = {"name": default_name, "dest": dest}
-                return migrated_data
-            
-            return data
+            return MappingUtils.migrate_mapping(data)
         except (FileNotFoundError, json.JSONDecodeError, StopIteration):
             return {}
 
+    @staticmethod
+    def migrate_mapping(data):
+        """Converts old-format mapping data (phrase -> dest) to the phrase -> rule dict format."""
+        # Check for old format and migrate.
+        # The first value in the dict will be a string in the old format,
+        # and a dictionary in the new format.
+        if data and isinstance(next(iter(data.values())), str):
+            migrated_data = {}
+            for phrase, dest in data.items():
+                # Create a default name from the phrase for backward compatibility
+                default_name = phrase.replace("_", " ").replace("-", " ").title()
+                migrated_data[phrase] = {"name": default_name, "dest": dest}
+            return migrated_data
+
+        return data
+
+    @staticmethod
+    def get_rule_dest(rule):
+        """Returns the destination folder of a rule, accepting both the old (str) and new (dict) format."""
+        if isinstance(rule, dict):
+            return rule.get("dest")
+        return rule
+
+    @staticmethod
+    def get_rule_type(rule):
+        """Returns a rule's type; rules without one (or of an unknown type) match the document text."""
+        if isinstance(rule, dict):
+            rule_type = str(rule.get("type", RULE_TYPE_TEXT)).lower()
+            if rule_type in (RULE_TYPE_FILENAME, RULE_TYPE_METADATA, RULE_TYPE_EXPRESSION):
+                return rule_type
+        return RULE_TYPE_TEXT
+
+    @staticmethod
+    def get_rule_max_distance(rule):
+        """Returns the number of character edits a text rule's phrase may be off by in approximate matching (default 0)."""
+        if not isinstance(rule, dict):
+            return 0
+        try:
+            return max(0, int(rule.get("max_distance", 0)))
+        except (TypeError, ValueError):
+            return 0
+
+    @staticmethod
+    def get_rule_scope(rule):
+        """
+        Returns (page, region) for a rule limited to part of a document, or
+        None for a rule that applies to the whole text. page is a 0-based
+        page index (negative counts from the end) and defaults to 0 when only
+        a region is given. region is (x0, y0, x1, y1) as fractions of the
+        page as displayed, or None for the whole page.
+        """
+        if not isinstance(rule, dict) or ("page" not in rule and "region" not in rule):
+            return None
+        if MappingUtils.get_rule_type(rule) != RULE_TYPE_TEXT:
+            return None
+        try:
+            page = int(rule.get("page", 0))
+        except (TypeError, ValueError):
+            page = 0
+        region = rule.get("region")
+        try:
+            x0, y0, x1, y1 = (min(max(float(v), 0.0), 1.0) for v in region)
+            region = (x0, y0, x1, y1) if x0 < x1 and y0 < y1 else None
+        except (TypeError, ValueError):
+            region = None
+        return page, region
+
     @staticmethod
     def save_mapping(file_path, data):
         """Saves mapping data to a JSON file."""
@@ -0,0 +1,91 @@
+"""
+Lazy directory walking for finding the PDFs to sort.
+
+walk_files yields matching file paths as it finds them, one directory at a
+time, so sorting can start long before the walk of a large tree finishes.
+It is built on os.scandir: file/directory checks use the type information
+the directory listing already holds, and only directories are stat'ed, to
+recognise ones already visited (symlink or junction loops) and folders to
+skip, such as the template folder files are sorted into.
+"""
+
+import os
+import fnmatch
+
+DEFAULT_INCLUDE = ("*.pdf",)
+
+
+def _matches(name, relative_path, patterns):
+    """True if the name or the '/'-separated relative path matches any glob, ignoring case."""
+    name = name.lower()
+    relative_path = relative_path.lower()
+    return any(fnmatch.fnmatchcase(name, pattern) or fnmatch.fnmatchcase(relative_path, pattern) for pattern in patterns)
+
+
+def _dir_key(path, stat=None):
+    """Identifies a directory by device and inode, whatever path reaches it."""
+    if stat is None or not stat.st_ino:
+        # DirEntry.stat() leaves the inode as 0 on Windows; os.stat fills it in.
+        stat = os.stat(path)
+    return stat.st_dev, stat.st_ino
+
+
+def walk_files(root, include=DEFAULT_INCLUDE, exclude=(), recursive=True, skip_dirs=(), on_error=None):
+    """
+    Yields the paths of files under root whose name (or path relative to
+    root, with '/' separators) matches an include glob and no exclude glob.
+    Globs ignore case, and an excluded directory is not entered. Without
+    recursive, only root's own files are yielded. Directories in skip_dirs,
+    and directories reached again through a link, are not entered.
+    on_error, if given, is called with the OSError of a directory that
+    cannot be read; the walk goes on.
+    """
+    include = [pattern.lower() for pattern in include]
+    exclude = [pattern.lower() for pattern in exclude]
+    skip = set()
+    for path in skip_dirs:
+        try:
+            skip.add(_dir_key(path))
+        except OSError:
+            pass
+    try:
+        visited = {_dir_key(root)}
+    except OSError as e:
+        if on_error is not None:
+            on_error(e)
+        return
+
+    # Directories still to walk, as (path, path relative to root).
+    pending = [(root, "")]
+    while pending:
+        directory, relative_dir = pending.pop()
+        subdirectories = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    relative_path = relative_dir + entry.name
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        continue
+                    if is_dir:
+                        if recursive and not _matches(entry.name, relative_path, exclude):
+                            subdirectories.append(entry)
+                    elif _matches(entry.name, relative_path, include) and not _matches(entry.name, relative_path, exclude):
+                        yield entry.path
+        except OSError as e:
+            if on_error is not None:
+                on_error(e)
+            continue
+
+        for entry in reversed(subdirectories):
+            try:
+                key = _dir_key(entry.path, entry.stat())
+            except OSError as e:
+                if on_error is not None:
+                    on_error(e)
+                continue
+            if key in visited or key in skip:
+                continue
+            visited.add(key)
+            pending.append((entry.path, relative_dir + entry.name + "/"))
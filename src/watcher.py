@@ -0,0 +1,271 @@
+"""
+Hot-folder watching.
+
+FolderWatcher keeps one Sorter running against a set of folders and sorts
+each PDF dropped there shortly after it arrives. The Sorter stays alive
+between files, so its compiled mapping, text cache and OCR worker pool are
+warm and a single file takes seconds rather than a full start-up.
+
+New files are noticed through inotify on Linux, read directly from libc so
+no extra package is needed. Elsewhere, or if inotify is unavailable, the
+folders are polled. inotify does not see files written to a network share
+by another machine, so with inotify the folders are still rescanned every
+rescan_interval seconds.
+
+A scanner may still be writing a file when it first appears. A file is only
+sorted once its size and mtime have not changed for settle_seconds and it
+ends with a PDF end-of-file marker. A file that never gets the marker is
+sorted once it is stable and max_wait seconds have passed since it was first
+seen, so a PDF with trailing bytes is not held back for ever. A file left in place (unmatched, or
+failed) is not tried again until it changes or the mapping file is edited.
+"""
+
+import os
+import sys
+import time
+import struct
+import select
+import threading
+import ctypes
+import ctypes.util
+
+DEFAULT_SETTLE_SECONDS = 2.0
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_RESCAN_INTERVAL = 60.0
+DEFAULT_MAX_WAIT = 120.0
+# How far from the end of a file to look for the end-of-file marker.
+EOF_SEARCH_BYTES = 1024
+
+# inotify event masks (see <sys/inotify.h>).
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_EVENT_HEADER = struct.Struct("iIII")
+
+
+class _Inotify:
+    """The paths written or moved into a set of folders, from Linux inotify."""
+
+    def __init__(self, folders):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._folders = {}
+        mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        try:
+            for folder in folders:
+                wd = libc.inotify_add_watch(self.fd, os.fsencode(folder), mask)
+                if wd < 0:
+                    raise OSError(ctypes.get_errno(), f"Cannot watch {folder}")
+                self._folders[wd] = folder
+        except OSError:
+            self.close()
+            raise
+
+    def wait(self, timeout, wake_fd):
+        """Waits up to timeout seconds for events, or until wake_fd is readable; returns the paths the events name."""
+        readable, _, _ = select.select([self.fd, wake_fd], [], [], max(0.0, timeout))
+        if self.fd not in readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset + _IN_EVENT_HEADER.size <= len(data):
+            wd, _, _, length = _IN_EVENT_HEADER.unpack_from(data, offset)
+            offset += _IN_EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name and wd in self._folders:
+                paths.append(os.path.join(self._folders[wd], os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Pending:
+    """A file seen but not yet sorted: its last size and mtime, and since when they have held."""
+
+    __slots__ = ("size", "mtime_ns", "stable_since", "first_seen")
+
+    def __init__(self, stat, now):
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.stable_since = now
+        self.first_seen = now
+
+
+def ends_like_a_pdf(file_path, size):
+    """True if the last bytes of a file hold the %%EOF marker that ends a PDF."""
+    try:
+        with open(file_path, "rb") as f:
+            f.seek(max(0, size - EOF_SEARCH_BYTES))
+            return b"%%EOF" in f.read(EOF_SEARCH_BYTES)
+    except OSError:
+        # E.g. still locked by the program writing it.
+        return False
+
+
+class FolderWatcher:
+    """
+    Sorts PDFs as they arrive in the top level of the given folders, with a
+    long-lived Sorter, until stop() is called. sort_options are passed to
+    Sorter.sort_files (e.g. first_page_only, stream_pages).
+    """
+
+    def __init__(self, sorter, folders, settle_seconds=DEFAULT_SETTLE_SECONDS, poll_interval=DEFAULT_POLL_INTERVAL,
+                 rescan_interval=DEFAULT_RESCAN_INTERVAL, max_wait=DEFAULT_MAX_WAIT, use_inotify=True, **sort_options):
+        self.sorter = sorter
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.max_wait = max_wait
+        self.use_inotify = use_inotify and sys.platform.startswith("linux")
+        self.sort_options = sort_options
+        self.sorted_batches = 0
+        self._pending = {}
+        # (size, mtime_ns) of files already tried and left in place.
+        self._done = {}
+        self._stop = threading.Event()
+        # Pipe written by stop() to end an inotify wait.
+        self._wake = None
+        self._mapping_mtime = self._mapping_stamp()
+
+    def stop(self):
+        """Makes run() return after the batch in progress, if any."""
+        self._stop.set()
+        wake = self._wake
+        if wake is not None:
+            try:
+                os.write(wake[1], b"x")
+            except OSError:
+                pass
+
+    def _report(self, message):
+        if self.sorter.status_callback:
+            self.sorter.status_callback(message)
+
+    def _mapping_stamp(self):
+        try:
+            return os.stat(self.sorter.mapping_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def run(self):
+        """Watches and sorts until stop() is called."""
+        events = None
+        if self.use_inotify:
+            try:
+                events = _Inotify(self.folders)
+                self._wake = os.pipe()
+            except (OSError, AttributeError) as e:
+                self._report(f"inotify unavailable ({e}); polling instead")
+        self._report(f"Watching {len(self.folders)} folder(s) by {'inotify' if events else 'polling'}")
+        next_scan = 0.0
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                if now >= next_scan:
+                    self._reload_mapping_if_changed()
+                    self.scan()
+                    next_scan = now + (self.rescan_interval if events else self.poll_interval)
+                ready = self.ready_files(now)
+                if ready:
+                    self.sort(ready)
+                    continue
+                wake = next_scan
+                if self._pending:
+                    wake = min(wake, now + self.settle_seconds / 2)
+                if events is not None:
+                    for path in events.wait(wake - now, self._wake[0]):
+                        self.notice(path)
+                else:
+                    self._stop.wait(max(0.0, wake - now))
+        finally:
+            if events is not None:
+                events.close()
+            wake, self._wake = self._wake, None
+            if wake is not None:
+                for fd in wake:
+                    os.close(fd)
+        self._report("Stopped watching")
+
+    def _reload_mapping_if_changed(self):
+        """Reloads the mapping after it was edited, and lets files left unmatched be tried again."""
+        stamp = self._mapping_stamp()
+        if stamp == self._mapping_mtime or stamp is None:
+            return
+        self._mapping_mtime = stamp
+        self.sorter.mapping_data = self.sorter.load_mapping()
+        self._done.clear()
+
+    def scan(self):
+        """Notices every PDF now in the folders, and forgets tried files that are gone."""
+        present = set()
+        for folder in self.folders:
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.name.lower().endswith(".pdf") and entry.is_file():
+                            present.add(entry.path)
+                            self.notice(entry.path, entry.stat())
+            except OSError as e:
+                self._report(f"Error scanning {folder}: {e}")
+        for path in list(self._done):
+            if path not in present:
+                del self._done[path]
+        for path in list(self._pending):
+            if path not in present:
+                del self._pending[path]
+
+    def notice(self, file_path, stat=None):
+        """Starts waiting for a PDF to settle, unless it was already tried as it is."""
+        if not file_path.lower().endswith(".pdf") or file_path in self._pending:
+            return
+        try:
+            stat = stat or os.stat(file_path)
+        except OSError:
+            return
+        if self._done.get(file_path) == (stat.st_size, stat.st_mtime_ns):
+            return
+        self._pending[file_path] = _Pending(stat, time.monotonic())
+
+    def ready_files(self, now):
+        """The pending files that have stopped changing and look complete, in the order they arrived."""
+        ready = []
+        for file_path, pending in list(self._pending.items()):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                del self._pending[file_path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (pending.size, pending.mtime_ns):
+                pending.size, pending.mtime_ns, pending.stable_since = stat.st_size, stat.st_mtime_ns, now
+                continue
+            if stat.st_size == 0 or now - pending.stable_since < self.settle_seconds:
+                continue
+            if ends_like_a_pdf(file_path, stat.st_size) or now - pending.first_seen >= self.max_wait:
+                ready.append((pending.first_seen, file_path))
+        return [file_path for _, file_path in sorted(ready)]
+
+    def sort(self, file_paths):
+        """Sorts a batch of settled files; those left in place are not tried again until they change."""
+        for file_path in file_paths:
+            del self._pending[file_path]
+        try:
+            self.sorter.sort_files(file_paths, **self.sort_options)
+        except Exception as e:
+            self._report(f"An error occurred during sorting: {e}")
+        self.sorted_batches += 1
+        for file_path in file_paths:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            self._done[file_path] = (stat.st_size, stat.st_mtime_ns)
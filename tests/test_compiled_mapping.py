@@ -0,0 +1,73 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+from src import compiled_mapping
+from src.compiled_mapping import load_compiled_mapping, get_cache_dir
+
+class TestCompiledMapping(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.mapping_path = os.path.join(self.temp_dir, "hr.json")
+        user_cache = patch('src.text_cache.user_cache_dir', return_value=os.path.join(self.temp_dir, "user_cache"))
+        user_cache.start()
+        self.addCleanup(user_cache.stop)
+        self._write_mapping({"Employee Questionnaire": "Questionnaire", "Contract": "Contracts"})
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _write_mapping(self, data):
+        with open(self.mapping_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    def _artifacts(self):
+        return sorted(os.listdir(get_cache_dir()))
+
+    def test_compiles_and_migrates_old_format(self):
+        compiled = load_compiled_mapping(self.mapping_path)
+        self.assertEqual(compiled.keys, ["Employee Questionnaire", "Contract"])
+        self.assertEqual(compiled.dests, ["Questionnaire", "Contracts"])
+        self.assertEqual(compiled.phrases, ["employee questionnaire", "contract"])
+        self.assertEqual(compiled.rules["Contract"], {"name": "Contract", "dest": "Contracts"})
+        self.assertEqual(len(self._artifacts()), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, ".compiled")))
+
+    def test_second_load_uses_artifact(self):
+        """An unchanged mapping is loaded from the artifact without recompiling."""
+        first = load_compiled_mapping(self.mapping_path)
+        with patch('src.compiled_mapping.matcher.PhraseMatcher.from_mapping') as mock_build:
+            second = load_compiled_mapping(self.mapping_path)
+        mock_build.assert_not_called()
+        self.assertEqual(second.digest, first.digest)
+        self.assertEqual(second.matcher.find_first("signed contract"), (1, 7))
+
+    def test_changed_mapping_is_rebuilt(self):
+        """Editing the JSON rebuilds the artifact and removes the stale one."""
+        first = load_compiled_mapping(self.mapping_path)
+        self._write_mapping({"Invoice": "Invoices"})
+        second = load_compiled_mapping(self.mapping_path)
+        self.assertNotEqual(first.digest, second.digest)
+        self.assertEqual(second.keys, ["Invoice"])
+        self.assertEqual(self._artifacts(), [os.path.basename(compiled_mapping.get_compiled_path(self.mapping_path, second.digest))])
+
+    def test_stale_artifact_of_other_mapping_is_kept(self):
+        """Cleanup only touches artifacts of the same mapping file, also one of the same name elsewhere."""
+        os.makedirs(os.path.join(self.temp_dir, "elsewhere"))
+        for other_path in (os.path.join(self.temp_dir, "hr.old.json"), os.path.join(self.temp_dir, "elsewhere", "hr.json")):
+            with open(other_path, "w", encoding="utf-8") as f:
+                json.dump({"Payroll": "Pay"}, f)
+            load_compiled_mapping(other_path)
+        load_compiled_mapping(self.mapping_path)
+        self.assertEqual(len(self._artifacts()), 3)
+
+    def test_missing_file_compiles_empty_mapping(self):
+        compiled = load_compiled_mapping(os.path.join(self.temp_dir, "missing.json"))
+        self.assertEqual(compiled.rules, {})
+        self.assertIsNone(compiled.matcher.find_first("anything"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,10 @@
 import os
+import json
 import shutil
+import tempfile
 import unittest
+from unittest.mock import patch
+import fitz
 from src.sorter import Sorter
 
 class TestDryRun(unittest.TestCase):
@@ -39,19 +43,12 @@ class TestDryRun(unittest.TestCase):
 
         # --- Act & Assert ---
         pdf_files = [f for f in os.listdir(self.pristine_dir) if f.lower().endswith('.pdf')]
-        
-        for filename in pdf_files:
-            pdf_path = os.path.join(self.pristine_dir, filename)
-            
-            # 1. Read the text from the PDF (includes OCR fallback)
-            text = sorter.read_pdf_text(pdf_path)
-            
-            # 2. Find the destination without moving the file
-            destination = sorter.find_destination(text)
-            
-            # 3. Print the result
-            if destination:
-                print(f"-> '{filename}' would be sorted to folder: '{destination}'")
+
+        # classify_many reads and matches every PDF (with OCR fallback) without moving it.
+        for pdf_path, match in sorter.classify_many([self.pristine_dir]):
+            filename = os.path.basename(pdf_path)
+            if match:
+                print(f"-> '{filename}' would be sorted to folder: '{match.dest}' ({match.describe()})")
             else:
                 print(f"-> '{filename}' -> No match found.")
         
@@ -64,5 +61,56 @@ class TestDryRun(unittest.TestCase):
                 f"File '{filename}' was moved or deleted, but it should not have been."
             )
 
+class TestClassifyMany(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.inbox = os.path.join(self.temp_dir, "inbox")
+        os.makedirs(self.inbox)
+        self.mapping_path = os.path.join(self.temp_dir, "mapping.json")
+        with open(self.mapping_path, "w", encoding="utf-8") as f:
+            json.dump({
+                r"^scan_": {"name": "Scans", "dest": "Scans", "type": "filename"},
+                "invoice": {"name": "Invoices", "dest": "Invoices"},
+            }, f)
+        for name, body in (("a.pdf", "Invoice 7"), ("b.pdf", "Letter"), ("scan_1.pdf", "Invoice 8")):
+            with fitz.open() as doc:
+                doc.new_page().insert_text((72, 72), body)
+                doc.save(os.path.join(self.inbox, name))
+
+    def test_classifies_without_moving(self):
+        """Every PDF is classified as sort_files would, and nothing leaves the inbox."""
+        # --- Arrange ---
+        sorter = Sorter(self.mapping_path)
+
+        # --- Act ---
+        extracted = []
+        def extract_many(paths, **kwargs):
+            for path in paths:
+                extracted.append(os.path.basename(path))
+                yield path, sorter.read_pdf_text(path)
+        with patch.object(Sorter, "extract_many", side_effect=extract_many) as mock_extract:
+            results = {os.path.basename(path): match for path, match in sorter.classify_many([self.inbox])}
+
+        # --- Assert ---
+        self.assertEqual(set(results), {"a.pdf", "b.pdf", "scan_1.pdf"})
+        self.assertEqual((results["a.pdf"].dest, results["a.pdf"].kind), ("Invoices", "text"))
+        self.assertIsNone(results["b.pdf"])
+        self.assertEqual(results["scan_1.pdf"].kind, "filename")
+        # The filename rule settled scan_1.pdf, so only the other two were read, in one batch.
+        mock_extract.assert_called_once()
+        self.assertEqual(sorted(extracted), ["a.pdf", "b.pdf"])
+        self.assertEqual(sorted(os.listdir(self.inbox)), ["a.pdf", "b.pdf", "scan_1.pdf"])
+        self.assertFalse(os.path.exists(os.path.join(sorter.template_dir, "Invoices")))
+
+    def test_streaming_matches_the_same(self):
+        sorter = Sorter(self.mapping_path)
+        paths = [os.path.join(self.inbox, "a.pdf"), os.path.join(self.inbox, "b.pdf")]
+
+        streamed = [(path, match and match.dest) for path, match in sorter.classify_many(paths, stream_pages=True)]
+
+        self.assertEqual(streamed, [(paths[0], "Invoices"), (paths[1], None)])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,125 @@
+import random
+import unittest
+from unittest.mock import patch
+from src.matcher import PhraseMatcher, ApproximateMatcher, normalize_text
+from src.sorter import Sorter
+
+def naive_first(phrases, text):
+    """The original rule-by-rule scan, used as the reference behaviour."""
+    for index, phrase in enumerate(phrases):
+        if phrase in text:
+            return index, text.index(phrase)
+    return None
+
+def substring_distance(phrase, text):
+    """Fewest edits turning phrase into some substring of text (Sellers' dynamic programme)."""
+    row = list(range(len(phrase) + 1))
+    best = row[-1]
+    for ch in text:
+        previous, row[0] = row[0], 0
+        for j, pch in enumerate(phrase, 1):
+            previous, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, previous + (pch != ch))
+        best = min(best, row[-1])
+    return best
+
+class TestPhraseMatcher(unittest.TestCase):
+
+    def test_first_rule_in_order_wins(self):
+        """
+        A later phrase that appears earlier in the text must not beat an
+        earlier rule that appears later in the text.
+        """
+        phrases = ["final report", "report", "invoice"]
+        matcher = PhraseMatcher(phrases)
+        text = "invoice attached. see the final report."
+        self.assertEqual(matcher.find_first(text), naive_first(phrases, text))
+        self.assertEqual(matcher.find_first(text), (0, 26))
+
+    def test_overlapping_and_suffix_phrases(self):
+        """Phrases that are suffixes or prefixes of each other are all found."""
+        phrases = ["she", "he", "hers", "his", "ushers"]
+        texts = ["ushers", "this", "he said", "nothing here", "shis", "ahishers"]
+        matcher = PhraseMatcher(phrases)
+        for text in texts:
+            self.assertEqual(matcher.find_first(text), naive_first(phrases, text), text)
+
+    def test_empty_phrase_matches_like_substring_check(self):
+        """An empty phrase matches any text, as '' in text does."""
+        matcher = PhraseMatcher(["payroll", ""])
+        self.assertEqual(matcher.find_first("anything"), (1, 0))
+        self.assertEqual(matcher.find_first("payroll summary"), (0, 0))
+
+    def test_no_match(self):
+        matcher = PhraseMatcher(["invoice", "receipt"])
+        self.assertIsNone(matcher.find_first("statement of account"))
+        self.assertIsNone(PhraseMatcher([]).find_first("anything"))
+
+    def test_normalize_text(self):
+        self.assertEqual(normalize_text("  Terms &\n Conditions\tOF  Employment "), "terms & conditions of employment")
+
+class TestApproximateMatcher(unittest.TestCase):
+
+    def test_ocr_misreads_match_within_distance(self):
+        matcher = ApproximateMatcher(["invoice", "employee"], [1, 2])
+        self.assertEqual(matcher.find_first("lnvoice no. 4"), (0, 0, 1))
+        self.assertEqual(matcher.find_first("ernployee handbook"), (1, 0, 2))
+        self.assertIsNone(matcher.find_first("lnvolce"))
+        # An exact occurrence reports distance 0.
+        self.assertEqual(matcher.find_first("new employee"), (1, 4, 0))
+
+    def test_lowest_index_wins_and_below_limits_rules(self):
+        matcher = ApproximateMatcher(["statement", "invoice"], [1, 1])
+        text = "lnvoice and statemant"
+        self.assertEqual(matcher.find_first(text)[0], 0)
+        self.assertIsNone(matcher.find_first(text, below=0))
+        self.assertIsNone(ApproximateMatcher(["statement"], [1]).find_first("staternent"))
+
+    def test_agrees_with_dynamic_programme(self):
+        """The bit-parallel result equals the textbook edit distance on random strings."""
+        rng = random.Random(7)
+        for _ in range(200):
+            phrases = ["".join(rng.choice("abc") for _ in range(rng.randint(2, 6))) for _ in range(4)]
+            distances = [rng.randint(1, 2) for _ in phrases]
+            text = "".join(rng.choice("abc ") for _ in range(rng.randint(0, 12)))
+            matcher = ApproximateMatcher(phrases, distances)
+            expected = next(
+                (i for i, (p, k) in enumerate(zip(phrases, matcher.max_distances))
+                 if substring_distance(p, text) <= k), None)
+            found = matcher.find_first(text)
+            self.assertEqual(None if found is None else found[0], expected, (phrases, text))
+            if found is not None:
+                # The reported distance is the first occurrence's, at most the rule's limit.
+                index, offset, distance = found
+                self.assertLessEqual(distance, matcher.max_distances[index])
+                self.assertGreaterEqual(distance, substring_distance(phrases[index], text))
+                self.assertLessEqual(substring_distance(phrases[index], text[offset:]), distance)
+
+class TestSorterFindDestination(unittest.TestCase):
+
+    @patch('src.sorter.utils.MappingUtils.load_mapping')
+    def test_find_destination_uses_mapping_order(self, mock_load_mapping):
+        """find_destination returns the rule of the first matching phrase in mapping order."""
+        mock_load_mapping.return_value = {
+            "Final  Report": {"name": "Final Report", "dest": "Reports"},
+            "INVOICE": {"name": "Invoice", "dest": "Invoices"},
+        }
+        sorter = Sorter('dummy_mapping.json')
+
+        text = "Invoice No. 42\nThis is the final\nreport for the year."
+        self.assertEqual(sorter.find_destination(text), {"name": "Final Report", "dest": "Reports"})
+        self.assertEqual(sorter.find_destination("invoice only"), {"name": "Invoice", "dest": "Invoices"})
+        self.assertIsNone(sorter.find_destination("nothing relevant"))
+
+    @patch('src.sorter.utils.MappingUtils.load_mapping')
+    def test_approximate_mode_is_opt_in(self, mock_load_mapping):
+        """Rules with a max_distance only tolerate misreads when the Sorter runs in approximate mode."""
+        mock_load_mapping.return_value = {
+            "invoice": {"name": "Invoice", "dest": "Invoices", "max_distance": 1},
+            "statement": {"name": "Statement", "dest": "Statements"},
+        }
+        text = "Statement and lnvoice"
+        self.assertEqual(Sorter('dummy_mapping.json').find_destination(text)["dest"], "Statements")
+        self.assertEqual(Sorter('dummy_mapping.json', approximate=True).find_destination(text)["dest"], "Invoices")
+
+if __name__ == '__main__':
+    unittest.main()
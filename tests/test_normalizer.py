@@ -0,0 +1,49 @@
+import unittest
+from src.normalizer import normalize_text
+from src.matcher import PhraseMatcher
+from src.compiled_mapping import CompiledMapping
+
+class TestNormalizeText(unittest.TestCase):
+
+    def test_matches_old_fold_on_plain_text(self):
+        text = "  Terms &\n Conditions\tOF  Employment \r\n"
+        self.assertEqual(normalize_text(text), ' '.join(text.split()).lower())
+
+    def test_ligatures_and_compatibility_forms(self):
+        self.assertEqual(normalize_text("ﬁnal ﬂow ﬀ"), "final flow ff")
+        self.assertEqual(normalize_text("ＩＮＶＯＩＣＥ №5"), "invoice no5")
+        self.assertEqual(normalize_text("𝐈𝐍𝐕𝐎𝐈𝐂𝐄"), "invoice")
+        # Decomposed accents compose to the same text as precomposed ones.
+        self.assertEqual(normalize_text("Cafe\u0301"), normalize_text("Café"))
+
+    def test_non_latin_text(self):
+        self.assertEqual(normalize_text("ДОГОВОР  Подряда"), "договор подряда")
+        self.assertEqual(normalize_text("ΠΡΟΫΠΟΘΈΣΕΙΣ Όροι"), "προϋποθέσεις όροι")
+        # Already lowercase and in NFKC form, but with a soft hyphen or a compatibility form.
+        self.assertEqual(normalize_text("дого\xadвор"), "договор")
+        self.assertEqual(normalize_text("счёт ﬁnal"), "счёт final")
+
+    def test_invisible_characters_and_spaces(self):
+        self.assertEqual(normalize_text("in\xadvoice pay\u200bment"), "invoice payment")
+        self.assertEqual(normalize_text("purchase\xa0order\u2003form\u2028here"), "purchase order form here")
+
+    def test_hyphenated_line_breaks_are_joined(self):
+        self.assertEqual(normalize_text("Employ-\nment con\u2010\r\n   tract"), "employment contract")
+        # A hyphen within a line, or one followed by a space, stays.
+        self.assertEqual(normalize_text("follow-up - \nnext"), "follow-up - next")
+
+    def test_repeated_text_is_returned_from_cache(self):
+        text = "Some ﬁle Text"
+        self.assertIs(normalize_text(text), normalize_text(text))
+
+    def test_phrases_and_text_are_normalized_alike(self):
+        """A phrase typed with a ligature or soft hyphen matches the plain text, and vice versa."""
+        compiled = CompiledMapping({
+            "ﬁnal report": {"name": "Reports", "dest": "Reports"},
+            "pay\xadslip": {"name": "Payroll", "dest": "Payroll"},
+        })
+        self.assertEqual(compiled.find_document_rule(normalize_text("The FINAL\nreport")), (0, 4, 0))
+        self.assertEqual(PhraseMatcher.from_mapping(["pay\xadslip"]).find_first(normalize_text("Pay-\nslip")), (0, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,13 @@
 import os
+import json
+import pickle
 import shutil
+import tempfile
+import subprocess
 import unittest
 from unittest.mock import patch, MagicMock
 from src.sorter import Sorter, OCR_AVAILABLE
+from src.ocr import OcrEngine, embedded_scan_pixmap
 
 # We import the specific exception to simulate it being raised
 if OCR_AVAILABLE:
@@ -33,7 +38,7 @@ class TestOCRFallback(unittest.TestCase):
 
     @patch('src.sorter.utils.MappingUtils.load_mapping')
     @patch('src.sorter.fitz.open')
-    @patch('src.sorter.Image.frombytes')
+    @patch('src.ocr.Image.frombytes')
     @patch('src.sorter.pytesseract.image_to_string')
     def test_ocr_fallback_is_triggered(self, mock_image_to_string, mock_frombytes, mock_fitz_open, mock_load_mapping):
         """
@@ -103,5 +108,296 @@ class TestOCRFallback(unittest.TestCase):
         self.assertEqual(extracted_text, "")
         print("\n--- Tesseract Not Found Test Passed ---\nSuccessfully handled missing Tesseract executable.\n-----------------------------------")
 
+    @patch('src.sorter.utils.MappingUtils.load_mapping')
+    @patch('src.sorter.fitz.open')
+    @patch('src.ocr.Image.frombytes')
+    @patch('src.sorter.pytesseract.image_to_string')
+    def test_only_image_pages_are_ocred(self, mock_image_to_string, mock_frombytes, mock_fitz_open, mock_load_mapping):
+        """
+        Tests that a mixed document is opened once, text pages are read from
+        the text layer, and only the scanned page goes to OCR.
+        """
+        # --- Arrange ---
+        mock_load_mapping.return_value = {"ocr_text": "ScannedDocs"}
+        text_page = MagicMock()
+        text_page.get_text.return_value = "Typed cover page text. "
+        scanned_page = MagicMock()
+        scanned_page.get_text.return_value = ""
+        mock_fitz_open.return_value = create_mock_document_context([text_page, scanned_page])
+        mock_image_to_string.return_value = "Scanned signature page."
+
+        sorter = Sorter(self.mapping_path)
+
+        # --- Act ---
+        extracted_text = sorter.read_pdf_text('mixed_document.pdf')
+
+        # --- Assert ---
+        self.assertEqual(extracted_text, "Typed cover page text. Scanned signature page.")
+        mock_fitz_open.assert_called_once()
+        mock_image_to_string.assert_called_once()
+        text_page.get_pixmap.assert_not_called()
+        scanned_page.get_pixmap.assert_called_once()
+
+    @patch('src.sorter.pytesseract.image_to_string')
+    def test_blank_pages_of_digital_pdfs_are_not_ocred(self, mock_image_to_string):
+        """A page with no text, image or drawing has nothing for OCR to read."""
+        import fitz
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        pdf_path = os.path.join(temp_dir, "report.pdf")
+        with fitz.open() as doc:
+            doc.new_page().insert_text((72, 72), "Quarterly report, page one")
+            doc.new_page()
+            doc.new_page().insert_text((72, 72), "Quarterly report, page three")
+            doc.save(pdf_path)
+
+        text = Sorter(self.mapping_path).read_pdf_text(pdf_path)
+        deferred = list(Sorter(self.mapping_path, ocr_engine=OcrEngine(batch_size=8)).extract_many([pdf_path]))
+
+        mock_image_to_string.assert_not_called()
+        self.assertIn("page three", text)
+        self.assertEqual(deferred, [(pdf_path, text)])
+        self.assertTrue(deferred[0][1].complete)
+
+    def _word_data(self, words, conf):
+        """Builds a minimal pytesseract.image_to_data dictionary for one line of words."""
+        return {
+            "text": words,
+            "conf": [conf] * len(words),
+            "block_num": [1] * len(words),
+            "par_num": [1] * len(words),
+            "line_num": [1] * len(words),
+        }
+
+    def _write_ocr_mapping(self):
+        with open(self.mapping_path, "w") as f:
+            f.write('{"ocr text": "ScannedDocs"}')
+
+    @patch('src.sorter.fitz.open')
+    @patch('src.ocr.Image.frombytes')
+    @patch('src.ocr.pytesseract.image_to_data')
+    def test_adaptive_ocr_keeps_confident_low_dpi_match(self, mock_image_to_data, mock_frombytes, mock_fitz_open):
+        """A confident low-DPI result that matches a rule is not re-rendered."""
+        self._write_ocr_mapping()
+        mock_page = MagicMock()
+        mock_page.get_text.return_value = ""
+        mock_fitz_open.return_value = create_mock_document_context([mock_page])
+        mock_image_to_data.return_value = self._word_data(["Some", "OCR", "text"], 91)
+
+        sorter = Sorter(self.mapping_path, ocr_engine=OcrEngine(adaptive=True, tiers=(150, 300)))
+        extracted_text = sorter.read_pdf_text('scanned_document.pdf')
+
+        self.assertEqual(extracted_text, "Some OCR text")
+        mock_page.get_pixmap.assert_called_once()
+        self.assertEqual(mock_page.get_pixmap.call_args.kwargs["dpi"], 150)
+        self.assertEqual(sorter.ocr_engine.tier_counts[150], 1)
+        self.assertEqual(sorter.ocr_engine.page_log, [("scanned_document.pdf", 1, 150, 91.0)])
+
+    @patch('src.sorter.fitz.open')
+    @patch('src.ocr.Image.frombytes')
+    @patch('src.ocr.pytesseract.image_to_data')
+    def test_adaptive_ocr_rerenders_low_confidence_or_unmatched(self, mock_image_to_data, mock_frombytes, mock_fitz_open):
+        """Low confidence, or text matching no rule, moves the page to the next DPI tier."""
+        self._write_ocr_mapping()
+        low_confidence_page = MagicMock()
+        low_confidence_page.get_text.return_value = ""
+        unmatched_page = MagicMock()
+        unmatched_page.get_text.return_value = ""
+        mock_fitz_open.return_value = create_mock_document_context([low_confidence_page, unmatched_page])
+        mock_image_to_data.side_effect = [
+            self._word_data(["0CR", "texl"], 40),      # page 1 at 150 dpi: low confidence
+            self._word_data(["OCR", "text"], 88),      # page 1 at 300 dpi
+            self._word_data(["Unrelated", "page"], 95),  # page 2 at 150 dpi: confident, no match
+            self._word_data(["Unrelated", "page"], 96),  # page 2 at 300 dpi
+        ]
+
+        sorter = Sorter(self.mapping_path, ocr_engine=OcrEngine(adaptive=True, tiers=(150, 300)))
+        sorter.read_pdf_text('scanned_document.pdf')
+
+        self.assertEqual(mock_image_to_data.call_count, 4)
+        self.assertEqual(sorter.ocr_engine.tier_counts[300], 2)
+        self.assertEqual(sorter.ocr_engine.tier_summary(), "300 dpi: 2")
+
+    def test_adaptive_ocr_accepts_what_the_whole_text_rules_match(self):
+        """Expressions count as matches; filename and metadata keys are not phrases to look for."""
+        with open(self.mapping_path, "w") as f:
+            json.dump({
+                "invoice AND total": {"name": "Invoices", "dest": "Invoices", "type": "expression"},
+                "^scan_": {"name": "Scans", "dest": "Scans", "type": "filename"},
+                "acme": {"name": "Acme", "dest": "Acme", "type": "metadata"},
+            }, f)
+        sorter = Sorter(self.mapping_path)
+
+        accept = pickle.loads(pickle.dumps(sorter.ocr_accept))
+
+        self.assertTrue(accept("Invoice 1001 ... Total 12"))
+        self.assertFalse(accept("see ^scan_ here, from acme"))
+        self.assertIs(sorter.ocr_accept, sorter.ocr_accept)
+
+        with open(self.mapping_path, "w") as f:
+            json.dump({"^scan_": {"name": "Scans", "dest": "Scans", "type": "filename"}}, f)
+        self.assertIsNone(Sorter(self.mapping_path).ocr_accept)
+
+    def test_parallel_extraction_matches_serial_order_and_text(self):
+        """
+        Tests that extract_many with an OCR worker pool yields the same text,
+        in the same order, as reading the files one by one.
+        """
+        pristine_dir = "tests/test_pdfs_pristine"
+        pdf_paths = [os.path.join(pristine_dir, f) for f in sorted(os.listdir(pristine_dir)) if f.lower().endswith('.pdf')]
+        if not pdf_paths:
+            self.skipTest(f"The '{pristine_dir}' directory is empty. Skipping test.")
+        pdf_paths = pdf_paths + pdf_paths[::-1]
+
+        serial_sorter = Sorter(self.mapping_path)
+        serial = [(path, serial_sorter.read_pdf_text(path, first_page_only=True)) for path in pdf_paths]
+
+        parallel_sorter = Sorter(self.mapping_path, ocr_engine=OcrEngine(workers=2))
+        try:
+            parallel = list(parallel_sorter.extract_many(pdf_paths, first_page_only=True))
+        finally:
+            parallel_sorter.close()
+
+        self.assertEqual(parallel, serial)
+
+    @patch('src.ocr.subprocess.run')
+    def test_batched_ocr_uses_one_tesseract_process(self, mock_run):
+        """
+        Tests that first pages of several scanned files are read by a single
+        Tesseract invocation and the TSV output is split back per page.
+        """
+        # --- Arrange ---
+        import fitz
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        pdf_paths = []
+        for i in range(3):
+            path = os.path.join(temp_dir, f"scan{i}.pdf")
+            with fitz.open() as doc:
+                for _ in range(2):
+                    doc.new_page().draw_rect(fitz.Rect(72, 72, 300, 120), fill=(0, 0, 0))
+                doc.save(path)
+            pdf_paths.append(path)
+
+        header = "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext"
+        rows = [header]
+        for page_num, words in ((1, ["first", "scan"]), (2, []), (3, ["third", "scan"])):
+            rows.append(f"1\t{page_num}\t0\t0\t0\t0\t0\t0\t10\t10\t-1\t")
+            for word_num, word in enumerate(words, start=1):
+                rows.append(f"5\t{page_num}\t1\t1\t1\t{word_num}\t0\t0\t5\t5\t95.0\t{word}")
+        mock_run.return_value = subprocess.CompletedProcess([], 0, stdout="\n".join(rows).encode(), stderr=b"")
+
+        sorter = Sorter(self.mapping_path, ocr_engine=OcrEngine(batch_size=8))
+
+        # --- Act ---
+        results = list(sorter.extract_many(pdf_paths, first_page_only=True))
+
+        # --- Assert ---
+        mock_run.assert_called_once()
+        self.assertEqual(results, [(pdf_paths[0], "first scan"), (pdf_paths[1], ""), (pdf_paths[2], "third scan")])
+        self.assertEqual(sorter.ocr_engine.tier_counts[300], 3)
+
+    @patch('src.ocr.Image.frombytes')
+    @patch('src.ocr.subprocess.Popen')
+    def test_zero_copy_pipes_pixmap_samples_to_tesseract(self, mock_popen, mock_frombytes):
+        """
+        Tests that with zero_copy the rendered page reaches Tesseract's stdin
+        as a PNM header plus the pixmap samples, without a PIL image.
+        """
+        # --- Arrange ---
+        import io
+        import fitz
+        received = io.BytesIO()
+        received.close = lambda: None
+        tsv = "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext\n" \
+              "5\t1\t1\t1\t1\t1\t0\t0\t5\t5\t96.0\tscanned\n" \
+              "5\t1\t1\t1\t1\t2\t0\t0\t5\t5\t94.0\tletter\n"
+        mock_popen.return_value.stdin = received
+        mock_popen.return_value.stdout = io.BytesIO(tsv.encode())
+        mock_popen.return_value.wait.return_value = 0
+
+        engine = OcrEngine(adaptive=True, tiers=(150,), zero_copy=True)
+        with fitz.open() as doc:
+            page = doc.new_page()
+            expected = page.get_pixmap(dpi=150, colorspace=fitz.csGRAY)
+
+            # --- Act ---
+            result = engine.read_page(page)
+
+        # --- Assert ---
+        mock_frombytes.assert_not_called()
+        self.assertEqual(mock_popen.call_args[0][0][1:], ["stdin", "stdout", "tsv"])
+        header = f"P5\n{expected.width} {expected.height}\n255\n".encode("ascii")
+        self.assertEqual(received.getvalue(), header + expected.samples)
+        self.assertEqual(result.text, "scanned letter")
+        self.assertEqual(result.confidence, 95.0)
+
+@unittest.skipIf(not OCR_AVAILABLE, "Pytesseract or Pillow not installed, skipping OCR tests.")
+class TestEmbeddedScanImages(unittest.TestCase):
+
+    def _scan_png(self, dpi=288):
+        """A landscape 'scan' with a dark top-left corner and a grey bottom-right corner."""
+        import fitz
+        with fitz.open() as doc:
+            page = doc.new_page(width=200, height=100)
+            page.draw_rect(fitz.Rect(0, 0, 50, 50), fill=(0, 0, 0))
+            page.draw_rect(fitz.Rect(150, 60, 200, 100), fill=(0.5, 0.5, 0.5))
+            return page.get_pixmap(dpi=dpi).tobytes("png")
+
+    def test_full_page_scan_is_read_upright_from_the_image(self):
+        """
+        Tests that a full-page image is taken from the PDF and oriented like
+        the rendered page, whether the image or the page itself is rotated.
+        """
+        # --- Arrange ---
+        import fitz
+        png = self._scan_png()
+        doc = fitz.open()
+        self.addCleanup(doc.close)
+
+        for image_rotation, page_rotation in ((0, 0), (90, 0), (180, 0), (270, 0), (0, 90), (90, 270)):
+            page = doc.new_page(width=612, height=792)
+            page.insert_image(page.rect, stream=png, rotate=image_rotation, keep_proportion=False)
+            page.set_rotation(page_rotation)
+
+            # --- Act ---
+            pix = embedded_scan_pixmap(page, 100, gray=True)
+            rendered = page.get_pixmap(dpi=100, colorspace=fitz.csGRAY)
+
+            # --- Assert ---
+            label = f"image {image_rotation}, page {page_rotation}"
+            self.assertIsNotNone(pix, label)
+            self.assertEqual(pix.n, 1, label)
+            for fx in (0.05, 0.3, 0.7, 0.95):
+                for fy in (0.05, 0.3, 0.7, 0.95):
+                    ours = pix.pixel(int(fx * pix.width), int(fy * pix.height))[0]
+                    theirs = rendered.pixel(int(fx * rendered.width), int(fy * rendered.height))[0]
+                    self.assertLess(abs(ours - theirs), 60, f"{label} at {fx}, {fy}")
+
+    def test_high_resolution_scan_is_scaled_down_to_the_dpi(self):
+        """Tests that a 288 DPI scan is scaled down for 144 DPI but not scaled up for 300 DPI."""
+        import fitz
+        with fitz.open() as doc:
+            page = doc.new_page(width=200, height=100)
+            page.insert_image(page.rect, stream=self._scan_png())
+            self.assertEqual((embedded_scan_pixmap(page, 144).width, embedded_scan_pixmap(page, 144).height), (400, 200))
+            self.assertEqual(embedded_scan_pixmap(page, 300).width, 800)
+
+    def test_other_pages_fall_back_to_rendering(self):
+        """Tests that pages without exactly one full-page image are not read from an image."""
+        import fitz
+        png = self._scan_png()
+        with fitz.open() as doc:
+            text_page = doc.new_page()
+            text_page.insert_text((72, 72), "Hello")
+            small_image = doc.new_page()
+            small_image.insert_image(fitz.Rect(72, 72, 272, 172), stream=png)
+            two_images = doc.new_page(width=200, height=200)
+            two_images.insert_image(fitz.Rect(0, 0, 200, 100), stream=png)
+            two_images.insert_image(fitz.Rect(0, 100, 200, 200), stream=self._scan_png(dpi=144))
+
+            for page in doc:
+                self.assertIsNone(embedded_scan_pixmap(page, 300), page.number)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,87 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import fitz
+from src.pipeline import SortPipeline
+from src.sorter import Sorter
+
+class TestSortPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.inbox = os.path.join(self.temp_dir, "inbox")
+        os.makedirs(self.inbox)
+
+    def _sorter(self, rules):
+        mapping_path = os.path.join(self.temp_dir, "mapping.json")
+        with open(mapping_path, "w", encoding="utf-8") as f:
+            json.dump(rules, f)
+        return Sorter(mapping_path)
+
+    def _write_files(self, count):
+        # Filename rules settle these without opening them, so they need not be real PDFs.
+        for i in range(count):
+            with open(os.path.join(self.inbox, f"doc{i:03}.pdf"), "wb") as f:
+                f.write(b"%PDF-1.4")
+
+    def test_bounded_queues_hold_back_the_scanner(self):
+        """While the consumer is idle, only a few queue-fulls of documents are scanned ahead of it."""
+        # --- Arrange ---
+        self._write_files(60)
+        sorter = self._sorter({r"^doc": {"name": "Docs", "dest": "Docs", "type": "filename"}})
+        sort_pipeline = SortPipeline(sorter, queue_size=2)
+
+        # --- Act ---
+        results = sort_pipeline.run([self.inbox])
+        first = next(results)
+        time.sleep(0.3)
+        scanned_while_idle = sort_pipeline.scanned
+        rest = list(results)
+
+        # --- Assert ---
+        self.assertLess(scanned_while_idle, 10)
+        self.assertEqual(len(rest) + 1, 60)
+        self.assertEqual(first[1].dest, "Docs")
+        self.assertEqual(sort_pipeline.scanned, 60)
+
+    def test_stopping_early_stops_the_stages(self):
+        self._write_files(20)
+        sorter = self._sorter({r"^doc": {"name": "Docs", "dest": "Docs", "type": "filename"}})
+        sort_pipeline = SortPipeline(sorter, queue_size=1)
+
+        results = sort_pipeline.run([self.inbox])
+        next(results)
+        results.close()
+
+        self.assertLess(sort_pipeline.scanned, 20)
+
+    def test_stage_error_is_raised_to_the_consumer(self):
+        self._write_files(3)
+        sorter = self._sorter({r"^doc": {"name": "Docs", "dest": "Docs", "type": "filename"}})
+
+        with patch.object(Sorter, "_match_before_text", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                list(SortPipeline(sorter).run([self.inbox]))
+
+    def test_several_matchers_give_the_same_results(self):
+        for i, body in enumerate(["Invoice for services", "Contract of sale", "Letter to a friend", "Invoice and contract"] * 3):
+            with fitz.open() as doc:
+                doc.new_page().insert_text((72, 72), body)
+                doc.save(os.path.join(self.inbox, f"{i}.pdf"))
+        sorter = self._sorter({"contract": "Contracts", "invoice": "Invoices"})
+
+        def classify(match_workers):
+            sort_pipeline = SortPipeline(sorter, match_workers=match_workers)
+            return {path: match and match.dest for path, match, _, _ in sort_pipeline.run([self.inbox])}
+
+        one, several = classify(1), classify(3)
+        self.assertEqual(several, one)
+        self.assertEqual(sorted(one.values(), key=str), ["Contracts"] * 6 + ["Invoices"] * 3 + [None] * 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import fitz
+from src import planner
+from src.sorter import Sorter
+
+class TestPlanThenApply(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.inbox = os.path.join(self.temp_dir, "inbox")
+        os.makedirs(self.inbox)
+        self.mapping_path = os.path.join(self.temp_dir, "mapping.json")
+        with open(self.mapping_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "invoice": {"name": "Invoices", "dest": "Invoices"},
+                "contract": {"name": "Contracts", "dest": "Contracts"},
+            }, f)
+        for name, body in (("a.pdf", "Invoice 1"), ("b.pdf", "Invoice 2"), ("c.pdf", "Contract"), ("d.pdf", "Letter")):
+            with fitz.open() as doc:
+                doc.new_page().insert_text((72, 72), body)
+                doc.save(os.path.join(self.inbox, name))
+        self.sorter = Sorter(self.mapping_path)
+        self.plan_path = os.path.join(self.temp_dir, "plan.jsonl")
+
+    def test_plan_moves_nothing(self):
+        counts = planner.write_plan(self.sorter, [self.inbox], self.plan_path)
+
+        self.assertEqual((counts["matched"], counts["unmatched"]), (3, 1))
+        self.assertEqual(len(os.listdir(self.inbox)), 4)
+        header, entries = planner.read_plan(self.plan_path)
+        self.assertEqual(header["template_dir"], os.path.abspath(self.sorter.template_dir))
+        by_name = {os.path.basename(entry.source): entry for entry in entries}
+        self.assertEqual(by_name["c.pdf"].dest, os.path.join(header["template_dir"], "Contracts", "c.pdf"))
+        self.assertEqual(by_name["c.pdf"].rule, "contract")
+        self.assertEqual(len(by_name["c.pdf"].hash), 64)
+        self.assertIsNone(by_name["d.pdf"].dest)
+
+    def test_apply_creates_each_folder_once_and_is_idempotent(self):
+        """A second apply finds every file already in place and moves nothing."""
+        # --- Arrange ---
+        planner.write_plan(self.sorter, [self.inbox], self.plan_path)
+
+        # --- Act ---
+        with patch("src.planner.os.makedirs", wraps=os.makedirs) as mock_makedirs:
+            first = planner.apply_plan(self.plan_path, workers=4)
+        second = planner.apply_plan(self.plan_path, workers=4)
+
+        # --- Assert ---
+        self.assertEqual(mock_makedirs.call_count, 2)
+        self.assertEqual((first["moved"], first["unmatched"]), (3, 1))
+        self.assertEqual((second["done"], second["unmatched"], second["moved"]), (3, 1, 0))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.sorter.template_dir, "Invoices"))), ["a.pdf", "b.pdf"])
+        self.assertEqual(os.listdir(self.inbox), ["d.pdf"])
+
+    def test_changed_source_is_left_in_place(self):
+        planner.write_plan(self.sorter, [self.inbox], self.plan_path)
+        with open(os.path.join(self.inbox, "a.pdf"), "ab") as f:
+            f.write(b"\n% edited after planning\n")
+
+        counts = planner.apply_plan(self.plan_path)
+
+        self.assertEqual((counts["changed"], counts["moved"]), (1, 2))
+        self.assertTrue(os.path.exists(os.path.join(self.inbox, "a.pdf")))
+
+    def test_existing_destinations_are_never_overwritten(self):
+        """Same-named files from two folders, or a file already at the destination, are conflicts."""
+        # --- Arrange ---
+        for folder, body in (("2023", "Invoice one, from 2023"), ("2024", "Invoice two, from 2024")):
+            os.makedirs(os.path.join(self.inbox, folder))
+            with fitz.open() as doc:
+                doc.new_page().insert_text((72, 72), body)
+                doc.save(os.path.join(self.inbox, folder, "scan.pdf"))
+        folders = [os.path.join(self.inbox, "2023"), os.path.join(self.inbox, "2024"), self.inbox]
+        counts = planner.write_plan(self.sorter, folders, self.plan_path)
+        # A different c.pdf is already sorted.
+        os.makedirs(os.path.join(self.sorter.template_dir, "Contracts"))
+        with open(os.path.join(self.sorter.template_dir, "Contracts", "c.pdf"), "wb") as f:
+            f.write(b"%PDF-1.4 another contract")
+
+        # --- Act ---
+        first = planner.apply_plan(self.plan_path, workers=4)
+        second = planner.apply_plan(self.plan_path, workers=4)
+
+        # --- Assert ---
+        self.assertEqual(counts["conflict"], 1)
+        self.assertEqual((first["moved"], first["conflict"]), (3, 2))
+        self.assertEqual((second["done"], second["conflict"], second["moved"]), (3, 2, 0))
+        self.assertEqual(len(os.listdir(os.path.join(self.inbox, "2023")) + os.listdir(os.path.join(self.inbox, "2024"))), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.inbox, "c.pdf")))
+        with open(os.path.join(self.sorter.template_dir, "Contracts", "c.pdf"), "rb") as f:
+            self.assertEqual(f.read(), b"%PDF-1.4 another contract")
+
+    def test_rejects_other_files(self):
+        with open(self.plan_path, "w", encoding="utf-8") as f:
+            f.write('{"invoice": "Invoices"}\n')
+        with self.assertRaises(ValueError):
+            planner.read_plan(self.plan_path)
+
+if __name__ == '__main__':
+    unittest.main()
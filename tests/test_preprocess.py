@@ -0,0 +1,151 @@
+import unittest
+from unittest.mock import patch
+import fitz
+from src import preprocess
+from src.preprocess import Preprocessor, BlankPageDetector, NUMPY_AVAILABLE
+from src.ocr import OcrEngine, OCR_AVAILABLE
+
+if NUMPY_AVAILABLE:
+    import numpy as np
+
+def skewed_page(angle_degrees, background=200):
+    """A gray page with wide margins and dark text-like lines sloping by the given angle."""
+    page = np.full((600, 800), background, dtype=np.uint8)
+    slope = np.tan(np.radians(angle_degrees))
+    xs = np.arange(150, 650)
+    for top in range(150, 450, 30):
+        ys = np.round(top + xs * slope).astype(int)
+        for thickness in range(5):
+            page[ys + thickness, xs] = 30
+    return page
+
+@unittest.skipIf(not NUMPY_AVAILABLE, "NumPy not installed, skipping preprocessing tests.")
+class TestPreprocessSteps(unittest.TestCase):
+
+    def test_crop_keeps_content_and_margin(self):
+        page = skewed_page(0)
+        cropped = preprocess.crop_to_content(page)
+        # Lines span rows 150..424 and columns 150..649.
+        self.assertEqual(cropped.shape, (424 - 150 + 1 + 2 * preprocess.CROP_MARGIN, 500 + 2 * preprocess.CROP_MARGIN))
+        self.assertEqual(int((cropped < 100).sum()), int((page < 100).sum()))
+
+    def test_crop_ignores_specks(self):
+        page = np.full((600, 800), 255, dtype=np.uint8)
+        page[300, 400] = 0
+        self.assertEqual(preprocess.crop_to_content(page).shape, page.shape)
+
+    def test_binarize_removes_gray_background(self):
+        page = skewed_page(0, background=190)
+        # A darker band across the bottom half, like uneven scanner lighting.
+        page[300:, :][page[300:, :] == 190] = 140
+        binary = preprocess.binarize(page)
+        self.assertEqual(set(np.unique(binary)), {0, 255})
+        self.assertTrue((binary[page == 30] == 0).all())
+        self.assertTrue((binary[page >= 140] == 255).mean() > 0.99)
+
+    def test_deskew_straightens_lines(self):
+        page = skewed_page(2.0)
+        self.assertAlmostEqual(preprocess.estimate_skew(page), 2.0)
+        straightened = preprocess.deskew(page)
+        self.assertAlmostEqual(preprocess.estimate_skew(straightened), 0.0)
+        self.assertIs(preprocess.deskew(skewed_page(0)).dtype, np.dtype(np.uint8))
+
+class TestPreprocessor(unittest.TestCase):
+
+    def _pixmap(self):
+        data = np.repeat(skewed_page(1.5)[:, :, None], 3, axis=2)
+        return fitz.Pixmap(fitz.csRGB, 800, 600, data.tobytes(), False)
+
+    @unittest.skipIf(not NUMPY_AVAILABLE, "NumPy not installed, skipping preprocessing tests.")
+    def test_process_returns_gray_pixmap_and_step_times(self):
+        processor = Preprocessor(binarize=False)
+        pix, times = processor.process(self._pixmap())
+        self.assertEqual(pix.n, 1)
+        self.assertLess(pix.width, 800)
+        self.assertEqual(set(times), {"convert", "crop", "deskew"})
+
+    def test_from_steps_rejects_unknown_steps(self):
+        processor = Preprocessor.from_steps(["crop"])
+        self.assertEqual((processor.crop, processor.binarize, processor.deskew), (True, False, False))
+        with self.assertRaises(ValueError):
+            Preprocessor.from_steps(["sharpen"])
+
+    @unittest.skipIf(not (NUMPY_AVAILABLE and OCR_AVAILABLE), "NumPy or OCR libraries not installed.")
+    @patch('src.ocr.pytesseract.image_to_string')
+    def test_engine_ocrs_preprocessed_page_and_records_times(self, mock_image_to_string):
+        """Tests that OcrEngine hands the preprocessed image to Tesseract and totals the step times."""
+        # --- Arrange ---
+        mock_image_to_string.return_value = "scanned text"
+        processor = Preprocessor()
+        engine = OcrEngine(preprocessor=processor)
+        with fitz.open() as doc:
+            page = doc.new_page()
+            page.insert_image(page.rect, pixmap=self._pixmap())
+
+            # --- Act ---
+            result = engine.ocr_page(page)
+
+        # --- Assert ---
+        image = mock_image_to_string.call_args[0][0]
+        self.assertEqual(image.mode, "L")
+        self.assertEqual(result.text, "scanned text")
+        self.assertEqual(set(result.preprocess_times), {"convert", "crop", "binarize", "deskew"})
+        self.assertEqual(processor.pages, 1)
+        self.assertIn("binarize", processor.timing_summary())
+
+def screening_document():
+    """A document with a blank page, a dusty blank page, a barcode separator, a patch code sheet and two text pages."""
+    doc = fitz.open()
+    doc.new_page()
+    dusty = doc.new_page()
+    for x, y in ((80, 90), (300, 500), (520, 700), (200, 260)):
+        dusty.draw_rect(fitz.Rect(x, y, x + 1, y + 1), fill=(0, 0, 0), color=None)
+    separator = doc.new_page()
+    x = 150
+    for width in [1.5, 3, 4.5, 1.5, 1.5, 3, 4.5, 3] * 8:
+        separator.draw_rect(fitz.Rect(x, 300, x + width, 360), fill=(0, 0, 0), color=None)
+        x += width + 3
+    separator.insert_text((200, 390), "DOCUMENT SEPARATOR", fontsize=14)
+    patch_code = doc.new_page()
+    for i in range(4):
+        patch_code.draw_rect(fitz.Rect(250 + i * 25, 100, 262 + i * 25, 600), fill=(0, 0, 0), color=None)
+    text = doc.new_page()
+    for i in range(30):
+        text.insert_text((72, 80 + i * 20), f"Terms and conditions of employment, clause {i}", fontsize=11)
+    one_word = doc.new_page()
+    one_word.insert_text((72, 80), "Invoice", fontsize=9)
+    return doc
+
+@unittest.skipIf(not NUMPY_AVAILABLE, "NumPy not installed, skipping blank page tests.")
+class TestBlankPageDetector(unittest.TestCase):
+
+    def test_classifies_blank_separator_and_content_pages(self):
+        with screening_document() as doc:
+            kinds = [BlankPageDetector().classify(page) for page in doc]
+        self.assertEqual(kinds, ["blank", "blank", "separator", "separator", None, None])
+
+    def test_separators_can_be_kept(self):
+        with screening_document() as doc:
+            self.assertIsNone(BlankPageDetector(detect_separators=False).classify(doc[2]))
+
+    @unittest.skipIf(not OCR_AVAILABLE, "Pytesseract or Pillow not installed, skipping OCR tests.")
+    @patch('src.ocr.pytesseract.image_to_string')
+    def test_engine_skips_and_counts_screened_pages(self, mock_image_to_string):
+        """Tests that blank and separator pages never reach Tesseract and are counted by kind."""
+        # --- Arrange ---
+        mock_image_to_string.return_value = "page text"
+        engine = OcrEngine(blank_detector=BlankPageDetector())
+
+        # --- Act ---
+        with screening_document() as doc:
+            results = [engine.ocr_page(page) for page in doc]
+
+        # --- Assert ---
+        self.assertEqual(mock_image_to_string.call_count, 2)
+        self.assertEqual([r.skipped for r in results], ["blank", "blank", "separator", "separator", None, None])
+        self.assertEqual([r.text for r in results[:4]], [""] * 4)
+        self.assertEqual(engine.skipped_summary(), "blank: 2, separator: 2")
+        self.assertEqual(sum(engine.tier_counts.values()), 2)
+
+if __name__ == '__main__':
+    unittest.main()
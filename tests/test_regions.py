@@ -0,0 +1,153 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+import fitz
+from src.sorter import Sorter, OCR_AVAILABLE
+from src.ocr import OcrEngine
+from src.utils import MappingUtils
+from src.mapping_editor.editor_logic import EditorLogic
+
+TOP_BAND = [0.0, 0.0, 1.0, 0.2]
+
+class TestRegionRules(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.inbox = os.path.join(self.temp_dir, "inbox")
+        os.makedirs(self.inbox)
+
+    def _write_mapping(self, rules):
+        path = os.path.join(self.temp_dir, "regions.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(rules, f)
+        return path
+
+    def _write_pdf(self, name, title, body, rotation=0):
+        """A one-page text PDF with a title in the top band and a body further down."""
+        path = os.path.join(self.inbox, name)
+        with fitz.open() as doc:
+            page = doc.new_page()
+            page.insert_text((72, 72), title, fontsize=18)
+            page.insert_text((72, 500), body, fontsize=11)
+            page.set_rotation(rotation)
+            doc.save(path)
+        return path
+
+    def test_get_rule_scope(self):
+        self.assertIsNone(MappingUtils.get_rule_scope({"name": "A", "dest": "A"}))
+        self.assertIsNone(MappingUtils.get_rule_scope("A"))
+        self.assertEqual(MappingUtils.get_rule_scope({"dest": "A", "region": TOP_BAND}), (0, (0.0, 0.0, 1.0, 0.2)))
+        self.assertEqual(MappingUtils.get_rule_scope({"dest": "A", "page": 2}), (2, None))
+        # Out-of-range values are clamped; an empty rectangle means the whole page.
+        self.assertEqual(MappingUtils.get_rule_scope({"dest": "A", "region": [-1, 0, 2, 0.5]}), (0, (0.0, 0.0, 1.0, 0.5)))
+        self.assertEqual(MappingUtils.get_rule_scope({"dest": "A", "page": 1, "region": [0.5, 0, 0.5, 1]}), (1, None))
+
+    def test_region_rule_only_matches_inside_its_region(self):
+        """A phrase in the body does not satisfy a rule limited to the top band."""
+        mapping_path = self._write_mapping({
+            "invoice": {"name": "Invoice", "dest": "Invoices", "region": TOP_BAND},
+        })
+        titled = self._write_pdf("titled.pdf", "INVOICE", "Payment terms apply.")
+        mentioned = self._write_pdf("mentioned.pdf", "Letter", "Please find the invoice attached.")
+        sorter = Sorter(mapping_path)
+
+        self.assertEqual(sorter.match_regions(titled).index, 0)
+        self.assertIsNone(sorter.match_regions(mentioned))
+
+    def test_region_only_mapping_never_reads_whole_pages(self):
+        """When every rule is region-scoped, sorting does not extract full page text."""
+        # --- Arrange ---
+        mapping_path = self._write_mapping({
+            "invoice": {"name": "Invoice", "dest": "Invoices", "region": TOP_BAND},
+            "statement": {"name": "Statement", "dest": "Statements", "page": 0, "region": TOP_BAND},
+        })
+        self._write_pdf("a.pdf", "STATEMENT", "Balance due.")
+        self._write_pdf("b.pdf", "Memo", "No title here, just an invoice mention.")
+        self._write_pdf("c.pdf", "", "Nothing in the top band at all.")
+        sorter = Sorter(mapping_path)
+
+        # --- Act ---
+        with patch.object(Sorter, "read_pdf_text") as mock_read, patch.object(Sorter, "extract_many") as mock_extract, \
+                patch.object(fitz.Page, "get_text", autospec=True, side_effect=fitz.Page.get_text) as mock_get_text:
+            sorter.sort_files([self.inbox])
+
+        # --- Assert ---
+        mock_read.assert_not_called()
+        mock_extract.assert_not_called()
+        # An empty region (c.pdf's top band) does not read the rest of its page either.
+        self.assertTrue(mock_get_text.called)
+        self.assertTrue(all(call.kwargs.get("clip") is not None for call in mock_get_text.call_args_list))
+        self.assertTrue(os.path.exists(os.path.join(sorter.template_dir, "Statements", "a.pdf")))
+        self.assertTrue(os.path.exists(os.path.join(self.inbox, "b.pdf")))
+
+    def test_first_rule_in_mapping_order_wins_across_scopes(self):
+        """An earlier whole-text rule beats a later region rule, and an earlier region rule skips the text."""
+        mapping_path = self._write_mapping({
+            "confidential": {"name": "Confidential", "dest": "Confidential"},
+            "purchase order": {"name": "Purchase Order", "dest": "Orders", "region": TOP_BAND},
+            "order": {"name": "Other orders", "dest": "Other"},
+        })
+        secret = self._write_pdf("secret.pdf", "PURCHASE ORDER", "Confidential pricing.")
+        plain = self._write_pdf("plain.pdf", "PURCHASE ORDER", "Standard pricing.")
+        sorter = Sorter(mapping_path)
+
+        sorter.sort_files([self.inbox])
+
+        self.assertTrue(os.path.exists(os.path.join(sorter.template_dir, "Confidential", os.path.basename(secret))))
+        self.assertTrue(os.path.exists(os.path.join(sorter.template_dir, "Orders", os.path.basename(plain))))
+
+    def test_region_follows_displayed_page_on_rotated_pages(self):
+        """Regions are fractions of the page as displayed, also when the page is rotated."""
+        mapping_path = self._write_mapping({
+            "invoice": {"name": "Invoice", "dest": "Invoices", "region": [0.0, 0.0, 0.2, 1.0]},
+        })
+        # Rotating by 90 degrees shows the unrotated top band along the right edge, not the left.
+        rotated = self._write_pdf("rotated.pdf", "INVOICE", "Body text.", rotation=90)
+        self.assertIsNone(Sorter(mapping_path).match_regions(rotated))
+
+        mapping_path = self._write_mapping({
+            "invoice": {"name": "Invoice", "dest": "Invoices", "region": [0.8, 0.0, 1.0, 1.0]},
+        })
+        self.assertEqual(Sorter(mapping_path).match_regions(rotated).index, 0)
+
+    @unittest.skipIf(not OCR_AVAILABLE, "Pytesseract or Pillow not installed, skipping OCR tests.")
+    @patch('src.ocr.pytesseract.image_to_string')
+    def test_scanned_page_ocrs_only_the_region(self, mock_image_to_string):
+        """On a page without a text layer only the region is rendered and OCRed."""
+        # --- Arrange ---
+        mock_image_to_string.return_value = "INVOICE"
+        mapping_path = self._write_mapping({
+            "invoice": {"name": "Invoice", "dest": "Invoices", "region": TOP_BAND},
+        })
+        path = os.path.join(self.inbox, "scan.pdf")
+        with fitz.open() as doc:
+            page = doc.new_page()
+            page.draw_rect(fitz.Rect(72, 40, 300, 90), fill=(0, 0, 0))
+            doc.save(path)
+        blank_detector = MagicMock()
+        sorter = Sorter(mapping_path, ocr_engine=OcrEngine(blank_detector=blank_detector))
+
+        # --- Act ---
+        match = sorter.match_regions(path)
+
+        # --- Assert ---
+        self.assertEqual((match.index, match.kind, match.page), (0, "region", 1))
+        # Screening would render the whole page.
+        blank_detector.classify.assert_not_called()
+        image = mock_image_to_string.call_args[0][0]
+        # A 20% band of an A4 page at 300 DPI.
+        self.assertEqual(image.size, (2480, 702))
+
+    def test_editor_keeps_region_when_rule_is_edited(self):
+        logic = EditorLogic()
+        logic.mappings = {"invoice": {"name": "Invoice", "dest": "Invoices", "page": 0, "region": TOP_BAND}}
+        ok, _ = logic.update_rule("invoice", "invoice no", "Invoices", "Bills")
+        self.assertTrue(ok)
+        self.assertEqual(logic.mappings, {"invoice no": {"name": "Invoices", "dest": "Bills", "page": 0, "region": TOP_BAND}})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import fitz
+from src.sorter import Sorter
+from src.utils import MappingUtils
+
+class TestFilenameAndMetadataRules(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.inbox = os.path.join(self.temp_dir, "inbox")
+        os.makedirs(self.inbox)
+
+    def _write_mapping(self, rules):
+        path = os.path.join(self.temp_dir, "types.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(rules, f)
+        return path
+
+    def _write_pdf(self, name, body, metadata=None):
+        path = os.path.join(self.inbox, name)
+        with fitz.open() as doc:
+            page = doc.new_page()
+            page.insert_text((72, 72), body, fontsize=11)
+            if metadata:
+                doc.set_metadata(metadata)
+            doc.save(path)
+        return path
+
+    def test_get_rule_type(self):
+        self.assertEqual(MappingUtils.get_rule_type({"dest": "A"}), "text")
+        self.assertEqual(MappingUtils.get_rule_type("A"), "text")
+        self.assertEqual(MappingUtils.get_rule_type({"dest": "A", "type": "Filename"}), "filename")
+        self.assertEqual(MappingUtils.get_rule_type({"dest": "A", "type": "metadata"}), "metadata")
+        self.assertEqual(MappingUtils.get_rule_type({"dest": "A", "type": "barcode"}), "text")
+        # Page regions only apply to text rules.
+        self.assertIsNone(MappingUtils.get_rule_scope({"dest": "A", "type": "filename", "page": 1}))
+
+    def test_filename_rule_sorts_without_opening_the_document(self):
+        """A matching filename rule earlier than every other rule settles the file with no I/O on it."""
+        # --- Arrange ---
+        mapping_path = self._write_mapping({
+            r"^inv[-_]\d+": {"name": "Invoice scans", "dest": "Invoices", "type": "filename"},
+            "statement": {"name": "Statement", "dest": "Statements", "type": "metadata", "field": "title"},
+            "invoice": {"name": "Invoice", "dest": "Invoices"},
+        })
+        self._write_pdf("INV-2024.pdf", "Invoice body")
+        sorter = Sorter(mapping_path)
+
+        # --- Act ---
+        with patch('src.sorter.fitz.open') as mock_open:
+            moved = sorter.sort_file(os.path.join(self.inbox, "INV-2024.pdf"))
+
+        # --- Assert ---
+        self.assertTrue(moved)
+        mock_open.assert_not_called()
+        self.assertTrue(os.path.exists(os.path.join(sorter.template_dir, "Invoices", "INV-2024.pdf")))
+
+    def test_metadata_rules_match_their_field(self):
+        mapping_path = self._write_mapping({
+            "acme corp": {"name": "Acme", "dest": "Acme", "type": "metadata", "field": "author"},
+            "payslip": {"name": "Payslip", "dest": "Payroll", "type": "metadata"},
+        })
+        by_author = self._write_pdf("a.pdf", "Body", {"author": "ACME  Corp", "title": "Letter"})
+        in_title = self._write_pdf("b.pdf", "Body", {"title": "Acme Corp Payslip"})
+        none = self._write_pdf("c.pdf", "Acme Corp payslip", {"title": "Letter"})
+        sorter = Sorter(mapping_path)
+
+        self.assertEqual(sorter.match_before_text(by_author).index, 0)
+        # "acme corp" only counts in the author field; an unscoped rule checks every field.
+        self.assertEqual(sorter.match_before_text(in_title).index, 1)
+        self.assertIsNone(sorter.match_before_text(none))
+
+    def test_metadata_match_skips_text_extraction(self):
+        """Documents settled by metadata are not read; the rest still go through the text rules in order."""
+        # --- Arrange ---
+        mapping_path = self._write_mapping({
+            "scanner": {"name": "Scans", "dest": "Scans", "type": "metadata", "field": "creator"},
+            "contract": {"name": "Contract", "dest": "Contracts"},
+        })
+        self._write_pdf("scan.pdf", "Contract", {"creator": "Office Scanner 3000"})
+        self._write_pdf("plain.pdf", "Contract", {"creator": "Word"})
+        sorter = Sorter(mapping_path)
+
+        # --- Act ---
+        extracted = []
+        def extract_many(paths, **kwargs):
+            extracted.extend(paths)
+            return [(p, "Contract") for p in extracted]
+        with patch.object(Sorter, "extract_many", side_effect=extract_many):
+            sorter.sort_files([self.inbox])
+
+        # --- Assert ---
+        self.assertEqual(extracted, [os.path.join(self.inbox, "plain.pdf")])
+        self.assertTrue(os.path.exists(os.path.join(sorter.template_dir, "Scans", "scan.pdf")))
+        self.assertTrue(os.path.exists(os.path.join(sorter.template_dir, "Contracts", "plain.pdf")))
+
+    def test_earlier_text_rule_beats_later_filename_rule(self):
+        mapping_path = self._write_mapping({
+            "confidential": {"name": "Confidential", "dest": "Confidential"},
+            r"\.pdf$": {"name": "Everything", "dest": "Other", "type": "filename"},
+            "[unclosed": {"name": "Broken", "dest": "Broken", "type": "filename"},
+        })
+        self._write_pdf("secret.pdf", "Confidential terms")
+        self._write_pdf("public.pdf", "Public terms")
+        sorter = Sorter(mapping_path)
+
+        sorter.sort_files([self.inbox])
+
+        self.assertTrue(os.path.exists(os.path.join(sorter.template_dir, "Confidential", "secret.pdf")))
+        self.assertTrue(os.path.exists(os.path.join(sorter.template_dir, "Other", "public.pdf")))
+
+if __name__ == '__main__':
+    unittest.main()
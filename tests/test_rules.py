@@ -0,0 +1,122 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import fitz
+from src import rules
+from src.rules import compile_expression, RuleSyntaxError, TextTerms
+from src.compiled_mapping import CompiledMapping
+from src.matcher import normalize_text
+from src.sorter import Sorter
+
+def holds(expression, text):
+    return compile_expression(expression).evaluate(TextTerms(normalize_text(text))) is not None
+
+class TestRuleExpressions(unittest.TestCase):
+
+    def test_boolean_operators(self):
+        expression = 'invoice AND (total OR "amount due") AND NOT "credit note"'
+        self.assertTrue(holds(expression, "Invoice 42\nAmount  due: 10"))
+        self.assertFalse(holds(expression, "Invoice 42, credit note, total 10"))
+        self.assertFalse(holds(expression, "Invoice 42"))
+        # NOT binds tighter than AND, and AND tighter than OR.
+        self.assertTrue(holds("memo OR invoice AND NOT paid", "memo, paid"))
+        self.assertFalse(holds("NOT paid AND invoice", "invoice paid"))
+
+    def test_adjacent_words_form_a_phrase(self):
+        self.assertTrue(holds("purchase order AND NOT draft", "Purchase Order #7"))
+        self.assertFalse(holds("purchase order", "order for purchase"))
+
+    def test_near_counts_words_between_in_either_order(self):
+        self.assertTrue(holds("purchase NEAR/0 order", "the purchase order"))
+        self.assertTrue(holds("purchase NEAR/2 order", "order of the purchase"))
+        self.assertFalse(holds("purchase NEAR/1 order", "purchase of the order"))
+        # Any pair of occurrences counts.
+        self.assertTrue(holds('"tax year" NEAR/1 2023', "2023 report ... tax year ends 2023 and beyond"))
+
+    def test_plan_checks_rare_terms_first_and_short_circuits(self):
+        plan = compile_expression("a AND invoice AND acknowledgement")
+        self.assertEqual([node.phrase for node in plan.operands], ["acknowledgement", "invoice", "a"])
+
+        terms = TextTerms("an invoice")
+        self.assertIsNone(plan.evaluate(terms))
+        # Evaluation stopped at the first missing term.
+        self.assertEqual(list(terms._offsets), ["acknowledgement"])
+
+    def test_syntax_errors(self):
+        for expression in ("invoice AND", "(invoice OR bill", "a NEAR/2 (b OR c)", '""', "AND"):
+            with self.assertRaises(RuleSyntaxError):
+                compile_expression(expression)
+
+class TestExpressionRulesInMappings(unittest.TestCase):
+
+    def test_first_rule_in_mapping_order_wins(self):
+        compiled = CompiledMapping({
+            "contract AND NOT draft": {"name": "Contracts", "dest": "Contracts", "type": "expression"},
+            "agreement": {"name": "Agreements", "dest": "Agreements"},
+            "broken AND": {"name": "Broken", "dest": "Broken", "type": "expression"},
+            "employment NEAR/3 contract": {"name": "HR", "dest": "HR", "type": "expression"},
+        })
+        self.assertEqual(compiled.document_indices, [0, 1, 3])
+        self.assertEqual(compiled.find_document_rule("employment contract agreement"), (0, 11, 0))
+        self.assertEqual(compiled.find_document_rule("draft employment contract agreement"), (1, 26, 0))
+        self.assertEqual(compiled.find_document_rule("draft employment contract"), (3, 6, 0))
+        self.assertIsNone(compiled.find_document_rule("broken"))
+
+    def test_streaming_sort_matches_terms_on_different_pages(self):
+        """An AND over terms on different pages holds once both pages have been read."""
+        # --- Arrange ---
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        mapping_path = os.path.join(temp_dir, "rules.json")
+        with open(mapping_path, "w", encoding="utf-8") as f:
+            json.dump({"invoice AND overdue": {"name": "Overdue", "dest": "Overdue", "type": "expression"}}, f)
+        inbox = os.path.join(temp_dir, "inbox")
+        os.makedirs(inbox)
+        with fitz.open() as doc:
+            doc.new_page().insert_text((72, 72), "Invoice 1001")
+            doc.new_page().insert_text((72, 72), "Payment is overdue.")
+            doc.save(os.path.join(inbox, "late.pdf"))
+        sorter = Sorter(mapping_path)
+
+        # --- Act ---
+        sorter.sort_files([inbox], stream_pages=True)
+
+        # --- Assert ---
+        self.assertTrue(os.path.exists(os.path.join(sorter.template_dir, "Overdue", "late.pdf")))
+
+    def test_streaming_decides_a_negation_only_after_the_last_page(self):
+        """A later page can disprove a NOT, so streaming matches the same rules as reading the whole text."""
+        # --- Arrange ---
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        mapping_path = os.path.join(temp_dir, "rules.json")
+        with open(mapping_path, "w", encoding="utf-8") as f:
+            json.dump({
+                'invoice AND NOT "credit note"': {"name": "Invoices", "dest": "Invoices", "type": "expression"},
+                "credit note": {"name": "Credit Notes", "dest": "Credit Notes"},
+            }, f)
+        paths = []
+        for name, second_page in (("refund.pdf", "This is a credit note."), ("plain.pdf", "Thank you for your order.")):
+            paths.append(os.path.join(temp_dir, name))
+            with fitz.open() as doc:
+                doc.new_page().insert_text((72, 72), "Invoice 1001")
+                doc.new_page().insert_text((72, 72), second_page)
+                doc.save(paths[-1])
+        sorter = Sorter(mapping_path)
+
+        # --- Act ---
+        whole = [sorter.match_text(sorter.read_pdf_text(path)) for path in paths]
+        streamed = [sorter.match_streaming(path) for path in paths]
+
+        # --- Assert ---
+        self.assertEqual([match.dest for match in whole], ["Credit Notes", "Invoices"])
+        self.assertEqual([match.dest for match in streamed], ["Credit Notes", "Invoices"])
+        self.assertEqual([match.page for match in streamed], [2, 2])
+
+    def test_probability_estimate_prefers_long_phrases_as_rare(self):
+        self.assertLess(rules._term_probability("acknowledgement"), rules._term_probability("tax"))
+
+if __name__ == '__main__':
+    unittest.main()
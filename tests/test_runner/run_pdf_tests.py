@@ -25,13 +25,17 @@ from typing import Dict, List, Tuple, Optional
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 
 from src.sorter import Sorter
+from src.text_cache import TextCache
+from src.ocr import OcrEngine
+from src.preprocess import Preprocessor, STEPS
 
 
 class PDFTestRunner:
     """Automated test runner for PDF sorting functionality."""
     
-    def __init__(self, test_dir: str = None):
-        """Initialize the test runner."""
+    def __init__(self, test_dir: str = None, text_cache: Optional[TextCache] = None,
+                 ocr_engine: Optional[OcrEngine] = None, approximate: bool = False):
+        """Initialize the test runner. A shared TextCache avoids re-reading PDFs across mappings and runs."""
         if test_dir is None:
             test_dir = Path(__file__).parent
         
@@ -45,6 +49,9 @@ class PDFTestRunner:
         self.mappings_dir.mkdir(exist_ok=True)
         self.results_dir.mkdir(exist_ok=True)
         
+        self.text_cache = text_cache
+        self.ocr_engine = ocr_engine
+        self.approximate = approximate
         self.test_results = []
         
     def get_available_pdfs(self) -> List[Path]:
@@ -65,46 +72,21 @@ class PDFTestRunner:
         
         try:
             # Create sorter instance
-            sorter = Sorter(str(mapping_path))
+            sorter = Sorter(str(mapping_path), ocr_engine=self.ocr_engine, text_cache=self.text_cache,
+                            approximate=self.approximate)
             
             # Read PDF text
             text = sorter.read_pdf_text(str(pdf_path), first_page_only=True)
             
-            # Use the sorter's find_destination method to find matches
-            destination = sorter.find_destination(text)
+            # The match result says which rule matched, and where
+            match = sorter.match_text(text)
             
-            # Try to find which phrase matched by checking against the mapping
-            matched_phrase = None
-            rule_name = None
-            destination_folder = None
-            
-            if destination:
-                # Handle both old format (string) and new format (dict)
-                if isinstance(destination, dict):
-                    destination_folder = destination.get('dest', 'Unknown')
-                    rule_name = destination.get('name', 'Unknown Rule')
-                else:
-                    destination_folder = destination
-                    rule_name = f"Direct mapping"
-                
-                # Normalize the text like the sorter does
-                normalized_text = ' '.join(text.split()).lower()
-                
-                # Check against the mapping data to find which phrase matched
-                for phrase, dest_info in sorter.mapping_data.items():
-                    normalized_phrase = ' '.join(phrase.split()).lower()
-                    if normalized_phrase in normalized_text:
-                        if isinstance(dest_info, dict):
-                            if dest_info.get('dest') == destination_folder:
-                                matched_phrase = phrase
-                                break
-                        else:
-                            if dest_info == destination_folder:
-                                matched_phrase = phrase
-                                break
-            
-            # If no match found, destination will be None
-            if not destination:
+            if match:
+                matched_phrase = match.key
+                rule_name = match.name or "Direct mapping"
+                destination_folder = match.dest
+            else:
+                matched_phrase = None
                 destination_folder = "Unmatched"
                 rule_name = "No matching rule"
             
@@ -116,6 +98,9 @@ class PDFTestRunner:
                 'matched_phrase': matched_phrase,
                 'rule_name': rule_name,
                 'destination_folder': destination_folder,
+                'match_offset': match.offset if match else None,
+                'match_page': match.page if match else None,
+                'match_distance': match.distance if match else None,
                 'text_preview': text[:200] + "..." if len(text) > 200 else text,
                 'processing_time_ms': round(processing_time * 1000, 2),
                 'success': True,
@@ -130,6 +115,9 @@ class PDFTestRunner:
                 'matched_phrase': None,
                 'rule_name': None,
                 'destination_folder': None,
+                'match_offset': None,
+                'match_page': None,
+                'match_distance': None,
                 'text_preview': None,
                 'processing_time_ms': round(processing_time * 1000, 2),
                 'success': False,
@@ -183,6 +171,8 @@ class PDFTestRunner:
                         if verbose:
                             print(f"     📝 Rule: {result['rule_name']}")
                             print(f"     🎯 Phrase: '{result['matched_phrase']}'")
+                            if result['match_page']:
+                                print(f"     📄 Page: {result['match_page']}")
                             print(f"     ⏱️  Time: {result['processing_time_ms']}ms")
                     else:
                         print(f"  ❓ {pdf.name:<25} → {result['destination_folder']} (no match)")
@@ -277,11 +267,22 @@ def main():
     parser.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
     parser.add_argument("--save-results", "-s", action="store_true", help="Save results to JSON file")
     parser.add_argument("--no-summary", action="store_true", help="Skip summary report")
+    parser.add_argument("--cache", nargs="?", const="", metavar="PATH",
+                        help="Reuse extracted text from the text cache (default location if no PATH)")
+    parser.add_argument("--preprocess", metavar="STEPS",
+                        help=f"Preprocess OCR images with these comma-separated steps ({', '.join(STEPS)}, or none)")
+    parser.add_argument("--approximate", action="store_true",
+                        help="Let rules with a max_distance match phrases with that many character edits")
     
     args = parser.parse_args()
     
     # Initialize test runner
-    runner = PDFTestRunner()
+    text_cache = TextCache(args.cache or None) if args.cache is not None else None
+    ocr_engine = None
+    if args.preprocess is not None:
+        steps = [step.strip() for step in args.preprocess.split(",") if step.strip() and step.strip() != "none"]
+        ocr_engine = OcrEngine(preprocessor=Preprocessor.from_steps(steps))
+    runner = PDFTestRunner(text_cache=text_cache, ocr_engine=ocr_engine, approximate=args.approximate)
     
     # Run tests
     results = runner.run_tests(mapping_filter=args.mapping, verbose=args.verbose)
@@ -294,6 +295,8 @@ def main():
         print("\n" + "="*60)
         summary = runner.generate_summary_report(results)
         print(summary)
+        if ocr_engine is not None:
+            print(f"\n⏱️ OCR preprocessing per page: {ocr_engine.preprocessor.timing_summary()}")
     
     # Save results if requested
     if args.save_results:
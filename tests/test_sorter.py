@@ -49,5 +49,76 @@ class TestSorter(unittest.TestCase):
         # we print the output. This will be visible when running pytest with the -s flag.
         print(f"\n--- Sorter read the following text ---\n{extracted_text}\n------------------------------------")
 
+    @patch('src.sorter.utils.MappingUtils.load_mapping')
+    @patch('src.sorter.fitz.open')
+    def test_streaming_stops_at_first_matching_page(self, mock_fitz_open, mock_load_mapping):
+        """
+        Tests that streaming mode stops reading once a page matches, including
+        a phrase that is split across a page break.
+        """
+        # --- Arrange ---
+        mock_load_mapping.return_value = {"Terms & Conditions of Employment": {"name": "Contract", "dest": "Contracts"}}
+        pages = [MagicMock() for _ in range(4)]
+        pages[0].get_text.return_value = "Cover letter\nTerms & Conditions\n"
+        pages[1].get_text.return_value = "of Employment\nSalary...\n"
+        pages[2].get_text.return_value = "More text\n"
+        pages[3].get_text.return_value = "Even more text\n"
+        mock_fitz_open.return_value = create_mock_document_context(pages)
+        sorter = Sorter('dummy_mapping.json')
+
+        # --- Act ---
+        rule = sorter.find_destination_streaming('dummy.pdf')
+
+        # --- Assert ---
+        self.assertEqual(rule, {"name": "Contract", "dest": "Contracts"})
+        pages[2].get_text.assert_not_called()
+        pages[3].get_text.assert_not_called()
+
+    @patch('src.sorter.utils.MappingUtils.load_mapping')
+    @patch('src.sorter.fitz.open')
+    def test_max_pages_caps_pages_read(self, mock_fitz_open, mock_load_mapping):
+        """Tests that no more than max_pages pages are read from a document."""
+        mock_load_mapping.return_value = {"keyword": "folder"}
+        pages = [MagicMock() for _ in range(3)]
+        for i, page in enumerate(pages):
+            page.get_text.return_value = f"Text from page {i + 1}. "
+        mock_fitz_open.return_value = create_mock_document_context(pages)
+        sorter = Sorter('dummy_mapping.json')
+
+        self.assertIsNone(sorter.find_destination_streaming('dummy.pdf', max_pages=2))
+        self.assertEqual(sorter.read_pdf_text('dummy.pdf', max_pages=2), "Text from page 1. Text from page 2.")
+        pages[2].get_text.assert_not_called()
+
+    @patch('src.sorter.utils.MappingUtils.load_mapping')
+    @patch('src.sorter.fitz.open')
+    def test_match_result_names_rule_and_page(self, mock_fitz_open, mock_load_mapping):
+        """
+        Tests that match_text reports the matched rule's key, name, dest,
+        offset and page, telling apart two rules with the same destination.
+        """
+        # --- Arrange ---
+        mock_load_mapping.return_value = {
+            "payslip": {"name": "Payslips", "dest": "Payroll"},
+            "p60": {"name": "Year end", "dest": "Payroll"},
+        }
+        pages = [MagicMock() for _ in range(3)]
+        pages[0].get_text.return_value = "Cover sheet for the employee\n"
+        pages[1].get_text.return_value = "Nothing to see\n"
+        pages[2].get_text.return_value = "Your P60 for the year\n"
+        mock_fitz_open.return_value = create_mock_document_context(pages)
+        sorter = Sorter('dummy_mapping.json')
+
+        # --- Act ---
+        match = sorter.match_text(sorter.read_pdf_text('dummy.pdf'))
+        streamed = sorter.match_streaming('dummy.pdf')
+
+        # --- Assert ---
+        self.assertEqual((match.key, match.name, match.dest, match.kind), ("p60", "Year end", "Payroll", "text"))
+        self.assertEqual((match.offset, match.page), (49, 3))
+        self.assertEqual((streamed.index, streamed.page), (1, 3))
+        self.assertIn("'Year end' (keyword 'p60' on page 3)", match.describe())
+        # Plain strings match too, with the page unknown.
+        self.assertIsNone(sorter.match_text("p60").page)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,217 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import fitz
+from src.compiled_mapping import could_change_outcome, mapping_version
+from src.sorter import Sorter, OCR_AVAILABLE
+from src.text_cache import file_digest
+from src.template_index import TemplateIndex, audit_template_dir
+
+if OCR_AVAILABLE:
+    from pytesseract import TesseractNotFoundError
+
+class TestMappingDiff(unittest.TestCase):
+
+    def test_first_match_wins_decides_what_can_change(self):
+        old = {"a": "A", "b": "B", "c": "C"}
+        # Unmatched documents only care about new or edited rules.
+        self.assertFalse(could_change_outcome(old, {"c": "C", "a": "A"}, None))
+        self.assertTrue(could_change_outcome(old, {"a": "A", "b": "B2", "c": "C"}, None))
+        self.assertTrue(could_change_outcome(old, {"a": "A", "b": "B", "c": "C", "d": "D"}, None))
+        # A matched document cares about its own rule and the rules now before it.
+        self.assertFalse(could_change_outcome(old, {"a": "A", "b": "B", "c": "C2", "d": "D"}, "b"))
+        self.assertFalse(could_change_outcome(old, {"b": "B", "c": "C"}, "b"))
+        self.assertTrue(could_change_outcome(old, {"a": "A2", "b": "B", "c": "C"}, "b"))
+        self.assertTrue(could_change_outcome(old, {"a": "A", "c": "C", "b": "B"}, "b"))
+        self.assertTrue(could_change_outcome(old, {"a": "A", "c": "C"}, "b"))
+        self.assertNotEqual(mapping_version(old), mapping_version(old, approximate=True))
+
+class TestTemplateAudit(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.inbox = os.path.join(self.temp_dir, "inbox")
+        os.makedirs(self.inbox)
+        self.mapping_path = os.path.join(self.temp_dir, "archive.json")
+        self._write_mapping({"invoice": "Invoices", "contract": "Contracts"})
+        for name, body in (("inv.pdf", "Invoice number 1001 for services"), ("con.pdf", "Contract of employment terms")):
+            self._write_pdf(os.path.join(self.inbox, name), body)
+
+    def _write_mapping(self, rules):
+        with open(self.mapping_path, "w", encoding="utf-8") as f:
+            json.dump(rules, f)
+
+    def _write_pdf(self, path, body):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with fitz.open() as doc:
+            doc.new_page().insert_text((72, 72), body)
+            doc.save(path)
+
+    def _sorter(self):
+        sorter = Sorter(self.mapping_path)
+        index = TemplateIndex(sorter.template_dir)
+        self.addCleanup(index.close)
+        sorter.template_index = index
+        return sorter, index
+
+    def test_sorted_files_are_indexed_and_not_read_again(self):
+        sorter, index = self._sorter()
+        sorter.sort_files([self.inbox])
+
+        with patch.object(Sorter, "_classify_many", return_value=iter([])) as mock_classify:
+            counts = audit_template_dir(sorter, index)
+
+        self.assertEqual(len(index), 2)
+        self.assertEqual(counts["unchanged"], 2)
+        mock_classify.assert_called_once_with([])
+
+    def test_rule_edit_moves_only_affected_files(self):
+        """After the contract rule's destination changes, only documents it decides are read, and moved."""
+        # --- Arrange ---
+        sorter, index = self._sorter()
+        sorter.sort_files([self.inbox])
+        index.close()
+        # A file dropped into the wrong folder by hand, and one deleted since the sort.
+        self._write_pdf(os.path.join(sorter.template_dir, "Invoices", "stray.pdf"), "Contract of sale terms here")
+        os.remove(os.path.join(sorter.template_dir, "Invoices", "inv.pdf"))
+        self._write_pdf(os.path.join(sorter.template_dir, "Invoices", "inv2.pdf"), "Invoice number 1002 for services")
+        self._write_mapping({"invoice": "Invoices", "contract": "Legal/Contracts"})
+        sorter, index = self._sorter()
+
+        # --- Act ---
+        with patch.object(Sorter, "_classify_many", wraps=sorter._classify_many) as mock_classify:
+            counts = audit_template_dir(sorter, index)
+
+        # --- Assert ---
+        classified = sorted(os.path.basename(path) for path in mock_classify.call_args[0][0])
+        self.assertEqual(classified, ["con.pdf", "inv2.pdf", "stray.pdf"])
+        self.assertEqual((counts["moved"], counts["correct"]), (2, 1))
+        self.assertEqual(sorted(os.listdir(os.path.join(sorter.template_dir, "Legal", "Contracts"))), ["con.pdf", "stray.pdf"])
+        self.assertEqual(len(index), 3)
+        self.assertIsNone(index.get(os.path.join(sorter.template_dir, "Invoices", "inv.pdf")))
+        # Everything is in place now, so a second audit reads nothing.
+        self.assertEqual(audit_template_dir(sorter, index)["unchanged"], 3)
+
+    def test_content_changes_are_detected_by_hash(self):
+        sorter, index = self._sorter()
+        sorter.sort_files([self.inbox])
+        invoice_path = os.path.join(sorter.template_dir, "Invoices", "inv.pdf")
+        contract_path = os.path.join(sorter.template_dir, "Contracts", "con.pdf")
+        # Files moved by a sort are indexed without a hash; give both one.
+        version = index.version_for(sorter.mapping_data)
+        index.record(contract_path, "contract", version, digest=file_digest(contract_path))
+        index.record(invoice_path, "invoice", version, digest=file_digest(invoice_path))
+
+        # Touched, same content: only re-stamped. Rewritten with other content: classified and moved.
+        os.utime(contract_path, ns=(1, 1))
+        self._write_pdf(invoice_path, "Contract of employment, amended terms")
+        with patch.object(Sorter, "_classify_many", wraps=sorter._classify_many) as mock_classify:
+            counts = audit_template_dir(sorter, index)
+
+        self.assertEqual([os.path.basename(path) for path in mock_classify.call_args[0][0]], ["inv.pdf"])
+        self.assertEqual((counts["moved"], counts["unchanged"]), (1, 1))
+        self.assertEqual(index.get(contract_path).mtime_ns, 1)
+
+    @unittest.skipIf(not OCR_AVAILABLE, "Pytesseract or Pillow not installed, skipping OCR tests.")
+    @patch('src.ocr.pytesseract.image_to_string', side_effect=TesseractNotFoundError if OCR_AVAILABLE else None)
+    def test_files_not_read_completely_are_audited_again(self, mock_image_to_string):
+        # --- Arrange ---
+        sorter, index = self._sorter()
+        scan_path = os.path.join(sorter.template_dir, "Letters", "scan.pdf")
+        os.makedirs(os.path.dirname(scan_path))
+        with fitz.open() as doc:
+            doc.new_page().draw_rect(fitz.Rect(72, 72, 300, 120), fill=(0, 0, 0))
+            doc.save(scan_path)
+
+        # --- Act ---
+        first = audit_template_dir(sorter, index)
+        second = audit_template_dir(sorter, index)
+
+        # --- Assert ---
+        self.assertEqual((first["incomplete"], second["incomplete"]), (1, 1))
+        self.assertIsNone(index.get(scan_path))
+        self.assertTrue(os.path.exists(scan_path))
+
+class TestIncrementalSort(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.inbox = os.path.join(self.temp_dir, "inbox")
+        os.makedirs(self.inbox)
+        self.mapping_path = os.path.join(self.temp_dir, "archive.json")
+        for name, body in (("inv.pdf", "Invoice number 1001 for services"), ("alice.pdf", "Letter to Alice about the weather"),
+                           ("bob.pdf", "Letter to Bob about the garden")):
+            with fitz.open() as doc:
+                doc.new_page().insert_text((72, 72), body)
+                doc.save(os.path.join(self.inbox, name))
+
+    def _sort(self, rules, first_page_only=False):
+        """Sorts the inbox with the given rules; returns the names of the documents whose text was read."""
+        with open(self.mapping_path, "w", encoding="utf-8") as f:
+            json.dump(rules, f)
+        sorter = Sorter(self.mapping_path, incremental=True)
+        sorter.template_index = TemplateIndex(sorter.template_dir)
+        self.addCleanup(sorter.template_index.close)
+        read = []
+        def extract_many(paths, **kwargs):
+            for path in paths:
+                read.append(os.path.basename(path))
+                yield path, sorter.read_pdf_text(path)
+        with patch.object(Sorter, "extract_many", side_effect=extract_many):
+            sorter.sort_files([self.inbox], first_page_only=first_page_only)
+        return sorted(read)
+
+    def test_only_documents_a_rule_change_could_affect_are_read(self):
+        """Unmatched documents are read again only once a new or edited rule might match them."""
+        rules = {"invoice": "Invoices", "contract": "Contracts"}
+        self.assertEqual(self._sort(rules), ["alice.pdf", "bob.pdf", "inv.pdf"])
+        # Same mapping, or the same rules reordered: nothing to read.
+        self.assertEqual(self._sort(rules), [])
+        self.assertEqual(self._sort({"contract": "Contracts", "invoice": "Invoices"}), [])
+        # Reading a different number of pages is not the same evaluation.
+        self.assertEqual(self._sort(rules, first_page_only=True), ["alice.pdf", "bob.pdf"])
+
+        self.assertEqual(self._sort({"invoice": "Invoices", "contract": "Contracts", "bob": "Bob"}), ["alice.pdf", "bob.pdf"])
+
+        self.assertEqual(os.listdir(self.inbox), ["alice.pdf"])
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir, "archive_template", "Bob", "bob.pdf")))
+
+    @unittest.skipIf(not OCR_AVAILABLE, "Pytesseract or Pillow not installed, skipping OCR tests.")
+    @patch('src.ocr.pytesseract.image_to_string', side_effect=TesseractNotFoundError if OCR_AVAILABLE else None)
+    def test_documents_not_read_completely_are_not_remembered_as_unmatched(self, mock_image_to_string):
+        """A PDF that cannot be opened, or one whose scanned page could not be OCRed, is read again next time."""
+        # --- Arrange ---
+        with open(os.path.join(self.inbox, "locked.pdf"), "wb") as f:
+            f.write(b"%PDF-1.4 still being written")
+        with fitz.open() as doc:
+            doc.new_page().insert_text((72, 72), "Cover letter for the enclosed scan")
+            doc.new_page().draw_rect(fitz.Rect(72, 72, 300, 120), fill=(0, 0, 0))
+            doc.save(os.path.join(self.inbox, "mixed.pdf"))
+        with open(self.mapping_path, "w", encoding="utf-8") as f:
+            json.dump({"invoice": "Invoices"}, f)
+
+        for stream_pages in (False, True):
+            read = []
+            messages = []
+            for _ in range(2):
+                sorter = Sorter(self.mapping_path, incremental=True, status_callback=messages.append)
+                sorter.template_index = TemplateIndex(sorter.template_dir)
+                self.addCleanup(sorter.template_index.close)
+                with patch.object(Sorter, "_read_pages", autospec=True, side_effect=Sorter._read_pages) as mock_read:
+                    # --- Act ---
+                    sorter.sort_files([self.inbox], stream_pages=stream_pages)
+                read.append(sorted(os.path.basename(call.args[1]) for call in mock_read.call_args_list))
+
+            # --- Assert ---
+            # The unmatched letters, read completely, are skipped the second time.
+            self.assertEqual(read[1], ["locked.pdf", "mixed.pdf"])
+            self.assertNotIn("No match found for: locked.pdf", messages)
+            self.assertIn("Not sorted: mixed.pdf could not be read completely", messages)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import fitz
+from src.ocr import OcrEngine
+from src.sorter import Sorter, OCR_AVAILABLE
+from src.text_cache import TextCache, SOURCE_TEXT, SOURCE_OCR
+
+class TestTextCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = TextCache(os.path.join(self.temp_dir, "cache.sqlite"))
+        self.pdf_path = self._write_file("a.pdf", b"%PDF-1.4 some bytes")
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.temp_dir)
+
+    def _write_file(self, name, content):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def test_round_trip_and_page_coverage(self):
+        """A first-page entry serves first-page reads only; a complete entry serves any read."""
+        self.cache.put_pages(self.pdf_path, [(SOURCE_OCR, "page one")], complete=False, first_page_only=True)
+        self.assertEqual(self.cache.get_pages(self.pdf_path, max_pages=1), [(SOURCE_OCR, "page one")])
+        self.assertIsNone(self.cache.get_pages(self.pdf_path))
+
+        pages = [(SOURCE_OCR, "page one"), (SOURCE_TEXT, "page two")]
+        self.cache.put_pages(self.pdf_path, pages, complete=True)
+        self.assertEqual(self.cache.get_pages(self.pdf_path), pages)
+        self.assertEqual(self.cache.get_pages(self.pdf_path, max_pages=1), pages[:1])
+
+        # A shorter, partial read never replaces a fuller entry.
+        self.cache.put_pages(self.pdf_path, [(SOURCE_OCR, "other")], complete=False, first_page_only=True)
+        self.assertEqual(self.cache.get_pages(self.pdf_path), pages)
+
+    def test_keyed_by_content_with_size_mtime_precheck(self):
+        """Copies share an entry, unchanged files are not re-hashed, and edits miss."""
+        self.cache.put_pages(self.pdf_path, [(SOURCE_TEXT, "hello")], complete=True)
+        copy_path = self._write_file("copy.pdf", b"%PDF-1.4 some bytes")
+        self.assertEqual(self.cache.get_pages(copy_path), [(SOURCE_TEXT, "hello")])
+
+        with patch('src.text_cache.file_digest') as mock_digest:
+            self.cache.get_pages(self.pdf_path)
+        mock_digest.assert_not_called()
+
+        self._write_file("a.pdf", b"%PDF-1.4 changed bytes")
+        self.assertIsNone(self.cache.get_pages(self.pdf_path))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        paths = [self._write_file(f"{i}.pdf", f"file {i}".encode()) for i in range(3)]
+        noise = [(SOURCE_OCR, os.urandom(150).hex())]
+        self.cache.put_pages(paths[0], noise, complete=True)
+        # Room for two entries, but not three.
+        self.cache.max_bytes = self.cache.total_bytes() * 5 // 2
+        self.cache.put_pages(paths[1], noise, complete=True)
+        self.cache.get_pages(paths[0])  # paths[1] is now the least recently used
+        self.cache.put_pages(paths[2], noise, complete=True)
+
+        self.assertIsNotNone(self.cache.get_pages(paths[0]))
+        self.assertIsNone(self.cache.get_pages(paths[1]))
+        self.assertIsNotNone(self.cache.get_pages(paths[2]))
+        self.assertLessEqual(self.cache.total_bytes(), self.cache.max_bytes)
+
+    def test_total_size_is_tracked_across_replacements_and_reopening(self):
+        self.cache.put_pages(self.pdf_path, [(SOURCE_TEXT, "one page")], complete=False)
+        self.cache.put_pages(self.pdf_path, [(SOURCE_TEXT, "one page"), (SOURCE_OCR, "and another")], complete=True)
+        stored = self.cache._conn.execute("SELECT SUM(nbytes) FROM texts").fetchone()[0]
+        self.assertEqual(self.cache.total_bytes(), stored)
+
+        reopened = TextCache(self.cache.db_path)
+        self.addCleanup(reopened.close)
+        self.assertEqual(reopened.total_bytes(), stored)
+
+    def test_ocr_pages_are_only_served_under_their_ocr_settings(self):
+        self.cache.put_pages(self.pdf_path, [(SOURCE_OCR, "scanned")], complete=True, ocr_settings="dpi=300")
+        self.assertEqual(self.cache.get_pages(self.pdf_path, ocr_settings="dpi=300"), [(SOURCE_OCR, "scanned")])
+        self.assertIsNone(self.cache.get_pages(self.pdf_path, ocr_settings="dpi=150,300"))
+
+        # A partial read under the new settings replaces the complete entry it cannot use.
+        self.cache.put_pages(self.pdf_path, [(SOURCE_OCR, "rescanned")], complete=False, first_page_only=True,
+                             ocr_settings="dpi=150,300")
+        self.assertEqual(self.cache.get_pages(self.pdf_path, max_pages=1, ocr_settings="dpi=150,300"),
+                         [(SOURCE_OCR, "rescanned")])
+
+        # Text-layer pages do not depend on OCR settings.
+        copy_path = self._write_file("text.pdf", b"%PDF-1.4 other bytes")
+        self.cache.put_pages(copy_path, [(SOURCE_TEXT, "typed")], complete=True, ocr_settings="dpi=300")
+        self.assertEqual(self.cache.get_pages(copy_path, ocr_settings="anything"), [(SOURCE_TEXT, "typed")])
+
+    @unittest.skipIf(not OCR_AVAILABLE, "Pytesseract or Pillow not installed, skipping OCR tests.")
+    @patch('src.ocr.pytesseract.image_to_data')
+    @patch('src.ocr.pytesseract.image_to_string', return_value="Some OCR text")
+    def test_sorter_caches_ocr_only_when_it_holds_for_any_mapping(self, mock_image_to_string, mock_image_to_data):
+        """Low-DPI OCR kept for matching the mapping is not cached; other settings read the page again."""
+        # --- Arrange ---
+        pdf_path = os.path.join(self.temp_dir, "scan.pdf")
+        with fitz.open() as doc:
+            doc.new_page().draw_rect(fitz.Rect(72, 72, 300, 120), fill=(0, 0, 0))
+            doc.save(pdf_path)
+        mapping_path = os.path.join(self.temp_dir, "mapping.json")
+        with open(mapping_path, "w", encoding="utf-8") as f:
+            f.write('{"ocr text": "ScannedDocs"}')
+        mock_image_to_data.return_value = {"text": ["Some", "OCR", "text"], "conf": [91] * 3,
+                                           "block_num": [1] * 3, "par_num": [1] * 3, "line_num": [1] * 3}
+        adaptive = Sorter(mapping_path, ocr_engine=OcrEngine(adaptive=True, tiers=(150, 300)), text_cache=self.cache)
+
+        # --- Act ---
+        adaptive.read_pdf_text(pdf_path)
+        adaptive.read_pdf_text(pdf_path)
+        for embedded_images in (True, False, False):
+            Sorter(mapping_path, ocr_engine=OcrEngine(embedded_images=embedded_images),
+                   text_cache=self.cache).read_pdf_text(pdf_path)
+
+        # --- Assert ---
+        self.assertEqual(mock_image_to_data.call_count, 2)
+        self.assertEqual(mock_image_to_string.call_count, 2)
+
+    def test_sorter_reads_cached_text_without_opening_pdf(self):
+        """A second read of an unchanged PDF comes from the cache."""
+        pdf_path = os.path.join(self.temp_dir, "text.pdf")
+        with fitz.open() as doc:
+            doc.new_page().insert_text((72, 72), "Employee Questionnaire")
+            doc.new_page().insert_text((72, 72), "Second page text")
+            doc.save(pdf_path)
+        sorter = Sorter(os.path.join(self.temp_dir, "mapping.json"), text_cache=self.cache)
+
+        first = sorter.read_pdf_text(pdf_path)
+        with patch('src.sorter.fitz.open') as mock_fitz_open:
+            second = sorter.read_pdf_text(pdf_path)
+            first_page = sorter.read_pdf_text(pdf_path, first_page_only=True)
+        mock_fitz_open.assert_not_called()
+        self.assertEqual(second, first)
+        self.assertEqual(first_page, "Employee Questionnaire")
+        self.assertIn("Second page text", first)
+
+if __name__ == '__main__':
+    unittest.main()
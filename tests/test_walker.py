@@ -0,0 +1,104 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import fitz
+from src.walker import walk_files
+from src.sorter import Sorter
+
+class TestWalkFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        for relative_path in ("a.pdf", "notes.txt", "B.PDF", "sub/c.pdf", "sub/deeper/d.pdf", "sub/drafts/e.pdf", "skip/f.pdf"):
+            path = os.path.join(self.root, *relative_path.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(b"%PDF-1.4")
+
+    def _walk(self, **kwargs):
+        return sorted(os.path.relpath(path, self.root).replace(os.sep, "/") for path in walk_files(self.root, **kwargs))
+
+    def test_recursive_and_top_level(self):
+        self.assertEqual(self._walk(), ["B.PDF", "a.pdf", "skip/f.pdf", "sub/c.pdf", "sub/deeper/d.pdf", "sub/drafts/e.pdf"])
+        self.assertEqual(self._walk(recursive=False), ["B.PDF", "a.pdf"])
+
+    def test_globs_and_skipped_folders(self):
+        """Exclude globs match names or relative paths; excluded and skipped folders are not entered."""
+        walked = self._walk(include=["*.pdf", "*.txt"], exclude=["drafts", "sub/deeper/*"],
+                            skip_dirs=[os.path.join(self.root, "skip")])
+        self.assertEqual(walked, ["B.PDF", "a.pdf", "notes.txt", "sub/c.pdf"])
+
+    @unittest.skipUnless(hasattr(os, "symlink"), "needs symlinks")
+    def test_symlink_loops_are_walked_once(self):
+        try:
+            os.symlink(self.root, os.path.join(self.root, "sub", "loop"), target_is_directory=True)
+        except OSError:
+            self.skipTest("cannot create symlinks here")
+        self.assertEqual(self._walk().count("sub/c.pdf"), 1)
+        self.assertEqual(len(self._walk()), 6)
+
+    def test_yields_before_the_walk_finishes(self):
+        walk = walk_files(self.root, recursive=True)
+        first = next(walk)
+        # Only the root has been listed so far.
+        self.assertEqual(os.path.dirname(first), self.root)
+
+class TestDeepAudit(unittest.TestCase):
+
+    def test_sorts_subfolders_but_not_the_template_folder(self):
+        # --- Arrange ---
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        mapping_path = os.path.join(temp_dir, "mapping.json")
+        with open(mapping_path, "w", encoding="utf-8") as f:
+            json.dump({"invoice": {"name": "Invoices", "dest": "Invoices"}}, f)
+        sorter = Sorter(mapping_path)
+        # The template folder sits inside the folder being sorted.
+        for folder, name in ((temp_dir, "top.pdf"), (os.path.join(temp_dir, "2023", "q1"), "nested.pdf"),
+                             (os.path.join(sorter.template_dir, "Invoices"), "sorted.pdf")):
+            os.makedirs(folder, exist_ok=True)
+            with fitz.open() as doc:
+                doc.new_page().insert_text((72, 72), "Invoice number 1001 for services")
+                doc.save(os.path.join(folder, name))
+        messages = []
+        sorter.status_callback = messages.append
+
+        # --- Act ---
+        sorter.sort_files([temp_dir], deep_audit=True)
+
+        # --- Assert ---
+        self.assertEqual(sorted(os.listdir(os.path.join(sorter.template_dir, "Invoices"))), ["nested.pdf", "sorted.pdf", "top.pdf"])
+        self.assertIn("Sort complete. Scanned: 2, Moved: 2", messages)
+
+    def test_same_named_files_from_different_folders_are_not_overwritten(self):
+        # --- Arrange ---
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        mapping_path = os.path.join(temp_dir, "mapping.json")
+        with open(mapping_path, "w", encoding="utf-8") as f:
+            json.dump({"invoice": {"name": "Invoices", "dest": "Invoices"}}, f)
+        inbox = os.path.join(temp_dir, "in")
+        for year in ("2023", "2024"):
+            os.makedirs(os.path.join(inbox, year))
+            with fitz.open() as doc:
+                doc.new_page().insert_text((72, 72), f"Invoice number 1001 for services in {year}")
+                doc.save(os.path.join(inbox, year, "scan001.pdf"))
+        sorter = Sorter(mapping_path)
+        messages = []
+        sorter.status_callback = messages.append
+
+        # --- Act ---
+        sorter.sort_files([inbox], deep_audit=True)
+
+        # --- Assert ---
+        self.assertEqual(os.listdir(os.path.join(sorter.template_dir, "Invoices")), ["scan001.pdf"])
+        left = [year for year in ("2023", "2024") if os.path.exists(os.path.join(inbox, year, "scan001.pdf"))]
+        self.assertEqual(len(left), 1)
+        self.assertIn("Sort complete. Scanned: 2, Moved: 1", messages)
+        self.assertIn("Not moved: scan001.pdf -> Invoices, a file of that name is already there", messages)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import fitz
+from src.sorter import Sorter
+from src.watcher import FolderWatcher, ends_like_a_pdf
+
+class TestFolderWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.inbox = os.path.join(self.temp_dir, "inbox")
+        os.makedirs(self.inbox)
+        self.mapping_path = os.path.join(self.temp_dir, "hot.json")
+        with open(self.mapping_path, "w", encoding="utf-8") as f:
+            json.dump({"invoice": {"name": "Invoices", "dest": "Invoices"}}, f)
+        self.sorter = Sorter(self.mapping_path)
+
+    def _pdf_bytes(self, body):
+        with fitz.open() as doc:
+            doc.new_page().insert_text((72, 72), body)
+            return doc.tobytes()
+
+    def _write(self, name, data):
+        path = os.path.join(self.inbox, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_partial_writes_are_held_back(self):
+        """A file is ready once it stops changing and ends like a PDF, or after max_wait without the marker."""
+        # --- Arrange ---
+        data = self._pdf_bytes("Invoice number 1001 for services")
+        folder_watcher = FolderWatcher(self.sorter, [self.inbox], settle_seconds=1.0, max_wait=10.0)
+        partial = self._write("partial.pdf", data[: len(data) // 2])
+        complete = self._write("complete.pdf", data)
+        folder_watcher.scan()
+        now = time.monotonic()
+
+        # --- Act & Assert ---
+        self.assertFalse(ends_like_a_pdf(partial, os.path.getsize(partial)))
+        self.assertTrue(ends_like_a_pdf(complete, os.path.getsize(complete)))
+        self.assertEqual(folder_watcher.ready_files(now), [])
+        self.assertEqual(folder_watcher.ready_files(now + 2), [complete])
+
+        # Still growing: the wait starts again.
+        with open(partial, "ab") as f:
+            f.write(b"more")
+        self.assertNotIn(partial, folder_watcher.ready_files(now + 5))
+        self.assertIn(partial, folder_watcher.ready_files(now + 20))
+
+    def test_sorts_new_files_and_does_not_retry_unmatched_ones(self):
+        # --- Arrange ---
+        folder_watcher = FolderWatcher(self.sorter, [self.inbox], settle_seconds=0.1, poll_interval=0.05)
+        thread = threading.Thread(target=folder_watcher.run, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(folder_watcher.stop)
+        sorted_path = os.path.join(self.sorter.template_dir, "Invoices", "scan1.pdf")
+
+        # --- Act ---
+        self._write("scan1.pdf", self._pdf_bytes("Invoice number 1001 for services"))
+        self._write("letter.pdf", self._pdf_bytes("A letter about nothing in particular"))
+        deadline = time.monotonic() + 10
+        while not os.path.exists(sorted_path) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        batches = folder_watcher.sorted_batches
+        time.sleep(0.5)
+
+        # --- Assert ---
+        self.assertTrue(os.path.exists(sorted_path))
+        self.assertTrue(os.path.exists(os.path.join(self.inbox, "letter.pdf")))
+        self.assertEqual(folder_watcher.sorted_batches, batches)
+
+    def test_mapping_edits_are_picked_up(self):
+        folder_watcher = FolderWatcher(self.sorter, [self.inbox], settle_seconds=0.0)
+        letter = self._write("letter.pdf", self._pdf_bytes("A letter about nothing in particular"))
+        folder_watcher.scan()
+        folder_watcher.sort(folder_watcher.ready_files(time.monotonic()))
+
+        with open(self.mapping_path, "w", encoding="utf-8") as f:
+            json.dump({"letter": {"name": "Letters", "dest": "Letters"}}, f)
+        os.utime(self.mapping_path, ns=(1, 1))
+        folder_watcher._reload_mapping_if_changed()
+        folder_watcher.scan()
+        folder_watcher.sort(folder_watcher.ready_files(time.monotonic()))
+
+        self.assertFalse(os.path.exists(letter))
+        self.assertTrue(os.path.exists(os.path.join(self.sorter.template_dir, "Letters", "letter.pdf")))
+
+if __name__ == '__main__':
+    unittest.main()